@@ -3,74 +3,253 @@ AI Emotion Detection and Conversation System
 Main Flask application that handles real-time emotion detection and AI conversations
 """
 
-import cv2
-import numpy as np
-import base64
-import io
-from flask import Flask, render_template, request, jsonify
+import time
+_startup_started = time.perf_counter()  # start of the startup report's 'imports' phase
+
+from flask import Flask, Response, render_template, request, jsonify, redirect, abort, make_response
 from flask_socketio import SocketIO, emit
-import google.generativeai as genai
 import os
 from dotenv import load_dotenv
 from emotion_detector import EmotionDetector
+from emotion_backends import create_backend
 from face_analyzer import FaceAnalyzer
-import json
+from frame_pipeline import FramePipeline, FaceTracker, SceneCache, serialize_faces
+from frame_scheduler import FrameScheduler
+from inference_executor import InferenceExecutor
+from conversation_ai import EmotionConversationAI
+from response_cache import ResponseCache
+from llm_gateway import LLMGateway, GeminiBackend, StubBackend, CircuitBreaker
+from emotion_history import SessionHistories
+from session_store import RedisSessionHistories, SessionOwners, ThreadedRedisManager, connect_redis
+from history_store import HistoryStore
+from payload_codec import PayloadEncoder
+from load_controller import LoadController
+from mjpeg_stream import MjpegBroadcaster, BOUNDARY
+from metrics import MetricsRegistry, SamplingProfiler, StageTimer, resident_memory_bytes
+import atexit
+import hmac
+import re
 from datetime import datetime
 import threading
-import time
+import queue
+from urllib.parse import urlencode
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
-socketio = SocketIO(app, cors_allowed_origins="*")
+
+# Multi-worker mode (see launcher.py): with REDIS_URL set, Socket.IO events
+# reach clients connected to any worker and session histories are shared;
+# WORKER_ID names this worker for sticky routing
+REDIS_URL = os.getenv('REDIS_URL')
+WORKER_ID = os.getenv('WORKER_ID')
+socketio_options = {'cors_allowed_origins': "*"}
+if REDIS_URL:
+    socketio_options['client_manager'] = ThreadedRedisManager(REDIS_URL)
+socketio = SocketIO(app, **socketio_options)
+
+# Prometheus metrics at /metrics; with ENABLE_PROFILER=1 a sampling profiler
+# can be started and stopped at /api/profiler while the server runs
+metrics = MetricsRegistry(namespace='emotion_ai')
+frame_stage_seconds = metrics.histogram(
+    'frame_stage_seconds', "Time spent in each stage of processing a video frame", ['stage'])
+frame_seconds = metrics.histogram('frame_seconds', "Total time to process a video frame")
+frame_errors = metrics.counter('frame_errors_total', "Video frames that failed to process")
+chat_stage_seconds = metrics.histogram(
+    'chat_stage_seconds', "Time spent in each stage of answering a chat message", ['path', 'stage'])
+chat_seconds = metrics.histogram('chat_seconds', "Total time to answer a chat message", ['path'])
+llm_call_seconds = metrics.histogram(
+    'llm_call_seconds', "Duration of language model backend calls", ['mode', 'outcome'])
+ENABLE_PROFILER = os.getenv('ENABLE_PROFILER', '0') == '1'
+profiler = SamplingProfiler(interval=float(os.getenv('PROFILER_INTERVAL', '0.005')))
+
+# Duration of each startup phase, reported once the server is warmed up
+startup_timer = StageTimer(started=_startup_started)
+startup_timer.mark('imports')
+startup_seconds = metrics.gauge('startup_seconds', "Time spent in each startup phase", ['phase'])
+
+# Emotion classifier: simulated, or an ONNX model run with cv2.dnn when
+# EMOTION_MODEL_PATH is set (EMOTION_MODEL_QUANTIZED_PATH is preferred if it loads)
+EMOTION_BACKEND = None
+if os.getenv('EMOTION_MODEL_PATH'):
+    EMOTION_BACKEND = {
+        'model_path': os.getenv('EMOTION_MODEL_PATH'),
+        'quantized_model_path': os.getenv('EMOTION_MODEL_QUANTIZED_PATH'),
+        'threads': int(os.getenv('EMOTION_MODEL_THREADS', '1')),
+        'batch_size': int(os.getenv('EMOTION_MODEL_BATCH_SIZE', '32'))
+    }
 
 # Initialize components
-emotion_detector = EmotionDetector()
+emotion_detector = EmotionDetector(backend=create_backend(EMOTION_BACKEND))
 face_analyzer = FaceAnalyzer()
+FACE_DETECT_SCALE = float(os.getenv('FACE_DETECT_SCALE', '0.5'))
+frame_pipeline = FramePipeline(emotion_detector, face_analyzer, detect_scale=FACE_DETECT_SCALE)
 
-# Configure Gemini API
-genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
-model = genai.GenerativeModel('gemma-2-27b-it')
+# Language model backend ('gemini', or 'stub' for offline testing) behind a
+# gateway with bounded concurrency, deadlines and a circuit breaker
+if os.getenv('LLM_BACKEND', 'gemini') == 'stub':
+    llm_backend = StubBackend(latency=float(os.getenv('STUB_LLM_LATENCY', '0.5')))
+else:
+    llm_backend = GeminiBackend('gemma-2-27b-it', api_key=os.getenv('GEMINI_API_KEY'))
+llm_gateway = LLMGateway(
+    llm_backend,
+    max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', '4')),
+    timeout=float(os.getenv('LLM_TIMEOUT', '20')),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.getenv('LLM_BREAKER_THRESHOLD', '5')),
+        reset_timeout=float(os.getenv('LLM_BREAKER_RESET', '30'))
+    ),
+    sleep=socketio.sleep,
+    latency_histogram=llm_call_seconds
+)
 
-# Store conversation history and emotion data
-conversation_history = []
-emotion_data = []
+# Conversation history and emotion data per session, bounded in size; in
+# Redis when several workers share sessions, expiring SESSION_TTL seconds
+# after the last write
+if REDIS_URL:
+    redis_client = connect_redis(REDIS_URL)
+    session_histories = RedisSessionHistories(
+        redis_client,
+        capacity=int(os.getenv('EMOTION_HISTORY_CAPACITY', '3000')),
+        conversation_capacity=int(os.getenv('CONVERSATION_HISTORY_CAPACITY', '200')),
+        ttl=int(os.getenv('SESSION_TTL', '3600'))
+    )
+    session_owners = SessionOwners(redis_client, WORKER_ID or str(os.getpid()))
+else:
+    session_histories = SessionHistories(
+        capacity=int(os.getenv('EMOTION_HISTORY_CAPACITY', '3000')),
+        conversation_capacity=int(os.getenv('CONVERSATION_HISTORY_CAPACITY', '200'))
+    )
+    session_owners = None
 
-class EmotionConversationAI:
-    def __init__(self):
-        self.current_emotion = "neutral"
-        self.emotion_intensity = 0.5
-        
-    def generate_response(self, user_message, emotion, intensity):
-        """Generate contextual response based on user emotion and message"""
-        try:
-            # Create emotion-aware prompt
-            emotion_context = f"""
-            You are an empathetic AI assistant. The user's current emotion is {emotion} with intensity {intensity:.2f}.
-            
-            Guidelines for responding:
-            - If emotion is 'happy' or 'joy': Be enthusiastic and positive
-            - If emotion is 'sad' or 'angry': Be supportive and understanding
-            - If emotion is 'fear' or 'surprise': Be reassuring and calm
-            - If emotion is 'disgust': Be neutral and redirect positively
-            - If emotion is 'neutral': Be balanced and engaging
-            
-            User message: {user_message}
-            
-            Respond appropriately to their emotion and message. Keep responses concise but meaningful.
-            """
-            
-            response = model.generate_content(emotion_context)
-            return response.text
-            
-        except Exception as e:
-            print(f"Error generating response: {e}")
-            return "I understand your feelings. How can I help you today?"
+# Socket.IO sessions connected to this worker. A frame still being
+# analysed when its client disconnects must not re-create the session's
+# state after handle_disconnect dropped it.
+connected_sessions = set()
+
+# Client session of each connection: the id the client sends on connect
+# (kept in the browser's localStorage), so its history and annotated stream
+# can be found again after reconnects, which change the Socket.IO sid.
+# Connections without a valid id use the sid.
+SESSION_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{8,64}')
+client_sessions = {}
+
+# Detect-then-track state per Socket.IO session
+face_trackers = {}
+FACE_DETECT_INTERVAL = int(os.getenv('FACE_DETECT_INTERVAL', '5'))
+
+# Near-identical frames reuse the last result for up to SCENE_MAX_REUSE_AGE
+# seconds; SCENE_DIFF_THRESHOLD is the mean thumbnail difference in grey
+# levels below which a frame counts as unchanged (0 disables reuse)
+SCENE_DIFF_THRESHOLD = float(os.getenv('SCENE_DIFF_THRESHOLD', '2.0'))
+SCENE_CELL_THRESHOLD = float(os.getenv('SCENE_CELL_THRESHOLD', '12.0'))
+SCENE_MAX_REUSE_AGE = float(os.getenv('SCENE_MAX_REUSE_AGE', '1.0'))
+
+def create_face_tracker():
+    """Per-session tracker, with a scene cache unless reuse is disabled"""
+    scene_cache = None
+    if SCENE_DIFF_THRESHOLD > 0:
+        scene_cache = SceneCache(SCENE_DIFF_THRESHOLD, SCENE_CELL_THRESHOLD, SCENE_MAX_REUSE_AGE)
+    return FaceTracker(detect_interval=FACE_DETECT_INTERVAL, scene_cache=scene_cache)
+
+# Latest-frame-wins scheduling of incoming video frames per session
+frame_scheduler = FrameScheduler()
+
+# Sessions that asked for the compact emotion_detected format; landmarks
+# moving less than this many pixels since the last send are not resent
+payload_encoders = {}
+LANDMARK_DELTA_THRESHOLD = float(os.getenv('LANDMARK_DELTA_THRESHOLD', '1.0'))
+
+# Frames are decoded straight to grayscale at 1/n resolution (1, 2, 4 or 8)
+FRAME_DECODE_REDUCTION = int(os.getenv('FRAME_DECODE_REDUCTION', '1'))
+
+# Frame decoding and analysis run off the event loop ('inline', 'thread' or 'process')
+inference_executor = InferenceExecutor(
+    mode=os.getenv('INFERENCE_EXECUTOR', 'thread'),
+    workers=int(os.getenv('INFERENCE_WORKERS', '0')) or None,
+    detect_scale=FACE_DETECT_SCALE,
+    sleep=socketio.sleep,
+    pipeline=frame_pipeline,
+    emotion_backend=EMOTION_BACKEND
+)
+
+# Annotated feeds at /stream/<session id>.mjpg, rendered only while watched.
+# They show users' webcams, so they are only served with MJPEG_STREAM_TOKEN
+# set, and every stream URL must carry it as ?token=
+MJPEG_QUALITY = int(os.getenv('MJPEG_QUALITY', '70'))
+MJPEG_STREAM_TOKEN = os.getenv('MJPEG_STREAM_TOKEN')
+mjpeg_broadcaster = MjpegBroadcaster(sleep=socketio.sleep)
+
+# Capture rate, size and JPEG quality pushed to each client, lowered as
+# processing latency and queue depth grow (ADAPTIVE_CAPTURE=0 to disable)
+ADAPTIVE_CAPTURE = os.getenv('ADAPTIVE_CAPTURE', '1') == '1'
+load_controller = LoadController(
+    workers=1 if inference_executor.mode == 'inline' else inference_executor.workers,
+    cooldown=float(os.getenv('CAPTURE_ADJUST_COOLDOWN', '2.0'))
+)
+
+# Durable emotion/chat history (SQLite in WAL mode); set HISTORY_DB_PATH to '' to disable
+HISTORY_DB_PATH = os.getenv('HISTORY_DB_PATH', 'emotion_history.db')
+history_store = HistoryStore(HISTORY_DB_PATH) if HISTORY_DB_PATH else None
+# Largest page_size the history endpoints accept
+HISTORY_MAX_PAGE_SIZE = int(os.getenv('HISTORY_MAX_PAGE_SIZE', '1000'))
+if history_store is not None:
+    atexit.register(history_store.close)
+
+# Cache of responses to repeated short messages per emotion and intensity bucket
+response_cache = ResponseCache(
+    max_size=int(os.getenv('RESPONSE_CACHE_SIZE', '256')),
+    ttl=float(os.getenv('RESPONSE_CACHE_TTL', '600')),
+    path=os.getenv('RESPONSE_CACHE_PATH')
+)
+atexit.register(response_cache.save)
 
 # Initialize AI conversation system
-ai_conversation = EmotionConversationAI()
+ai_conversation = EmotionConversationAI(llm_gateway, response_cache, stage_histogram=chat_stage_seconds)
+
+# Cancellation flag of the chat response currently streaming to each session
+chat_streams = {}
+
+# Queue depths, sessions and counters the components keep, read on each scrape
+metrics.gauge('active_sessions', "Sessions sending video frames", function=lambda: len(face_trackers))
+metrics.gauge('frames_pending', "Sessions with a video frame waiting to be processed",
+              function=frame_scheduler.pending_count)
+metrics.gauge('chat_streams_active', "Chat responses currently streaming", function=lambda: len(chat_streams))
+metrics.gauge('mjpeg_viewers', "Connected MJPEG stream viewers",
+              function=lambda: mjpeg_broadcaster.get_stats()['viewers'])
+metrics.gauge('llm_in_flight', "Language model backend calls running",
+              function=lambda: llm_gateway.get_stats()['in_flight'])
+metrics.gauge('process_resident_memory_bytes', "Resident memory of this server process",
+              function=resident_memory_bytes)
+metrics.gauge('history_write_queue', "Durable history writes waiting for the writer thread",
+              function=lambda: history_store.get_stats()['queued'] if history_store is not None else 0)
+for key in ('received', 'dropped', 'processed'):
+    metrics.counter(f'frames_{key}_total', f"Video frames {key}",
+                    function=lambda key=key: frame_scheduler.get_stats()[key])
+for key in ('calls', 'succeeded', 'failed', 'timeouts', 'rejected', 'coalesced', 'cancelled'):
+    metrics.counter(f'llm_{key}_total', f"Language model gateway calls: {key}",
+                    function=lambda key=key: llm_gateway.get_stats()[key])
+
+startup_timer.mark('components')
+
+def warm_up():
+    """Load the models and run one dummy inference in every inference worker
+    (or the inline pipeline), then print the startup report
+
+    Runs before the server accepts traffic when app.py is started directly;
+    other servers should call it from their startup hook. WARM_UP=0 skips
+    the dummy inference.
+    """
+    if os.getenv('WARM_UP', '1') == '1':
+        inference_executor.warm_up()
+        startup_timer.mark('warm_up')
+    
+    for phase, seconds in startup_timer.timings.items():
+        startup_seconds.set(seconds, phase=phase)
+    phases = ', '.join(f"{phase} {seconds:.2f}s" for phase, seconds in startup_timer.timings.items())
+    print(f"Startup: {phases} (total {sum(startup_timer.timings.values()):.2f}s)")
 
 @app.route('/')
 def index():
@@ -84,11 +263,15 @@ def chat():
         user_message = data.get('message', '')
         current_emotion = data.get('emotion', 'neutral')
         emotion_intensity = data.get('intensity', 0.5)
+        # Turns without a session_id are answered but not stored, rather
+        # than mixing every such client into one shared history
+        session = data.get('session_id')
         
         # Generate AI response
-        ai_response = ai_conversation.generate_response(
-            user_message, current_emotion, emotion_intensity
-        )
+        with chat_seconds.time(path='generate'):
+            ai_response = ai_conversation.generate_response(
+                user_message, current_emotion, emotion_intensity
+            )
         
         # Store conversation
         conversation_entry = {
@@ -98,7 +281,11 @@ def chat():
             'emotion': current_emotion,
             'intensity': emotion_intensity
         }
-        conversation_history.append(conversation_entry)
+        if session:
+            session_histories.conversation(session).append(conversation_entry)
+            if history_store is not None:
+                history_store.record_chat(session, time.time(), user_message, ai_response,
+                                          current_emotion, emotion_intensity)
         
         return jsonify({
             'response': ai_response,
@@ -110,18 +297,175 @@ def chat():
         print(f"Chat error: {e}")
         return jsonify({'error': 'Failed to process message'}), 500
 
+@socketio.on('chat_message')
+def handle_chat_message(data):
+    """Stream an emotion-aware response back chunk by chunk"""
+    sid = request.sid
+    
+    # A new message cancels the response still streaming to this session
+    previous = chat_streams.get(sid)
+    if previous is not None:
+        previous.set()
+    cancel_event = threading.Event()
+    chat_streams[sid] = cancel_event
+    
+    socketio.start_background_task(stream_chat_response, sid, data, cancel_event)
+
+def stream_chat_response(sid, data, cancel_event):
+    """Emit chat_chunk events as the model produces text, then chat_done"""
+    request_id = data.get('request_id')
+    user_message = data.get('message', '')
+    current_emotion = data.get('emotion', 'neutral')
+    emotion_intensity = data.get('intensity', 0.5)
+    started = time.perf_counter()
+    
+    # The model client blocks while waiting for chunks, so read them in a
+    # thread and hand them over through a queue
+    chunks = queue.Queue()
+    def read_chunks():
+        try:
+            for text in ai_conversation.stream_response(
+                    user_message, current_emotion, emotion_intensity, cancel_event):
+                chunks.put(text)
+        finally:
+            chunks.put(None)
+    threading.Thread(target=read_chunks, daemon=True).start()
+    
+    parts = []
+    while True:
+        try:
+            text = chunks.get_nowait()
+        except queue.Empty:
+            socketio.sleep(0.01)
+            continue
+        if text is None:
+            break
+        if cancel_event.is_set():
+            continue
+        parts.append(text)
+        socketio.emit('chat_chunk', {'request_id': request_id, 'text': text}, to=sid)
+    
+    if chat_streams.get(sid) is cancel_event:
+        del chat_streams[sid]
+    
+    ai_response = ''.join(parts)
+    cancelled = cancel_event.is_set()
+    chat_seconds.observe(time.perf_counter() - started, path='stream')
+    if not cancelled:
+        session = client_sessions.get(sid, sid)
+        session_histories.conversation(session).append({
+            'timestamp': datetime.now().isoformat(),
+            'user_message': user_message,
+            'ai_response': ai_response,
+            'emotion': current_emotion,
+            'intensity': emotion_intensity
+        })
+        if history_store is not None:
+            history_store.record_chat(session, time.time(), user_message, ai_response,
+                                      current_emotion, emotion_intensity)
+    
+    socketio.emit('chat_done', {
+        'request_id': request_id,
+        'response': ai_response,
+        'emotion': current_emotion,
+        'intensity': emotion_intensity,
+        'cancelled': cancelled
+    }, to=sid)
+
+@socketio.on('connect')
+def handle_connect(auth=None):
+    """Tell a new client how to capture frames
+
+    ``auth`` may carry the client's ``session_id``, under which its
+    histories and annotated stream are kept.
+    """
+    connected_sessions.add(request.sid)
+    session = (auth or {}).get('session_id')
+    if isinstance(session, str) and SESSION_ID_PATTERN.fullmatch(session):
+        client_sessions[request.sid] = session
+    if session_owners is not None:
+        session_owners.claim(client_sessions.get(request.sid, request.sid))
+    if ADAPTIVE_CAPTURE:
+        emit('capture_settings', load_controller.settings(request.sid))
+
+@socketio.on('set_stream_options')
+def handle_stream_options(data):
+    """Choose the emotion_detected format for this session
+
+    ``format: 'compact'`` switches to PayloadEncoder payloads, where
+    ``landmarks: false`` sends only face rects and scores; any other
+    format returns to the JSON format.
+    """
+    if data.get('format') == 'compact':
+        payload_encoders[request.sid] = PayloadEncoder(
+            include_landmarks=bool(data.get('landmarks', True)),
+            landmark_threshold=LANDMARK_DELTA_THRESHOLD
+        )
+    else:
+        payload_encoders.pop(request.sid, None)
+
 @socketio.on('video_frame')
 def handle_video_frame(data):
+    """Queue video frames for emotion detection, newest frame wins"""
+    sid = request.sid
+    if frame_scheduler.submit(sid, data):
+        socketio.start_background_task(process_frames, sid)
+
+def process_frames(sid):
+    """Process a session's frames until none is pending"""
+    while True:
+        data = frame_scheduler.next_frame(sid)
+        if data is None:
+            break
+        
+        started = time.perf_counter()
+        process_video_frame(sid, data)
+        if sid not in connected_sessions:
+            # The client left while its frame was analysed; next_frame finds
+            # nothing pending and ends this worker
+            continue
+        frame_scheduler.mark_processed(sid)
+        
+        if ADAPTIVE_CAPTURE:
+            settings = load_controller.record(
+                sid, time.perf_counter() - started, len(face_trackers), frame_scheduler.pending_count()
+            )
+            if settings is not None:
+                socketio.emit('capture_settings', settings, to=sid)
+        
+        # Give the client credit to send its next frame; a frame_id the
+        # client sent is echoed so it can match acks to frames
+        ack = frame_scheduler.get_stats(sid)
+        if 'frame_id' in data:
+            ack['frame_id'] = data['frame_id']
+        socketio.emit('frame_ack', ack, to=sid)
+        
+        # Let queued events run so stale frames get replaced
+        socketio.sleep(0)
+
+def process_video_frame(sid, data):
     """Process video frames for emotion detection"""
+    timer = StageTimer(frame_stage_seconds)
     try:
-        # Decode base64 image
-        image_data = base64.b64decode(data['image'].split(',')[1])
-        nparr = np.frombuffer(image_data, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        tracker = face_trackers.get(sid)
+        if tracker is None:
+            tracker = create_face_tracker()
         
-        # Detect emotions and analyze face
-        emotions = emotion_detector.detect_emotions(frame)
-        face_landmarks = face_analyzer.analyze_face(frame)
+        # Decode the JPEG (binary, or a legacy base64 data URL) to grayscale,
+        # detect faces once (or track them), then detect emotions and analyze
+        # faces, all in the inference executor. The client may also have
+        # downscaled the frame before sending it.
+        result, tracker = inference_executor.analyze(
+            data['image'], tracker, FRAME_DECODE_REDUCTION, float(data.get('scale', 1.0))
+        )
+        if sid not in connected_sessions:
+            return
+        face_trackers[sid] = tracker
+        # Stages timed in the worker; what is left is queueing and transfer
+        timer.add(result.timings)
+        timer.mark('executor')
+        emotions = result.emotions
+        face_landmarks = result.landmarks_data
         
         # Get dominant emotion
         if emotions:
@@ -129,59 +473,283 @@ def handle_video_frame(data):
             emotion_name = dominant_emotion[0]
             emotion_confidence = float(dominant_emotion[1])  # Convert to Python float
             
-            # Convert emotions to JSON-serializable format
-            serializable_emotions = {k: float(v) for k, v in emotions.items()}
+            # Store emotion data; the durable store only queues the write
+            now = time.time()
+            session = client_sessions.get(sid, sid)
+            session_histories.emotions(session).append(now, emotions)
+            if history_store is not None:
+                history_store.record_emotion(session, now, emotions)
+            timer.mark('history')
             
-            # Convert face landmarks to JSON-serializable format
-            serializable_landmarks = []
-            if face_landmarks:
-                for face_data in face_landmarks:
-                    serializable_face = {}
-                    if 'landmarks' in face_data:
-                        serializable_face['landmarks'] = [
-                            {'x': float(landmark['x']), 'y': float(landmark['y'])} 
-                            for landmark in face_data['landmarks']
-                        ]
-                    if 'face_rect' in face_data:
-                        x, y, w, h = face_data['face_rect']
-                        serializable_face['face_rect'] = [int(x), int(y), int(w), int(h)]
-                    if 'emotion_features' in face_data:
-                        serializable_face['emotion_features'] = {
-                            k: float(v) for k, v in face_data['emotion_features'].items()
-                        }
-                    serializable_landmarks.append(serializable_face)
+            # Encode the annotated frame once for all MJPEG viewers, if any
+            if mjpeg_broadcaster.has_viewers(session):
+                mjpeg_broadcaster.publish(session, inference_executor.render(
+                    data['image'], face_landmarks, emotions, float(data.get('scale', 1.0)), MJPEG_QUALITY
+                ))
+                timer.mark('render')
             
-            # Store emotion data
-            emotion_entry = {
-                'timestamp': datetime.now().isoformat(),
-                'emotion': emotion_name,
-                'confidence': emotion_confidence,
-                'all_emotions': serializable_emotions
-            }
-            emotion_data.append(emotion_entry)
+            # Emit results to frontend, compact if the client asked for it
+            encoder = payload_encoders.get(sid)
+            if encoder is not None:
+                payload = encoder.encode(emotions, face_landmarks, result.face_emotions,
+                                         data.get('frame_id'))
+            else:
+                # Convert emotions and face landmarks to JSON-serializable format
+                serializable_emotions = {k: float(v) for k, v in emotions.items()}
+                serializable_landmarks = serialize_faces(face_landmarks, result.face_emotions)
+                payload = {
+                    'emotion': emotion_name,
+                    'confidence': emotion_confidence,
+                    'all_emotions': serializable_emotions,
+                    'face_landmarks': serializable_landmarks
+                }
+                if 'frame_id' in data:
+                    payload['frame_id'] = data['frame_id']
+            timer.mark('serialize')
             
-            # Emit results to frontend
-            emit('emotion_detected', {
-                'emotion': emotion_name,
-                'confidence': emotion_confidence,
-                'all_emotions': serializable_emotions,
-                'face_landmarks': serializable_landmarks
-            })
+            socketio.emit('emotion_detected', payload, to=sid)
+            timer.mark('emit')
+        
+        frame_seconds.observe(timer.elapsed())
             
     except Exception as e:
-        print(f"Video frame processing error: {e}")
-        emit('error', {'message': 'Failed to process video frame'})
+        frame_errors.inc()
+        print(f"Video frame processing error: {e!r}")
+        socketio.emit('error', {'message': 'Failed to process video frame'}, to=sid)
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    """Drop per-session state when a client goes away"""
+    connected_sessions.discard(request.sid)
+    face_trackers.pop(request.sid, None)
+    payload_encoders.pop(request.sid, None)
+    frame_scheduler.remove_session(request.sid)
+    load_controller.remove_session(request.sid)
+    
+    cancel_event = chat_streams.pop(request.sid, None)
+    if cancel_event is not None:
+        cancel_event.set()
+    
+    # The durable store keeps the history; the live one and the stream go
+    # with the session's last connection to this worker
+    session = client_sessions.pop(request.sid, request.sid)
+    if session not in client_sessions.values():
+        session_histories.remove(session)
+        mjpeg_broadcaster.remove_session(session)
+        if session_owners is not None:
+            session_owners.release(session)
+
+@app.route('/api/frame_stats')
+def get_frame_stats():
+    """Get frame scheduling counters (received, dropped, processed) and scene reuse"""
+    stats = frame_scheduler.get_stats()
+    # Session ids would give access to the sessions' streams, so leave them out
+    stats['sessions'] = list(stats['sessions'].values())
+    stats['scene_reuse'] = {'hits': 0, 'misses': 0}
+    for tracker in list(face_trackers.values()):
+        if tracker.scene_cache is not None:
+            for key, value in tracker.scene_cache.get_stats().items():
+                stats['scene_reuse'][key] += value
+    return jsonify(stats)
+
+@app.route('/api/load_stats')
+def get_load_stats():
+    """Get processing latency and the capture level of every session"""
+    stats = load_controller.get_stats()
+    stats['sessions'] = list(stats['sessions'].values())
+    return jsonify(stats)
+
+def _check_stream_token():
+    """Answers 404 while streams are disabled and 403 without the right token"""
+    if not MJPEG_STREAM_TOKEN:
+        abort(make_response(jsonify({'error': 'Annotated streams are disabled, set MJPEG_STREAM_TOKEN'}), 404))
+    if not hmac.compare_digest(request.args.get('token', ''), MJPEG_STREAM_TOKEN):
+        abort(make_response(jsonify({'error': 'Invalid stream token'}), 403))
+
+@app.route('/api/streams')
+def list_streams():
+    """Sessions with a connected client, whose streams can be watched"""
+    _check_stream_token()
+    if session_owners is not None:
+        sessions = session_owners.sessions()
+    else:
+        sessions = {client_sessions.get(sid, sid) for sid in connected_sessions}
+    return jsonify({'sessions': sorted(sessions)})
+
+@app.route('/stream/<session>.mjpg')
+def stream_session(session):
+    """Live annotated video of a session (its client session id) as MJPEG"""
+    _check_stream_token()
+    
+    # Frames of a session are only rendered on the worker it is connected to
+    if session_owners is not None:
+        owner = session_owners.owner(session)
+        if owner is not None and owner != session_owners.worker_id and request.args.get('worker') != owner:
+            return redirect(request.path + '?' + urlencode({**request.args, 'worker': owner}), code=307)
+    return Response(mjpeg_broadcaster.stream(session),
+                    mimetype=f'multipart/x-mixed-replace; boundary={BOUNDARY}')
+
+@app.route('/api/stream_stats')
+def get_stream_stats():
+    """Get MJPEG viewer and frame counters"""
+    return jsonify(mjpeg_broadcaster.get_stats())
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus metrics in the text exposition format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/profiler', methods=['GET', 'POST'])
+def control_profiler():
+    """Start, stop or reset the sampling profiler, or get its collapsed stacks
+
+    POST ``{"action": "start" | "stop" | "reset"}``; GET returns one
+    ``frame;frame count`` line per stack, most frequent first (``limit``).
+    """
+    if not ENABLE_PROFILER:
+        return jsonify({'error': 'Profiler is disabled, set ENABLE_PROFILER=1'}), 404
+    
+    if request.method == 'GET':
+        return Response(profiler.report(request.args.get('limit', type=int)), mimetype='text/plain')
+    
+    action = (request.get_json(silent=True) or {}).get('action')
+    if action == 'start':
+        profiler.start()
+    elif action == 'stop':
+        profiler.stop()
+    elif action == 'reset':
+        profiler.reset()
+    else:
+        return jsonify({'error': f"Unknown profiler action: {action}"}), 400
+    return jsonify({'running': profiler.running, 'samples': profiler.samples})
+
+@app.route('/api/cache_stats')
+def get_cache_stats():
+    """Get response cache hit/miss counters"""
+    return jsonify(response_cache.get_stats())
+
+@app.route('/api/llm_stats')
+def get_llm_stats():
+    """Get language model gateway counters and circuit breaker state"""
+    return jsonify(llm_gateway.get_stats())
+
+def _session_arg():
+    """The session a history request is for; answers 400 without one"""
+    session = request.args.get('session')
+    if not session:
+        abort(400, description="Missing session parameter")
+    return session
+
+def _float_arg(name):
+    """A number query parameter, or None; answers 400 if it isn't a number"""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        abort(400, description=f"Invalid {name} {value!r}")
+
+def _int_arg(name, default=None, maximum=None):
+    """A positive integer query parameter, or ``default``; answers 400 if it
+    isn't one or is above ``maximum``"""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        number = int(value)
+        valid = number >= 1 and (maximum is None or number <= maximum)
+    except ValueError:
+        valid = False
+    if not valid:
+        limit = f"1 to {maximum}" if maximum is not None else "a positive integer"
+        abort(400, description=f"Invalid {name} {value!r}, must be {limit}")
+    return number
+
+def _page(method, session, default_size):
+    """A page of the durable store for the request's paging parameters"""
+    page_size = _int_arg('page_size', default_size, HISTORY_MAX_PAGE_SIZE)
+    try:
+        return jsonify(method(
+            session, request.args.get('cursor'), page_size,
+            _float_arg('start'), _float_arg('end'), request.args.get('order', 'desc')))
+    except ValueError as e:
+        abort(400, description=str(e))
+
+def _paginated():
+    """Whether a history request asks for a page of the durable store"""
+    return history_store is not None and ('cursor' in request.args or 'page_size' in request.args)
 
 @app.route('/api/emotion_history')
 def get_emotion_history():
-    """Get emotion detection history"""
-    return jsonify(emotion_data[-50:])  # Return last 50 entries
+    """Get emotion detection history for a session
+
+    Query parameters: session (required), start/end (Unix timestamps), limit (newest
+    entries, default 50 without a time range) and points (downsample to at
+    most this many averaged entries).
+
+    With cursor and/or page_size the durable store is paged instead,
+    newest first (order=asc for oldest first), returning
+    {'items': [...], 'next_cursor': ...}.
+    """
+    session = _session_arg()
+    start, end = _float_arg('start'), _float_arg('end')
+    
+    if _paginated():
+        return _page(history_store.emotion_page, session, 100)
+    
+    limit, points = _int_arg('limit'), _int_arg('points')
+    if limit is None and start is None and end is None:
+        limit = 50
+    
+    history = session_histories.emotions(session, create=False)
+    if history is None:
+        return jsonify([])
+    timestamps, probabilities = history.query(start, end, limit, points)
+    return jsonify(history.to_entries(timestamps, probabilities))
+
+@app.route('/api/emotion_aggregates')
+def get_emotion_aggregates():
+    """Get rolling mean, max and dominant emotion over the last 10s/60s/5min"""
+    history = session_histories.emotions(_session_arg(), create=False)
+    if history is None:
+        return jsonify({})
+    return jsonify(history.aggregates(now=time.time()))
+
+@app.route('/api/emotion_summary')
+def get_emotion_summary():
+    """Aggregate stored emotion samples over start/end, optionally per bucket seconds"""
+    if history_store is None:
+        return jsonify({'error': 'History store is disabled'}), 404
+    return jsonify(history_store.emotion_summary(
+        _session_arg(), _float_arg('start'), _float_arg('end'), _float_arg('bucket')))
 
 @app.route('/api/conversation_history')
 def get_conversation_history():
-    """Get conversation history"""
-    return jsonify(conversation_history[-20:])  # Return last 20 entries
+    """Get conversation history for a session, or a page of the durable store"""
+    session = _session_arg()
+    
+    if _paginated():
+        return _page(history_store.chat_page, session, 20)
+    
+    history = session_histories.conversation(session, create=False) or []
+    limit = _int_arg('limit', 20)
+    return jsonify(list(history)[-limit:])  # Return last 20 entries by default
+
+@app.errorhandler(400)
+def bad_request(error):
+    """Answer malformed API requests with a JSON error"""
+    return jsonify({'error': error.description}), 400
+
+@app.after_request
+def set_worker_cookie(response):
+    """Pin the client to this worker when running behind launcher.py"""
+    if WORKER_ID is not None:
+        response.set_cookie('emotion_ai_worker', WORKER_ID)
+    return response
 
 if __name__ == '__main__':
     print("Starting AI Emotion Detection System...")
-    socketio.run(app, debug=True, host='0.0.0.0', port=5500)
+    warm_up()
+    socketio.run(app, debug=os.getenv('FLASK_DEBUG', '1') == '1',
+                 host=os.getenv('HOST', '0.0.0.0'), port=int(os.getenv('PORT', '5500')))
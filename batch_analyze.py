@@ -0,0 +1,308 @@
+"""
+Batch Analysis Script
+Scores recorded sessions offline: video files or image directories are
+streamed frame by frame through the frame pipeline, sharded into chunks of
+frames across a process pool, and the per-frame face rects and emotions are
+written as one compressed .npz file per chunk, so memory stays bounded
+however long the recording is. Videos that don't report their length are
+read in one pass instead, still writing a chunk file at a time.
+
+Each chunk file holds a frame table (frame_index, timestamp, face_count) and
+a face table with a row per detected face (face_frame_index, face_rects,
+face_emotions with one column per entry of ``labels``).
+"""
+
+import argparse
+import collections
+import glob
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+from emotion_backends import create_backend
+from emotion_detector import EmotionDetector, EMOTION_LABELS
+from frame_pipeline import FramePipeline, FaceTracker
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# Pipeline of this worker process, built once by _init_worker
+_pipeline = None
+
+
+def _init_worker(detect_scale, emotion_backend=None):
+    """Load the detection models for one worker process and warm them up"""
+    global _pipeline
+    cv2.setNumThreads(1)
+    _pipeline = FramePipeline(EmotionDetector(backend=create_backend(emotion_backend)),
+                              detect_scale=detect_scale)
+    _pipeline.warm_up()
+
+
+def list_images(directory):
+    """Image files of a directory, sorted by name"""
+    return sorted(path for path in glob.glob(os.path.join(directory, '*'))
+                  if path.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def count_frames(source):
+    """Number of frames of a video or image directory, or None if the video doesn't say"""
+    if os.path.isdir(source):
+        return len(list_images(source))
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video {source}")
+    count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.release()
+    return count if count > 0 else None
+
+
+def iter_frames(source, stride=1, start=0, stop=None, fps=None):
+    """Yield (frame index, timestamp, BGR frame) for every ``stride``-th frame
+    of a video file or image directory in [start, stop)
+
+    Frames are decoded one at a time; skipped video frames are only grabbed,
+    not decoded. Timestamps are seconds from the video's frame rate (or
+    ``fps`` for images), NaN when it is unknown.
+    """
+    if os.path.isdir(source):
+        paths = list_images(source)
+        stop = len(paths) if stop is None else min(stop, len(paths))
+        for index in range(start, stop, stride):
+            frame = cv2.imread(paths[index])
+            if frame is None:
+                print(f"Error reading image {paths[index]}")
+                continue
+            yield index, index / fps if fps else math.nan, frame
+        return
+
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video {source}")
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS) or fps
+        if start:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+        index = start
+        while stop is None or index < stop:
+            if (index - start) % stride == 0:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yield index, index / fps if fps else math.nan, frame
+            elif not capture.grab():
+                break
+            index += 1
+    finally:
+        capture.release()
+
+
+def plan_chunks(total, chunk_frames, stride):
+    """Source frame ranges of chunks with ``chunk_frames`` analysed frames each
+
+    Chunks start on multiples of ``stride``, so sharding samples the same
+    frames as one pass would.
+    """
+    span = chunk_frames * stride
+    return [(start, min(start + span, total)) for start in range(0, total, span)]
+
+
+def analyze_chunk(source, start, stop, stride=1, fps=None, detect_interval=1, pipeline=None):
+    """Analyse the sampled frames of one chunk; returns its frame and face tables
+
+    With ``detect_interval`` above 1 faces are tracked between full
+    detections within the chunk.
+    """
+    pipeline = pipeline or _pipeline
+    tracker = FaceTracker(detect_interval=detect_interval) if detect_interval > 1 else None
+    return _analyze_frames(iter_frames(source, stride, start, stop, fps), pipeline, tracker)
+
+
+def analyze_stream(source, output_dir, stride=1, chunk_frames=500, fps=None, detect_interval=1,
+                   pipeline=None):
+    """Analyse a source of unknown length in one pass, writing a chunk file
+    every ``chunk_frames`` analysed frames; returns the chunk entries
+
+    Used when the video doesn't report its frame count, so it can't be
+    sharded. Faces are tracked across chunk boundaries.
+    """
+    pipeline = pipeline or _pipeline
+    tracker = FaceTracker(detect_interval=detect_interval) if detect_interval > 1 else None
+    name = source_name(source)
+    frames = iter_frames(source, stride, fps=fps)
+    chunks = []
+    while True:
+        tables = _analyze_frames(itertools.islice(frames, chunk_frames), pipeline, tracker)
+        if len(tables['frame_index']) == 0:
+            return chunks
+        chunks.append(write_chunk(output_dir, name, len(chunks), tables))
+        print(f"{name}: chunk {len(chunks) - 1}, {sum(chunk['frames'] for chunk in chunks)} frames")
+
+
+def _analyze_frames(frames, pipeline, tracker):
+    """Frame and face tables of (index, timestamp, frame) items"""
+    frame_indices, timestamps, face_counts = [], [], []
+    face_frame_indices, face_rects, face_emotions = [], [], []
+    for index, timestamp, frame in frames:
+        result = pipeline.analyze_frame(frame, tracker)
+        frame_indices.append(index)
+        timestamps.append(timestamp)
+        face_counts.append(len(result.faces))
+        if len(result.faces):
+            face_frame_indices.extend([index] * len(result.faces))
+            face_rects.append(result.faces)
+            face_emotions.append(result.face_emotions)
+
+    return {
+        'frame_index': np.array(frame_indices, dtype=np.int64),
+        'timestamp': np.array(timestamps, dtype=np.float64),
+        'face_count': np.array(face_counts, dtype=np.int32),
+        'face_frame_index': np.array(face_frame_indices, dtype=np.int64),
+        'face_rects': (np.concatenate(face_rects).astype(np.int32) if face_rects
+                       else np.empty((0, 4), dtype=np.int32)),
+        'face_emotions': (np.concatenate(face_emotions).astype(np.float32) if face_emotions
+                          else np.empty((0, len(EMOTION_LABELS)), dtype=np.float32))
+    }
+
+
+def source_name(source):
+    """Base name of the chunk files and manifest of a source"""
+    return os.path.splitext(os.path.basename(os.path.normpath(source)))[0]
+
+
+def write_chunk(output_dir, name, number, tables):
+    """Save one chunk's tables as <name>-<number>.npz; returns its manifest entry"""
+    path = os.path.join(output_dir, f"{name}-{number:05d}.npz")
+    np.savez_compressed(path, labels=np.array(EMOTION_LABELS), **tables)
+    return {'file': os.path.basename(path), 'frames': len(tables['frame_index']),
+            'faces': len(tables['face_frame_index'])}
+
+
+def analyze_source(source, output_dir, executor=None, stride=1, chunk_frames=500, fps=None,
+                   detect_interval=1, max_pending=None, pipeline=None):
+    """Analyse one video or image directory chunk by chunk into ``output_dir``
+
+    Chunks run on ``executor`` (a pool whose workers ran _init_worker) or
+    inline on ``pipeline``. At most ``max_pending`` chunks are in flight,
+    and each is written as soon as it and the ones before it are done.
+    Videos that don't report their frame count are read in one pass by
+    analyze_stream instead. Returns the manifest, which is also written as
+    <name>.json.
+    """
+    name = source_name(source)
+    os.makedirs(output_dir, exist_ok=True)
+    if executor is None and pipeline is None:
+        pipeline = FramePipeline()
+
+    manifest = {'source': source, 'stride': stride, 'labels': list(EMOTION_LABELS),
+                'chunks': [], 'frames': 0, 'faces': 0}
+    started = time.perf_counter()
+
+    def add(chunk):
+        manifest['chunks'].append(chunk)
+        manifest['frames'] += chunk['frames']
+        manifest['faces'] += chunk['faces']
+
+    def write(number, tables):
+        add(write_chunk(output_dir, name, number, tables))
+        elapsed = time.perf_counter() - started
+        print(f"{name}: chunk {number}, {manifest['frames']} frames "
+              f"({manifest['frames'] / elapsed:.1f} fps)")
+
+    total = count_frames(source)
+    if total is None:
+        # Can't be sharded; read in one pass, on a worker if there is a pool
+        if executor is None:
+            chunks = analyze_stream(source, output_dir, stride, chunk_frames, fps,
+                                    detect_interval, pipeline)
+        else:
+            chunks = executor.submit(analyze_stream, source, output_dir, stride, chunk_frames,
+                                     fps, detect_interval).result()
+        for chunk in chunks:
+            add(chunk)
+    elif executor is None:
+        for number, (start, stop) in enumerate(plan_chunks(total, chunk_frames, stride)):
+            write(number, analyze_chunk(source, start, stop, stride, fps, detect_interval, pipeline))
+    else:
+        max_pending = max_pending or 2 * (os.cpu_count() or 1)
+        pending = collections.deque()
+        for number, (start, stop) in enumerate(plan_chunks(total, chunk_frames, stride)):
+            if len(pending) >= max_pending:
+                write(*_result(pending.popleft()))
+            pending.append((number, executor.submit(
+                analyze_chunk, source, start, stop, stride, fps, detect_interval)))
+        while pending:
+            write(*_result(pending.popleft()))
+
+    manifest['seconds'] = time.perf_counter() - started
+    with open(os.path.join(output_dir, f"{name}.json"), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def _result(item):
+    number, future = item
+    return number, future.result()
+
+
+def read_chunks(manifest_path):
+    """Yield the tables of every chunk listed in a manifest, one chunk at a time"""
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    directory = os.path.dirname(manifest_path)
+    for chunk in manifest['chunks']:
+        with np.load(os.path.join(directory, chunk['file'])) as data:
+            yield {key: data[key] for key in data.files}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse recorded video files or image directories")
+    parser.add_argument('sources', nargs='+', help="Video files or directories of images")
+    parser.add_argument('--output', default='batch_results', help="Directory for chunk files and manifests")
+    parser.add_argument('--stride', type=int, default=1, help="Analyse every Nth frame")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Worker processes (0 analyses in this process)")
+    parser.add_argument('--chunk-frames', type=int, default=500, help="Analysed frames per chunk file")
+    parser.add_argument('--fps', type=float, help="Frame rate of image directories, for timestamps")
+    parser.add_argument('--detect-interval', type=int, default=1,
+                        help="Track faces between full detections every N analysed frames")
+    parser.add_argument('--detect-scale', type=float, default=1.0,
+                        help="Downscale factor for full face detections")
+    parser.add_argument('--emotion-model', help="ONNX emotion model (default: simulated emotions)")
+    args = parser.parse_args()
+
+    emotion_backend = {'model_path': args.emotion_model} if args.emotion_model else None
+    executor = None
+    pipeline = None
+    if args.workers > 0:
+        executor = ProcessPoolExecutor(
+            max_workers=args.workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker, initargs=(args.detect_scale, emotion_backend))
+    else:
+        pipeline = FramePipeline(EmotionDetector(backend=create_backend(emotion_backend)),
+                                 detect_scale=args.detect_scale)
+
+    try:
+        for source in args.sources:
+            try:
+                manifest = analyze_source(source, args.output, executor, args.stride, args.chunk_frames,
+                                          args.fps, args.detect_interval, 2 * args.workers, pipeline)
+            except ValueError as e:
+                print(f"Error analysing {source}: {e}")
+                continue
+            print(f"{source}: {manifest['frames']} frames, {manifest['faces']} faces in "
+                  f"{len(manifest['chunks'])} chunks ({manifest['seconds']:.1f}s)")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Benchmark script for the per-frame pipeline
+Times each stage on synthetic frames at several resolutions and face counts
+and writes JSON results that can be compared across runs
+"""
+
+import argparse
+import base64
+import json
+import platform
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+from emotion_backends import DnnBackend
+from emotion_detector import EmotionDetector, EMOTION_LABELS, prepare_face_batch
+from face_analyzer import FaceAnalyzer
+from frame_pipeline import FramePipeline, decode_frame, serialize_faces
+
+RESOLUTIONS = {
+    '480p': (640, 480),
+    '720p': (1280, 720),
+    '1080p': (1920, 1080)
+}
+
+
+def draw_synthetic_face(size):
+    """Draw a cartoon face the Haar cascade detects as a frontal face"""
+    face = np.full((size, size), 170, dtype=np.uint8)
+    s = size / 100
+
+    def pt(x, y):
+        return int(x * s), int(y * s)
+
+    cv2.ellipse(face, pt(50, 52), pt(38, 48), 0, 0, 360, 200, -1)
+    for eye_x in (33, 67):
+        cv2.ellipse(face, pt(eye_x, 40), pt(10, 5), 0, 0, 360, 40, -1)
+        cv2.rectangle(face, pt(eye_x - 12, 28), pt(eye_x + 12, 31), 60, -1)
+    cv2.rectangle(face, pt(46, 45), pt(54, 62), 150, -1)
+    cv2.ellipse(face, pt(50, 75), pt(16, 5), 0, 0, 360, 70, -1)
+    return cv2.GaussianBlur(face, (0, 0), 1.5 * s)
+
+
+def make_frame(width, height, num_faces, seed=0):
+    """Create a BGR frame with ``num_faces`` synthetic faces in a row"""
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(100, 140, size=(height, width), dtype=np.uint8)
+
+    if num_faces:
+        size = min(height // 3, width // (num_faces + 1))
+        gap = (width - num_faces * size) // (num_faces + 1)
+        y = (height - size) // 2
+        for i in range(num_faces):
+            x = gap + i * (size + gap)
+            frame[y:y + size, x:x + size] = draw_synthetic_face(size)
+
+    return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+
+
+def write_tiny_emotion_model(path, seed=0):
+    """Write a small random ONNX emotion classifier (needs the onnx package)
+
+    Conv 3x3/2 -> ReLU -> global average pool -> dense -> softmax over the
+    7 emotions, with a dynamic batch dimension. Good for timing the dnn
+    backend and for tests, not for recognizing emotions.
+    """
+    import onnx
+    from onnx import helper, numpy_helper, TensorProto
+
+    rng = np.random.default_rng(seed)
+    conv_w = rng.normal(0, 0.3, (8, 1, 3, 3)).astype(np.float32)
+    conv_b = np.zeros(8, dtype=np.float32)
+    dense_w = rng.normal(0, 0.5, (8, len(EMOTION_LABELS))).astype(np.float32)
+    dense_b = np.zeros(len(EMOTION_LABELS), dtype=np.float32)
+
+    graph = helper.make_graph(
+        [
+            helper.make_node('Conv', ['input', 'conv_w', 'conv_b'], ['conv'],
+                             kernel_shape=[3, 3], strides=[2, 2], pads=[1, 1, 1, 1]),
+            helper.make_node('Relu', ['conv'], ['relu']),
+            helper.make_node('GlobalAveragePool', ['relu'], ['pool']),
+            helper.make_node('Flatten', ['pool'], ['flat'], axis=1),
+            helper.make_node('MatMul', ['flat', 'dense_w'], ['logits_raw']),
+            helper.make_node('Add', ['logits_raw', 'dense_b'], ['logits']),
+            helper.make_node('Softmax', ['logits'], ['scores'], axis=1)
+        ],
+        'tiny_emotion',
+        [helper.make_tensor_value_info('input', TensorProto.FLOAT, ['N', 1, 48, 48])],
+        [helper.make_tensor_value_info('scores', TensorProto.FLOAT, ['N', len(EMOTION_LABELS)])],
+        [numpy_helper.from_array(conv_w, 'conv_w'), numpy_helper.from_array(conv_b, 'conv_b'),
+         numpy_helper.from_array(dense_w, 'dense_w'), numpy_helper.from_array(dense_b, 'dense_b')]
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)])
+    model.ir_version = 8
+    onnx.save(model, path)
+    return path
+
+
+def time_stage(func, repeat, warmup=2):
+    """Run ``func`` repeatedly and summarize its latency in milliseconds"""
+    for _ in range(warmup):
+        func()
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    samples = np.array(samples)
+    return {
+        'mean_ms': float(samples.mean()),
+        'median_ms': float(np.median(samples)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'min_ms': float(samples.min()),
+        'repeat': repeat
+    }
+
+
+def benchmark_case(width, height, num_faces, repeat, seed, emotion_model=None):
+    """Time every pipeline stage on one synthetic frame
+
+    With ``emotion_model`` the ONNX backend is timed next to the simulated one.
+    """
+    frame = make_frame(width, height, num_faces, seed)
+    jpeg = cv2.imencode('.jpg', frame)[1].tobytes()
+    data_url = 'data:image/jpeg;base64,' + base64.b64encode(jpeg).decode()
+
+    emotion_detector = EmotionDetector(seed=seed)
+    face_analyzer = FaceAnalyzer(seed=seed)
+    pipeline = FramePipeline(emotion_detector, face_analyzer)
+
+    result = pipeline.analyze_frame(frame)
+    emotions = result.emotions
+    landmarks_data = result.landmarks_data
+
+    def decode_base64_color():
+        image_data = base64.b64decode(data_url.split(',')[1])
+        cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+
+    stages = {
+        'decode_base64_color': decode_base64_color,
+        'decode_binary_gray': lambda: decode_frame(jpeg),
+        'detect_emotions': lambda: emotion_detector.detect_emotions(frame),
+        'detect_emotions_batch': lambda: emotion_detector.detect_emotions_batch(result.gray, result.faces),
+        'analyze_face': lambda: face_analyzer.analyze_face(frame),
+        'analyze_frame': lambda: pipeline.analyze_frame(frame),
+        'serialize_landmarks': lambda: json.dumps(serialize_faces(landmarks_data)),
+        'draw_face_mesh': lambda: face_analyzer.draw_face_mesh(frame.copy(), landmarks_data),
+        'get_face_emotions_overlay': lambda: face_analyzer.get_face_emotions_overlay(
+            frame, landmarks_data, emotions)
+    }
+
+    face_batch, _ = prepare_face_batch(result.gray, result.faces)
+    stages['score_emotions_simulated'] = lambda: emotion_detector.backend.predict(face_batch)
+    if emotion_model:
+        dnn_backend = DnnBackend(emotion_model)
+        stages['score_emotions_dnn'] = lambda: dnn_backend.predict(face_batch)
+
+    timings = {name: time_stage(func, repeat) for name, func in stages.items()}
+    return timings, len(result.faces)
+
+
+def run_benchmarks(resolutions, face_counts, repeat, seed, emotion_model=None):
+    results = {}
+    for resolution in resolutions:
+        width, height = RESOLUTIONS[resolution]
+        for num_faces in face_counts:
+            timings, detected = benchmark_case(width, height, num_faces, repeat, seed, emotion_model)
+            if detected != num_faces:
+                print(f"Warning: {resolution} with {num_faces} faces detected {detected}")
+            for stage, stats in timings.items():
+                stats['faces_detected'] = detected
+                results[f"{stage}/{resolution}/{num_faces}faces"] = stats
+                print(f"{stage:28s} {resolution:6s} {num_faces} faces  "
+                      f"median {stats['median_ms']:8.3f} ms  p95 {stats['p95_ms']:8.3f} ms")
+    return results
+
+
+def compare_results(baseline, current, threshold):
+    """Return (key, baseline ms, current ms, ratio) for stages slower than the threshold"""
+    regressions = []
+    for key, stats in current.items():
+        if key not in baseline:
+            continue
+        old = baseline[key]['median_ms']
+        new = stats['median_ms']
+        ratio = new / old if old > 0 else float('inf')
+        if ratio > 1 + threshold:
+            regressions.append((key, old, new, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the per-frame emotion pipeline")
+    parser.add_argument('--resolutions', default='480p,720p,1080p',
+                        help="Comma-separated subset of 480p, 720p, 1080p")
+    parser.add_argument('--faces', default='0,1,4', help="Comma-separated face counts")
+    parser.add_argument('--repeat', type=int, default=20, help="Timed runs per stage")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for frames and simulated emotions")
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    parser.add_argument('--compare', help="Baseline JSON file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Allowed median slowdown before a stage counts as a regression")
+    parser.add_argument('--emotion-model',
+                        help="ONNX emotion model to time against the simulated backend, "
+                             "or 'tiny' for a generated random model (needs onnx)")
+    args = parser.parse_args()
+
+    resolutions = args.resolutions.split(',')
+    face_counts = [int(n) for n in args.faces.split(',')]
+
+    emotion_model = args.emotion_model
+    if emotion_model == 'tiny':
+        emotion_model = write_tiny_emotion_model(os.path.join(tempfile.mkdtemp(), 'tiny_emotion.onnx'))
+
+    results = run_benchmarks(resolutions, face_counts, args.repeat, args.seed, emotion_model)
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'seed': args.seed,
+            'emotion_model': args.emotion_model,
+            'repeat': args.repeat
+        },
+        'results': results
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare_results(baseline, results, args.threshold)
+        for key, old, new, ratio in regressions:
+            print(f"REGRESSION {key}: {old:.3f} ms -> {new:.3f} ms ({ratio:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Conversation Module
+Builds emotion-aware prompts and gets complete or streamed responses from
+the language model
+"""
+
+from llm_gateway import LLMGateway, ModelBackend
+from metrics import StageTimer
+
+FALLBACK_RESPONSE = "I understand your feelings. How can I help you today?"
+
+
+class EmotionConversationAI:
+    def __init__(self, model, cache=None, stage_histogram=None):
+        # An LLMGateway, or any object with generate_content(prompt, stream=False)
+        # (e.g. a google.generativeai GenerativeModel or a local fake), which is
+        # put behind a gateway with default limits
+        if isinstance(model, LLMGateway):
+            self.gateway = model
+        else:
+            self.gateway = LLMGateway(ModelBackend(model))
+        # Optional ResponseCache consulted before calling the model
+        self.cache = cache
+        # Optional metrics Histogram (labels: path, stage) timing each step
+        self.stage_histogram = stage_histogram
+
+    def build_prompt(self, user_message, emotion, intensity):
+        """Create the emotion-aware prompt for a user message"""
+        return f"""
+            You are an empathetic AI assistant. The user's current emotion is {emotion} with intensity {intensity:.2f}.
+
+            Guidelines for responding:
+            - If emotion is 'happy' or 'joy': Be enthusiastic and positive
+            - If emotion is 'sad' or 'angry': Be supportive and understanding
+            - If emotion is 'fear' or 'surprise': Be reassuring and calm
+            - If emotion is 'disgust': Be neutral and redirect positively
+            - If emotion is 'neutral': Be balanced and engaging
+
+            User message: {user_message}
+
+            Respond appropriately to their emotion and message. Keep responses concise but meaningful.
+            """
+
+    def _cache_key(self, user_message, emotion, intensity):
+        if self.cache is None:
+            return None
+        return self.cache.make_key(user_message, emotion, intensity)
+
+    def generate_response(self, user_message, emotion, intensity):
+        """Generate contextual response based on user emotion and message"""
+        timer = StageTimer(self.stage_histogram, path='generate')
+        try:
+            cache_key = self._cache_key(user_message, emotion, intensity)
+            cached = self.cache.get(cache_key) if cache_key else None
+            timer.mark('cache_lookup')
+            if cached is not None:
+                return cached
+
+            response = self.gateway.generate(self.build_prompt(user_message, emotion, intensity))
+            timer.mark('llm')
+            if cache_key:
+                self.cache.put(cache_key, response)
+                timer.mark('cache_store')
+            return response
+
+        except Exception as e:
+            print(f"Error generating response: {e}")
+            return FALLBACK_RESPONSE
+
+    def stream_response(self, user_message, emotion, intensity, cancel_event=None):
+        """Yield the response text chunk by chunk as the model produces it
+
+        Stops early once ``cancel_event`` (a threading.Event) is set. If the
+        model fails before sending anything, the fallback text is yielded.
+        """
+        sent_any = False
+        timer = StageTimer(self.stage_histogram, path='stream')
+        try:
+            cache_key = self._cache_key(user_message, emotion, intensity)
+            cached = self.cache.get(cache_key) if cache_key else None
+            timer.mark('cache_lookup')
+            if cached is not None:
+                yield cached
+                return
+
+            stream = self.gateway.stream(self.build_prompt(user_message, emotion, intensity), cancel_event)
+            parts = []
+            for text in stream:
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                if text:
+                    if not sent_any:
+                        timer.mark('first_chunk')
+                    sent_any = True
+                    parts.append(text)
+                    yield text
+            timer.mark('llm_stream')
+
+            # Only complete, uncancelled responses are cached; the stream also
+            # ends quietly when it is cancelled between chunks
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            if cache_key:
+                self.cache.put(cache_key, ''.join(parts))
+                timer.mark('cache_store')
+
+        except Exception as e:
+            print(f"Error streaming response: {e}")
+            if not sent_any:
+                yield FALLBACK_RESPONSE
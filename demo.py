@@ -1,68 +1,278 @@
 """
 Demo script to test emotion detection functionality
+Capture, analysis and display run as separate stages connected by
+latest-frame queues, so neither the camera nor the display waits for
+inference
 """
 
-import cv2
-import numpy as np
-from emotion_detector import EmotionDetector
-from face_analyzer import FaceAnalyzer
+import argparse
+import threading
 import time
 
-def main():
-    # Initialize components
-    emotion_detector = EmotionDetector()
-    face_analyzer = FaceAnalyzer()
-    
-    # Initialize camera
-    cap = cv2.VideoCapture(0)
-    
-    if not cap.isOpened():
-        print("Error: Could not open camera")
-        return
-    
-    print("Starting emotion detection demo...")
-    print("Press 'q' to quit")
-    
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        # Detect emotions
-        emotions = emotion_detector.detect_emotions(frame)
-        
-        # Analyze face
-        landmarks_data = face_analyzer.analyze_face(frame)
-        
-        # Create emotion overlay
+import cv2
+from frame_pipeline import FramePipeline, FaceTracker
+
+
+class LatestQueue:
+    """Hands the newest item from one stage to the next
+
+    ``put`` replaces an item nobody has taken yet, so a slow consumer works
+    on the latest frame instead of a growing backlog; replaced items are
+    counted in ``dropped``.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = item
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """The newest item, or None on timeout or once closed and empty"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._item is not None or self._closed, timeout)
+            item, self._item = self._item, None
+            return item
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        with self._cond:
+            return self._closed and self._item is None
+
+
+class StageStats:
+    """Frame rate and latency of one stage, smoothed with an EWMA"""
+    def __init__(self, alpha=0.1):
+        self.alpha = alpha
+        self.frames = 0
+        self.fps = 0.0
+        self.latency = 0.0
+        self._last = None
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        now = time.perf_counter()
+        with self._lock:
+            if self._last is not None and now > self._last:
+                self.fps = self._ewma(self.fps, 1.0 / (now - self._last))
+            self.latency = self._ewma(self.latency, latency)
+            self._last = now
+            self.frames += 1
+
+    def _ewma(self, average, value):
+        return value if self.frames <= 1 else average + self.alpha * (value - average)
+
+
+class DemoPipeline:
+    """Capture -> analysis -> display pipeline for local video
+
+    A capture thread reads ``capture`` (a cv2.VideoCapture or anything with
+    ``read()``) and passes every frame on to both analysis and display.
+    ``workers`` analysis threads each own a FramePipeline and FaceTracker and
+    always take the newest frame. ``frames()`` yields each captured frame
+    with the newest analysis result drawn on it, so display keeps the
+    source's frame rate whatever the analysis rate. With ``frame_interval``
+    capture is paced, e.g. to play a video file in real time.
+    """
+    def __init__(self, capture, workers=1, detect_scale=1.0, detect_interval=5,
+                 frame_interval=0.0, seed=None):
+        self.capture = capture
+        self.frame_interval = frame_interval
+
+        self._pipelines = [FramePipeline(detect_scale=detect_scale, seed=seed) for _ in range(workers)]
+        self._detect_interval = detect_interval
+        self._analysis_queue = LatestQueue()
+        self._display_queue = LatestQueue()
+        self._stopped = threading.Event()
+        self._threads = []
+
+        self._result_lock = threading.Lock()
+        self._result = (0, None, [])  # frame number, emotions, landmarks_data
+
+        self.stats = {'capture': StageStats(), 'analysis': StageStats(), 'display': StageStats()}
+
+    def start(self):
+        self._threads = [threading.Thread(target=self._capture_loop, name='capture', daemon=True)]
+        for i, pipeline in enumerate(self._pipelines):
+            self._threads.append(threading.Thread(
+                target=self._analysis_loop, args=(pipeline,), name=f'analysis-{i}', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._analysis_queue.close()
+        self._display_queue.close()
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+
+    def frames(self):
+        """Yield annotated frames until the source ends or ``stop`` is called"""
+        while not self._display_queue.closed:
+            item = self._display_queue.get(timeout=0.1)
+            if item is None:
+                continue
+            _, captured_at, frame = item
+            self.annotate(frame)
+            self.stats['display'].record(time.perf_counter() - captured_at)
+            yield frame
+
+    def annotate(self, frame):
+        """Draw the newest analysis result and the pipeline stats on ``frame``"""
+        with self._result_lock:
+            _, emotions, landmarks_data = self._result
+
+        face_analyzer = self._pipelines[0].face_analyzer
         if emotions and landmarks_data:
-            overlay_frame = face_analyzer.get_face_emotions_overlay(frame, landmarks_data, emotions)
-        else:
-            overlay_frame = frame
-        
-        # Draw face mesh
+            face_analyzer.get_face_emotions_overlay(frame, landmarks_data, emotions, out=frame)
         if landmarks_data:
-            overlay_frame = face_analyzer.draw_face_mesh(overlay_frame, landmarks_data)
-        
+            face_analyzer.draw_face_mesh(frame, landmarks_data)
+
         # Display emotion information
         if emotions:
             y = 30
             for emotion, confidence in emotions.items():
                 text = f"{emotion}: {confidence:.2f}"
-                cv2.putText(overlay_frame, text, (10, y), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+                cv2.putText(frame, text, (10, y),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
                 y += 30
-        
-        # Show frame
-        cv2.imshow('Emotion Detection Demo', overlay_frame)
-        
-        # Check for exit
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
-    
-    # Cleanup
-    cap.release()
-    cv2.destroyAllWindows()
+
+        display, analysis = self.stats['display'], self.stats['analysis']
+        text = (f"display {display.fps:.1f} fps | analysis {analysis.fps:.1f} fps, "
+                f"{analysis.latency * 1000:.0f} ms")
+        cv2.putText(frame, text, (10, frame.shape[0] - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+        return frame
+
+    def get_stats(self):
+        stats = {name: {'frames': stage.frames, 'fps': stage.fps, 'latency_ms': stage.latency * 1000}
+                 for name, stage in self.stats.items()}
+        stats['analysis']['dropped'] = self._analysis_queue.dropped
+        stats['display']['dropped'] = self._display_queue.dropped
+        return stats
+
+    def _capture_loop(self):
+        frame_number = 0
+        next_frame_at = time.perf_counter()
+        try:
+            while not self._stopped.is_set():
+                ret, frame = self.capture.read()
+                if not ret:
+                    break
+                captured_at = time.perf_counter()
+                frame_number += 1
+                self.stats['capture'].record(0.0)
+
+                # Analysis only reads the frame; display draws on its own copy
+                self._analysis_queue.put((frame_number, captured_at, frame))
+                self._display_queue.put((frame_number, captured_at, frame.copy()))
+
+                if self.frame_interval:
+                    next_frame_at += self.frame_interval
+                    time.sleep(max(0.0, next_frame_at - time.perf_counter()))
+        except Exception as e:
+            print(f"Error capturing frame: {e}")
+        finally:
+            self._analysis_queue.close()
+            self._display_queue.close()
+
+    def _analysis_loop(self, pipeline):
+        tracker = FaceTracker(detect_interval=self._detect_interval)
+        pipeline.warm_up()
+        while True:
+            item = self._analysis_queue.get()
+            if item is None:
+                return
+            frame_number, captured_at, frame = item
+            result = pipeline.analyze_frame(frame, tracker)
+
+            # With several workers results can finish out of order
+            with self._result_lock:
+                if frame_number > self._result[0]:
+                    self._result = (frame_number, result.emotions, result.landmarks_data)
+            self.stats['analysis'].record(time.perf_counter() - captured_at)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local emotion detection demo")
+    parser.add_argument('--source', default='0', help="Camera index or video file")
+    parser.add_argument('--workers', type=int, default=1, help="Analysis threads")
+    parser.add_argument('--detect-scale', type=float, default=0.5,
+                        help="Downscale factor for full face detections")
+    parser.add_argument('--headless', action='store_true',
+                        help="Do not open a window; print stats instead")
+    parser.add_argument('--realtime', action='store_true',
+                        help="Play video files at their own frame rate instead of as fast as possible")
+    parser.add_argument('--output', help="Write the annotated video to this file")
+    args = parser.parse_args()
+
+    # Initialize camera or video file
+    source = int(args.source) if args.source.isdigit() else args.source
+    cap = cv2.VideoCapture(source)
+
+    if not cap.isOpened():
+        print(f"Error: Could not open video source {args.source}")
+        return
+
+    frame_interval = 0.0
+    if args.realtime and not isinstance(source, int):
+        source_fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_interval = 1.0 / source_fps if source_fps > 0 else 0.0
+
+    pipeline = DemoPipeline(cap, workers=args.workers, detect_scale=args.detect_scale,
+                            frame_interval=frame_interval)
+    writer = None
+
+    print("Starting emotion detection demo...")
+    print("Press Ctrl+C to quit" if args.headless else "Press 'q' to quit")
+
+    pipeline.start()
+    last_report = time.perf_counter()
+    try:
+        for frame in pipeline.frames():
+            if args.output:
+                if writer is None:
+                    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+                    writer = cv2.VideoWriter(args.output, cv2.VideoWriter_fourcc(*'mp4v'), fps,
+                                             (frame.shape[1], frame.shape[0]))
+                writer.write(frame)
+
+            if not args.headless:
+                # Show frame and check for exit
+                cv2.imshow('Emotion Detection Demo', frame)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+            elif time.perf_counter() - last_report >= 1.0:
+                last_report = time.perf_counter()
+                stats = pipeline.get_stats()
+                print(f"display {stats['display']['fps']:.1f} fps, "
+                      f"analysis {stats['analysis']['fps']:.1f} fps "
+                      f"({stats['analysis']['latency_ms']:.0f} ms)")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Cleanup
+        pipeline.stop()
+        cap.release()
+        if writer is not None:
+            writer.release()
+        if not args.headless:
+            cv2.destroyAllWindows()
+
+    for name, stage in pipeline.get_stats().items():
+        print(f"{name}: {stage['frames']} frames, {stage['fps']:.1f} fps, "
+              f"{stage['latency_ms']:.1f} ms latency, {stage.get('dropped', 0)} dropped")
 
 if __name__ == "__main__":
     main()
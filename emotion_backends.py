@@ -0,0 +1,134 @@
+"""
+Emotion Backends Module
+Classifiers that turn a batch of normalized face crops into emotion
+probabilities: the built-in simulation, or an ONNX model run with cv2.dnn
+"""
+
+import os
+import time
+
+import cv2
+import numpy as np
+from emotion_detector import EMOTION_LABELS
+from model_registry import get_dnn_net
+
+# Simulated score of each emotion: base value plus a random spread
+SIMULATED_SCORE_RANGES = {
+    'happy': (0.2, 0.4),
+    'neutral': (0.3, 0.3),
+    'surprise': (0.1, 0.2),
+    'sad': (0.05, 0.15),
+    'angry': (0.05, 0.1),
+    'fear': (0.02, 0.08),
+    'disgust': (0.02, 0.05)
+}
+
+
+class EmotionBackend:
+    """Interface for emotion classifiers"""
+    def predict(self, batch):
+        """Score an (N, 48, 48) float32 batch of normalized faces
+
+        Returns an (N, len(labels)) float32 array of probabilities.
+        """
+        raise NotImplementedError
+
+
+class SimulatedBackend(EmotionBackend):
+    """Random emotion scores with a slow time-based drift, for demos
+
+    With a seed the scores are deterministic: random values come from a
+    seeded generator and the clock advances 0.2s per batch.
+    """
+    def __init__(self, seed=None, labels=EMOTION_LABELS):
+        self.labels = list(labels)
+        self._rng = np.random.default_rng(seed)
+        self._seeded = seed is not None
+        self._simulated_time = 0.0
+
+        ranges = [SIMULATED_SCORE_RANGES.get(label, (0.02, 0.05)) for label in self.labels]
+        self._base_scores = np.array([low for low, _ in ranges])
+        self._score_spread = np.array([spread for _, spread in ranges])
+
+    def predict(self, batch):
+        scores = self._base_scores + self._rng.random((len(batch), len(self.labels))) * self._score_spread
+
+        # Add some time-based variation for demo realism
+        time_factor = self._now() % 10  # 10-second cycle
+        if time_factor < 2:
+            boost = ('happy', 0.2)
+        elif time_factor < 4:
+            boost = ('neutral', 0.2)
+        elif time_factor < 6:
+            boost = ('surprise', 0.1)
+        else:
+            boost = ('sad', 0.1)
+        if boost[0] in self.labels:
+            scores[:, self.labels.index(boost[0])] += boost[1]
+
+        # Normalize each face to sum to 1
+        scores /= scores.sum(axis=1, keepdims=True)
+        return scores.astype(np.float32)
+
+    def _now(self):
+        """Current time, or the simulated clock in seeded mode"""
+        if not self._seeded:
+            return time.time()
+        self._simulated_time += 0.2
+        return self._simulated_time
+
+
+class DnnBackend(EmotionBackend):
+    """ONNX emotion classifier run on the CPU with OpenCV's dnn module
+
+    The model takes an (N, 1, 48, 48) batch and returns one row of scores per
+    face in ``model_labels`` order; rows are reordered to ``labels``. Each
+    model file is loaded once per process and shared by every backend using
+    it. ``quantized_model_path`` (an INT8 or FP16 export) is used instead of
+    ``model_path`` when it loads. ``threads`` sets OpenCV's thread count and
+    batches larger than ``batch_size`` run in chunks.
+    """
+    def __init__(self, model_path, quantized_model_path=None, threads=None, batch_size=32,
+                 model_labels=EMOTION_LABELS, labels=EMOTION_LABELS, softmax=False):
+        if threads is not None:
+            cv2.setNumThreads(threads)
+
+        self.model_path = model_path
+        if quantized_model_path and os.path.exists(quantized_model_path):
+            try:
+                self.net, self._lock = get_dnn_net(quantized_model_path)
+                self.model_path = quantized_model_path
+            except cv2.error as e:
+                print(f"Error loading quantized emotion model, using {model_path}: {e}")
+        if self.model_path == model_path:
+            self.net, self._lock = get_dnn_net(model_path)
+
+        self.batch_size = batch_size
+        self.softmax = softmax
+        self.labels = list(labels)
+        self._order = [list(model_labels).index(label) for label in self.labels]
+
+    def predict(self, batch):
+        outputs = []
+        for start in range(0, len(batch), self.batch_size):
+            blob = np.ascontiguousarray(batch[start:start + self.batch_size, None], dtype=np.float32)
+            with self._lock:
+                self.net.setInput(blob)
+                outputs.append(self.net.forward().reshape(len(blob), -1))
+
+        scores = np.concatenate(outputs)[:, self._order] if outputs else np.empty((0, len(self.labels)))
+        if self.softmax:
+            scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+            scores /= scores.sum(axis=1, keepdims=True)
+        return scores.astype(np.float32)
+
+
+def create_backend(config=None, seed=None):
+    """Build a backend from a config dict, e.g. ``{'model_path': ...}``
+
+    Without a ``model_path`` the simulated backend is used. The dict is
+    plain data so it can be handed to worker processes.
+    """
+    if not config or not config.get('model_path'):
+        return SimulatedBackend(seed)
+    return DnnBackend(**config)
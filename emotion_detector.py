@@ -1,88 +1,111 @@
 """
 Emotion Detection Module
-Uses OpenCV for face detection and simulated emotion recognition
+Uses OpenCV for face detection and a pluggable emotion classifier
+(simulated unless a model backend is configured)
 """
 
 import cv2
 import numpy as np
-import random
-import time
+from model_registry import FACE_CASCADE, get_cascade
+
+# Emotion labels in the order used for emotion probability arrays
+EMOTION_LABELS = ['angry', 'disgust', 'fear', 'happy', 'neutral', 'sad', 'surprise']
+
+# Side length of the face crops emotions are scored on
+FACE_INPUT_SIZE = 48
+
+def prepare_face_batch(gray, faces, size=FACE_INPUT_SIZE):
+    """Crop, resize and normalize face rects into one batch
+
+    Returns an (N, size, size) float32 array, each face scaled to zero mean
+    and unit variance, and a boolean mask of the rects that had pixels.
+    """
+    crops = np.zeros((len(faces), size, size), dtype=np.uint8)
+    valid = np.zeros(len(faces), dtype=bool)
+    frame_h, frame_w = gray.shape[:2]
+    for i, (x, y, w, h) in enumerate(faces):
+        roi = gray[max(0, y):min(frame_h, y + h), max(0, x):min(frame_w, x + w)]
+        if roi.size > 0:
+            cv2.resize(roi, (size, size), dst=crops[i], interpolation=cv2.INTER_AREA)
+            valid[i] = True
+
+    # Normalize the whole batch at once
+    batch = crops.astype(np.float32)
+    mean = batch.mean(axis=(1, 2), keepdims=True)
+    std = batch.std(axis=(1, 2), keepdims=True)
+    batch -= mean
+    batch /= np.maximum(std, 1e-6)
+    return batch, valid
+
 
 class EmotionDetector:
-    def __init__(self):
-        # Load OpenCV's pre-trained face detection model
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        
+    def __init__(self, seed=None, backend=None):
         # Emotion labels
-        self.emotion_labels = ['angry', 'disgust', 'fear', 'happy', 'neutral', 'sad', 'surprise']
+        self.emotion_labels = list(EMOTION_LABELS)
+        
+        # Classifier for batches of face crops; by default the simulation,
+        # which is deterministic with a seed. Imported here because the
+        # backends module uses EMOTION_LABELS from this one.
+        if backend is None:
+            from emotion_backends import SimulatedBackend
+            backend = SimulatedBackend(seed, self.emotion_labels)
+        self.backend = backend
+    
+    @property
+    def face_cascade(self):
+        """OpenCV's pre-trained face detection model, loaded on first use"""
+        return get_cascade(FACE_CASCADE)
         
+    def detect_faces(self, frame):
+        """Convert a frame to grayscale and run the face cascade on it"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
+        return gray, faces
+    
     def detect_emotions(self, frame):
         """Detect emotions in a frame using face detection and simulation"""
         try:
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
-            
-            emotions = {}
+            gray, faces = self.detect_faces(frame)
+            return self.detect_emotions_in_faces(gray, faces)
             
+        except Exception as e:
+            print(f"Error in emotion detection: {e}")
+            return self._get_default_emotions()
+    
+    def detect_emotions_in_faces(self, gray, faces):
+        """Detect emotions from already detected faces in a grayscale frame
+
+        Returns the emotions of the first face; see detect_emotions_batch
+        for every face.
+        """
+        try:
             if len(faces) > 0:
-                # Use the first detected face
-                (x, y, w, h) = faces[0]
-                
-                # Extract face region
-                face_roi = gray[y:y+h, x:x+w]
-                
-                if face_roi.size > 0:
-                    # Simulate realistic emotion detection
-                    emotions = self._simulate_realistic_emotions(face_roi)
-                else:
-                    emotions = self._get_default_emotions()
-            else:
-                emotions = self._get_default_emotions()
-            
-            return emotions
+                scores = self.detect_emotions_batch(gray, faces[:1])
+                return dict(zip(self.emotion_labels, scores[0].tolist()))
+            return self._get_default_emotions()
             
         except Exception as e:
             print(f"Error in emotion detection: {e}")
             return self._get_default_emotions()
     
-    
-    def _simulate_realistic_emotions(self, face_roi):
-        """Simulate realistic emotion detection based on basic face analysis"""
-        # Analyze basic face features for emotion simulation
-        
-        # Calculate some basic features
-        height, width = face_roi.shape
-        
-        # Simple heuristics for emotion simulation
-        # In a real implementation, you'd use ML models trained on emotion datasets
-        
-        # Base emotions with realistic variations
-        base_emotions = {
-            'happy': 0.2 + random.random() * 0.4,
-            'neutral': 0.3 + random.random() * 0.3,
-            'surprise': 0.1 + random.random() * 0.2,
-            'sad': 0.05 + random.random() * 0.15,
-            'angry': 0.05 + random.random() * 0.1,
-            'fear': 0.02 + random.random() * 0.08,
-            'disgust': 0.02 + random.random() * 0.05
-        }
-        
-        # Add some time-based variation for demo realism
-        time_factor = time.time() % 10  # 10-second cycle
-        if time_factor < 2:
-            base_emotions['happy'] += 0.2
-        elif time_factor < 4:
-            base_emotions['neutral'] += 0.2
-        elif time_factor < 6:
-            base_emotions['surprise'] += 0.1
-        else:
-            base_emotions['sad'] += 0.1
-        
-        # Normalize to sum to 1
-        total = sum(base_emotions.values())
-        normalized_emotions = {k: v/total for k, v in base_emotions.items()}
-        
-        return normalized_emotions
+    def detect_emotions_batch(self, gray, faces):
+        """Score every face rect in one vectorized call
+
+        Returns an (N, 7) float32 array of probabilities in label order, one
+        row per rect in ``faces``. Empty face regions get the default scores.
+        """
+        default = np.array([self._get_default_emotions().get(label, 0.0)
+                            for label in self.emotion_labels], dtype=np.float32)
+        try:
+            batch, valid = prepare_face_batch(gray, faces)
+            scores = np.tile(default, (len(batch), 1))
+            if valid.any():
+                scores[valid] = self.backend.predict(batch[valid])
+            return scores
+            
+        except Exception as e:
+            print(f"Error in batched emotion detection: {e}")
+            return np.tile(default, (len(faces), 1))
     
     def _get_default_emotions(self):
         """Return default emotion values when detection fails"""
@@ -0,0 +1,200 @@
+"""
+Emotion History Module
+Fixed-capacity, NumPy-backed per-session emotion history with rolling
+aggregates that are updated incrementally as samples arrive
+"""
+
+import threading
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+from emotion_detector import EMOTION_LABELS
+
+# Rolling aggregate windows in seconds
+DEFAULT_WINDOWS = {'10s': 10, '60s': 60, '5min': 300}
+
+
+def select_samples(timestamps, probabilities, start=None, end=None, limit=None, points=None):
+    """Filter time-ordered samples to [start, end], keep the newest ``limit``
+    and downsample to at most ``points`` averaged buckets"""
+    # Samples are in time order, so ranges are binary searches
+    lo = np.searchsorted(timestamps, start, side='left') if start is not None else 0
+    hi = np.searchsorted(timestamps, end, side='right') if end is not None else len(timestamps)
+    if limit is not None:
+        lo = max(lo, hi - limit)
+    timestamps = timestamps[lo:hi]
+    probabilities = probabilities[lo:hi]
+
+    if points is not None and 0 < points < len(timestamps):
+        bounds = np.linspace(0, len(timestamps), points + 1).astype(np.int64)[:-1]
+        counts = np.diff(np.append(bounds, len(timestamps)))
+        timestamps = np.add.reduceat(timestamps, bounds) / counts
+        probabilities = np.add.reduceat(probabilities, bounds, axis=0) / counts[:, None]
+
+    return timestamps, probabilities
+
+
+def emotion_entries(timestamps, probabilities, labels=EMOTION_LABELS):
+    """Convert samples to the emotion history JSON entries"""
+    entries = []
+    dominant = np.argmax(probabilities, axis=1) if len(probabilities) else []
+    for timestamp, row, best in zip(timestamps.tolist(), probabilities.tolist(), dominant):
+        entries.append({
+            'timestamp': datetime.fromtimestamp(timestamp).isoformat(),
+            'emotion': labels[best],
+            'confidence': row[best],
+            'all_emotions': dict(zip(labels, row))
+        })
+    return entries
+
+
+class _RollingWindow:
+    """Running sum and per-emotion max over the samples of the last ``seconds``
+
+    The max is kept with one monotonic queue per emotion, so adding and
+    evicting a sample are amortized O(1).
+    """
+    def __init__(self, seconds, num_labels):
+        self.seconds = seconds
+        self.start = 0  # sequence number of the oldest sample in the window
+        self.end = 0    # sequence number after the newest sample
+        self.sum = np.zeros(num_labels, dtype=np.float64)
+        self.max_queues = [deque() for _ in range(num_labels)]
+
+    def add(self, seq, values):
+        self.sum += values
+        self.end = seq + 1
+        for queue, value in zip(self.max_queues, values.tolist()):
+            while queue and queue[-1][1] <= value:
+                queue.pop()
+            queue.append((seq, value))
+
+    def evict_oldest(self, values):
+        self.sum -= values
+        for queue in self.max_queues:
+            if queue and queue[0][0] == self.start:
+                queue.popleft()
+        self.start += 1
+
+    @property
+    def count(self):
+        return self.end - self.start
+
+
+class EmotionRingBuffer:
+    """Timestamps plus an (N, 7) emotion-probability array in a ring buffer"""
+    def __init__(self, capacity=3000, windows=None, labels=EMOTION_LABELS):
+        self.capacity = capacity
+        self.labels = list(labels)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.probabilities = np.zeros((capacity, len(self.labels)), dtype=np.float32)
+        self.total = 0  # samples ever appended; the next sample's sequence number
+
+        self.windows = {name: _RollingWindow(seconds, len(self.labels))
+                        for name, seconds in (windows or DEFAULT_WINDOWS).items()}
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def append(self, timestamp, emotions):
+        """Add one sample; ``emotions`` is a dict by label or an array in label order"""
+        if isinstance(emotions, dict):
+            values = np.array([emotions.get(label, 0.0) for label in self.labels], dtype=np.float32)
+        else:
+            values = np.asarray(emotions, dtype=np.float32)
+
+        seq = self.total
+        index = seq % self.capacity
+
+        # The slot about to be overwritten must leave every window first
+        overwritten = seq - self.capacity
+        for window in self.windows.values():
+            while window.count and window.start <= overwritten:
+                window.evict_oldest(self.probabilities[window.start % self.capacity])
+
+        self.timestamps[index] = timestamp
+        self.probabilities[index] = values
+        self.total += 1
+
+        for window in self.windows.values():
+            window.add(seq, values)
+        self.expire(timestamp)
+
+    def expire(self, now):
+        """Evict samples older than each window from its aggregates"""
+        for window in self.windows.values():
+            cutoff = now - window.seconds
+            while window.count and self.timestamps[window.start % self.capacity] < cutoff:
+                window.evict_oldest(self.probabilities[window.start % self.capacity])
+
+    def aggregates(self, now=None):
+        """Mean, max and dominant emotion over every rolling window"""
+        if now is not None:
+            self.expire(now)
+
+        result = {}
+        for name, window in self.windows.items():
+            if window.count == 0:
+                result[name] = {'count': 0, 'mean': {}, 'max': {}, 'dominant': None}
+                continue
+
+            mean = window.sum / window.count
+            result[name] = {
+                'count': window.count,
+                'mean': dict(zip(self.labels, mean.tolist())),
+                'max': {label: queue[0][1] for label, queue in zip(self.labels, window.max_queues)},
+                'dominant': self.labels[int(np.argmax(mean))]
+            }
+        return result
+
+    def query(self, start=None, end=None, limit=None, points=None):
+        """Samples in time order, optionally within [start, end]
+
+        ``limit`` keeps only the newest samples; ``points`` downsamples the
+        result to at most that many averaged buckets. Returns timestamps and
+        an (N, 7) probability array.
+        """
+        order = (np.arange(self.total - len(self), self.total) % self.capacity)
+        return select_samples(self.timestamps[order], self.probabilities[order], start, end, limit, points)
+
+    def to_entries(self, timestamps, probabilities):
+        """Convert query() output to the emotion history JSON entries"""
+        return emotion_entries(timestamps, probabilities, self.labels)
+
+
+class SessionHistories:
+    """Emotion ring buffer and bounded conversation history per session"""
+    def __init__(self, capacity=3000, conversation_capacity=200, windows=None):
+        self.capacity = capacity
+        self.conversation_capacity = conversation_capacity
+        self.windows = windows
+        self._emotions = {}
+        self._conversations = {}
+        self._lock = threading.Lock()
+
+    def emotions(self, session, create=True):
+        """The session's emotion ring buffer, created on first use unless ``create`` is False"""
+        with self._lock:
+            buffer = self._emotions.get(session)
+            if buffer is None and create:
+                buffer = self._emotions[session] = EmotionRingBuffer(self.capacity, self.windows)
+            return buffer
+
+    def conversation(self, session, create=True):
+        """The session's conversation history deque, created on first use unless ``create`` is False"""
+        with self._lock:
+            history = self._conversations.get(session)
+            if history is None and create:
+                history = self._conversations[session] = deque(maxlen=self.conversation_capacity)
+            return history
+
+    def remove(self, session):
+        """Free everything stored for a session"""
+        with self._lock:
+            self._emotions.pop(session, None)
+            self._conversations.pop(session, None)
+
+    def session_count(self):
+        with self._lock:
+            return len(set(self._emotions) | set(self._conversations))
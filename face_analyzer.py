@@ -6,14 +6,136 @@ Uses OpenCV for basic face detection and landmark simulation
 import cv2
 import numpy as np
 from typing import List, Dict, Tuple
+from model_registry import FACE_CASCADE, get_cascade
+
+NUM_LANDMARKS = 468
+
+# Index ranges of the simulated face regions (same layout the frontend uses)
+REGION_SLICES = {
+    'left_eye': slice(33, 39),
+    'right_eye': slice(39, 45),
+    'mouth': slice(45, 53),
+    'eyebrows': slice(17, 27),
+    'nose': slice(27, 32)
+}
+
+
+def _build_landmark_template():
+    """Build the fixed part of the simulated landmarks in face-relative units
+
+    Returns the (468, 2) offsets as fractions of the face width/height and a
+    (468, 1) mask of the points that get random jitter.
+    """
+    points = []
+    
+    # Face outline (jawline)
+    for i in range(17):
+        points.append((i / 16.0, 0.8 + np.sin(i * 0.3) * 0.1))
+    
+    # Left and right eyebrows
+    for i in range(5):
+        points.append((0.2 + i * 0.1, 0.25))
+    for i in range(5):
+        points.append((0.6 + i * 0.1, 0.25))
+    
+    # Left and right eyes
+    for center_x in (0.3, 0.7):
+        for i in range(6):
+            angle = i * np.pi / 3
+            points.append((center_x + np.cos(angle) * 0.05, 0.35 + np.sin(angle) * 0.03))
+    
+    # Nose
+    for i in range(5):
+        points.append((0.5, 0.4 + i * 0.05))
+    
+    # Mouth
+    for i in range(8):
+        angle = i * np.pi / 4
+        points.append((0.5 + np.cos(angle) * 0.08, 0.7 + np.sin(angle) * 0.04))
+    
+    # Fill the rest with distributed points across the face
+    remaining_points = NUM_LANDMARKS - len(points)
+    rows = remaining_points // 20 + 1
+    for i in range(remaining_points):
+        points.append(((i % 20) / 20, (i // 20) / rows))
+    
+    template = np.array(points, dtype=np.float32)
+    jitter_mask = np.zeros((NUM_LANDMARKS, 1), dtype=np.float32)
+    jitter_mask[NUM_LANDMARKS - remaining_points:] = 1.0
+    return template, jitter_mask
+
+
+LANDMARK_TEMPLATE, LANDMARK_JITTER_MASK = _build_landmark_template()
+
+
+def landmarks_to_dicts(landmarks):
+    """Return a (468, 2) landmark array as the legacy list of {'x', 'y'} dicts"""
+    return [{'x': x, 'y': y} for x, y in np.asarray(landmarks, dtype=np.float64).tolist()]
+
+
+# Colors (BGR) of the emotion overlay
+EMOTION_COLORS = {
+    'happy': (0, 255, 0),      # Green
+    'sad': (255, 0, 0),        # Blue
+    'angry': (0, 0, 255),      # Red
+    'surprise': (255, 255, 0), # Yellow
+    'fear': (128, 0, 128),     # Purple
+    'disgust': (0, 128, 128),  # Teal
+    'neutral': (128, 128, 128) # Gray
+}
+
+_disk_kernels = {}
+
+
+def disk_kernel(radius):
+    """Structuring element with the same pixels as a filled cv2.circle of ``radius``"""
+    if radius not in _disk_kernels:
+        dy, dx = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+        _disk_kernels[radius] = (dx * dx + dy * dy <= radius * radius).astype(np.uint8)
+    return _disk_kernels[radius]
+
+
+def stamp_points(image, points, radius, color):
+    """Draw filled circles at all ``points`` without a per-point call
+
+    The points are set in a mask over their bounding box, grown into disks
+    with one dilation and the color is copied through the mask.
+    """
+    points = np.asarray(points).astype(np.int32).reshape(-1, 2)
+    if len(points) == 0:
+        return image
+
+    low = points.min(axis=0) - radius
+    high = points.max(axis=0) + radius + 1
+    mask = np.zeros((high[1] - low[1], high[0] - low[0]), dtype=np.uint8)
+    local = points - low
+    mask[local[:, 1], local[:, 0]] = 255
+    if radius > 0:
+        mask = cv2.dilate(mask, disk_kernel(radius))
+
+    # Only the part of the box inside the image is drawn
+    height, width = image.shape[:2]
+    x0, y0 = max(low[0], 0), max(low[1], 0)
+    x1, y1 = min(high[0], width), min(high[1], height)
+    if x1 <= x0 or y1 <= y0:
+        return image
+
+    region = image[y0:y1, x0:x1]
+    solid = np.empty_like(region)
+    cv2.rectangle(solid, (0, 0), (x1 - x0, y1 - y0), color, -1)
+    cv2.copyTo(solid, mask[y0 - low[1]:y1 - low[1], x0 - low[0]:x1 - low[0]], region)
+    return image
+
+
+def as_landmark_array(landmarks):
+    """Accept landmarks as an array or as the legacy list of dicts"""
+    if isinstance(landmarks, np.ndarray):
+        return landmarks
+    return np.array([(p['x'], p['y']) for p in landmarks], dtype=np.float32).reshape(-1, 2)
+
 
 class FaceAnalyzer:
-    def __init__(self):
-        # Load OpenCV's pre-trained face detection model
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        self.eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
-        self.smile_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_smile.xml')
-        
+    def __init__(self, seed=None):
         # Simulated face regions for visualization
         self.face_regions = {
             'left_eye': [],
@@ -22,24 +144,46 @@ class FaceAnalyzer:
             'eyebrows': [],
             'nose': []
         }
+        
+        # Random generator for landmark jitter; seed it for reproducible output
+        self._rng = np.random.default_rng(seed)
+    
+    @property
+    def face_cascade(self):
+        """OpenCV's pre-trained face detection model, loaded on first use"""
+        return get_cascade(FACE_CASCADE)
     
     def analyze_face(self, frame):
         """Analyze face and return simulated landmark data"""
         try:
             gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
             faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
+            return self.analyze_faces(faces)
             
+        except Exception as e:
+            print(f"Error in face analysis: {e}")
+            return []
+    
+    def analyze_faces(self, faces):
+        """Return simulated landmark data for already detected face rects
+
+        Each face's 'landmarks' is a (468, 2) float32 view into one batch
+        array; use landmarks_to_dicts() where the old dict format is needed.
+        """
+        try:
             landmarks_data = []
             
             if len(faces) > 0:
-                for (x, y, w, h) in faces:
-                    # Generate simulated landmarks for the face
-                    landmarks = self._generate_simulated_landmarks(x, y, w, h)
-                    
+                # Generate simulated landmarks for all faces at once
+                all_landmarks = self.generate_landmarks(faces)
+                features = self._extract_emotion_features(all_landmarks)
+                
+                for i, (x, y, w, h) in enumerate(faces):
+                    landmarks = all_landmarks[i]
                     landmarks_data.append({
                         'landmarks': landmarks,
                         'regions': self._get_region_coordinates(landmarks),
-                        'emotion_features': self._extract_emotion_features(landmarks),
+                        'emotion_features': {k: v[i] for k, v in features.items()},
                         'face_rect': (x, y, w, h)
                     })
             
@@ -49,136 +193,89 @@ class FaceAnalyzer:
             print(f"Error in face analysis: {e}")
             return []
     
+    def generate_landmarks(self, faces):
+        """Generate simulated landmarks for a batch of face rects
+
+        Returns a (faces, 468, 2) float32 array of x, y pixel coordinates.
+        """
+        rects = np.asarray(faces, dtype=np.float32).reshape(-1, 4)
+        origin = rects[:, None, :2]
+        size = rects[:, None, 2:]
+        
+        # One batched draw for the jitter of every point of every face
+        noise = self._rng.normal(0, 0.02, size=(len(rects), NUM_LANDMARKS, 2)).astype(np.float32)
+        return origin + (LANDMARK_TEMPLATE + noise * LANDMARK_JITTER_MASK) * size
+    
     def _generate_simulated_landmarks(self, x, y, w, h):
         """Generate simulated facial landmarks for a detected face"""
-        landmarks = []
-        
-        # Generate landmarks in a grid pattern across the face
-        # This simulates the 468 MediaPipe landmarks
-        
-        # Face outline (jawline)
-        for i in range(17):
-            px = x + (i / 16.0) * w
-            py = y + h * 0.8 + np.sin(i * 0.3) * h * 0.1
-            landmarks.append({'x': px, 'y': py})
-        
-        # Left eyebrow
-        for i in range(5):
-            px = x + w * (0.2 + i * 0.1)
-            py = y + h * 0.25
-            landmarks.append({'x': px, 'y': py})
-        
-        # Right eyebrow
-        for i in range(5):
-            px = x + w * (0.6 + i * 0.1)
-            py = y + h * 0.25
-            landmarks.append({'x': px, 'y': py})
-        
-        # Left eye
-        for i in range(6):
-            angle = i * np.pi / 3
-            px = x + w * 0.3 + np.cos(angle) * w * 0.05
-            py = y + h * 0.35 + np.sin(angle) * h * 0.03
-            landmarks.append({'x': px, 'y': py})
-        
-        # Right eye
-        for i in range(6):
-            angle = i * np.pi / 3
-            px = x + w * 0.7 + np.cos(angle) * w * 0.05
-            py = y + h * 0.35 + np.sin(angle) * h * 0.03
-            landmarks.append({'x': px, 'y': py})
-        
-        # Nose
-        for i in range(5):
-            px = x + w * 0.5
-            py = y + h * (0.4 + i * 0.05)
-            landmarks.append({'x': px, 'y': py})
-        
-        # Mouth
-        for i in range(8):
-            angle = i * np.pi / 4
-            px = x + w * 0.5 + np.cos(angle) * w * 0.08
-            py = y + h * 0.7 + np.sin(angle) * h * 0.04
-            landmarks.append({'x': px, 'y': py})
-        
-        # Fill the rest with distributed points across the face
-        remaining_points = 468 - len(landmarks)
-        for i in range(remaining_points):
-            px = x + (i % 20) * w / 20 + np.random.normal(0, w * 0.02)
-            py = y + (i // 20) * h / (remaining_points // 20 + 1) + np.random.normal(0, h * 0.02)
-            landmarks.append({'x': px, 'y': py})
-        
-        return landmarks[:468]  # Limit to 468 points
+        return self.generate_landmarks([(x, y, w, h)])[0]
     
     def _get_region_coordinates(self, landmarks):
-        """Get coordinates for specific face regions based on simulated landmarks"""
-        regions = {}
-        
+        """Get coordinates for specific face regions based on simulated landmarks
+
+        Regions are views into the landmark array, not copies.
+        """
         if len(landmarks) >= 50:
-            # Map landmark indices to face regions (simplified)
-            regions['left_eye'] = landmarks[33:39] if len(landmarks) > 39 else landmarks[10:16]
-            regions['right_eye'] = landmarks[39:45] if len(landmarks) > 45 else landmarks[16:22]
-            regions['mouth'] = landmarks[45:53] if len(landmarks) > 53 else landmarks[22:30]
-            regions['eyebrows'] = landmarks[17:27] if len(landmarks) > 27 else landmarks[5:15]
-            regions['nose'] = landmarks[27:32] if len(landmarks) > 32 else landmarks[30:35]
-        else:
-            # Fallback for insufficient landmarks
-            regions = {region: [] for region in self.face_regions.keys()}
+            return {region: landmarks[index] for region, index in REGION_SLICES.items()}
         
-        return regions
+        # Fallback for insufficient landmarks
+        return {region: [] for region in self.face_regions.keys()}
     
     def _extract_emotion_features(self, landmarks):
-        """Extract features that indicate emotions from simulated landmarks"""
+        """Extract features that indicate emotions from simulated landmarks
+
+        Works on one face (468, 2) or a batch (faces, 468, 2); values are
+        floats for a single face and lists of floats for a batch.
+        """
         try:
+            landmarks = as_landmark_array(landmarks)
             features = {}
             
-            if len(landmarks) >= 50:
+            if landmarks.shape[-2] >= 50:
+                xs = landmarks[..., 0]
+                ys = landmarks[..., 1]
+                
                 # Mouth curve (smile detection) - using simulated mouth landmarks
-                mouth_points = landmarks[45:53] if len(landmarks) > 53 else landmarks[22:30]
-                if len(mouth_points) >= 4:
-                    mouth_left = mouth_points[0]
-                    mouth_right = mouth_points[3]
-                    mouth_top = mouth_points[1]
-                    mouth_bottom = mouth_points[2]
-                    
-                    mouth_width = abs(mouth_right['x'] - mouth_left['x'])
-                    mouth_height = abs(mouth_bottom['y'] - mouth_top['y'])
-                    
-                    features['mouth_curve'] = mouth_height / mouth_width if mouth_width > 0 else 0
+                mouth = REGION_SLICES['mouth'].start
+                mouth_width = np.abs(xs[..., mouth + 3] - xs[..., mouth])
+                mouth_height = np.abs(ys[..., mouth + 2] - ys[..., mouth + 1])
+                safe_width = np.where(mouth_width > 0, mouth_width, 1)
+                features['mouth_curve'] = np.where(mouth_width > 0, mouth_height / safe_width, 0)
                 
                 # Eye openness - using simulated eye landmarks
-                left_eye_points = landmarks[33:39] if len(landmarks) > 39 else landmarks[10:16]
-                right_eye_points = landmarks[39:45] if len(landmarks) > 45 else landmarks[16:22]
-                
-                if len(left_eye_points) >= 4 and len(right_eye_points) >= 4:
-                    left_eye_openness = abs(left_eye_points[1]['y'] - left_eye_points[3]['y'])
-                    right_eye_openness = abs(right_eye_points[1]['y'] - right_eye_points[3]['y'])
-                    features['eye_openness'] = (left_eye_openness + right_eye_openness) / 2
+                left_eye = REGION_SLICES['left_eye'].start
+                right_eye = REGION_SLICES['right_eye'].start
+                left_eye_openness = np.abs(ys[..., left_eye + 1] - ys[..., left_eye + 3])
+                right_eye_openness = np.abs(ys[..., right_eye + 1] - ys[..., right_eye + 3])
+                features['eye_openness'] = (left_eye_openness + right_eye_openness) / 2
                 
-                # Eyebrow position (surprise/anger indicator)
-                eyebrow_points = landmarks[17:27] if len(landmarks) > 27 else landmarks[5:15]
-                if len(eyebrow_points) >= 4:
-                    avg_eyebrow_y = sum(p['y'] for p in eyebrow_points[:4]) / 4
-                    avg_eye_y = sum(p['y'] for p in (left_eye_points + right_eye_points)[:8]) / 8
-                    features['eyebrow_height'] = abs(avg_eyebrow_y - avg_eye_y)
+                # Eyebrow position (surprise/anger indicator): first four eyebrow
+                # points against the six left eye and first two right eye points
+                eyebrows = REGION_SLICES['eyebrows'].start
+                avg_eyebrow_y = ys[..., eyebrows:eyebrows + 4].mean(axis=-1)
+                avg_eye_y = ys[..., left_eye:left_eye + 8].mean(axis=-1)
+                features['eyebrow_height'] = np.abs(avg_eyebrow_y - avg_eye_y)
             
-            return features
+            return {k: np.asarray(v, dtype=np.float64).tolist() for k, v in features.items()}
             
         except Exception as e:
             print(f"Error extracting emotion features: {e}")
             return {}
     
-    def draw_face_mesh(self, frame, landmarks_data):
-        """Draw simulated face mesh on frame"""
+    def draw_face_mesh(self, frame, landmarks_data, out=None):
+        """Draw simulated face mesh on frame
+
+        Draws into ``frame``, or into ``out`` (a buffer of the same shape)
+        after copying the frame there.
+        """
+        if out is not None and out is not frame:
+            np.copyto(out, frame)
+            frame = out
         try:
             if landmarks_data:
                 for face_data in landmarks_data:
-                    landmarks = face_data['landmarks']
-                    
-                    # Draw landmarks as small circles
-                    for landmark in landmarks:
-                        x, y = int(landmark['x']), int(landmark['y'])
-                        cv2.circle(frame, (x, y), 1, (0, 255, 0), -1)
+                    # Draw landmarks as small filled circles, all at once
+                    stamp_points(frame, as_landmark_array(face_data['landmarks']), 1, (0, 255, 0))
                     
                     # Draw face rectangle if available
                     if 'face_rect' in face_data:
@@ -191,43 +288,33 @@ class FaceAnalyzer:
             print(f"Error drawing face mesh: {e}")
             return frame
     
-    def get_face_emotions_overlay(self, frame, landmarks_data, emotions):
-        """Create an overlay showing emotion levels on face regions"""
-        overlay = frame.copy()
+    def get_face_emotions_overlay(self, frame, landmarks_data, emotions, out=None):
+        """Create an overlay showing emotion levels on face regions
+
+        Renders into a copy of ``frame``, or into ``out`` when given; pass
+        ``out=frame`` to draw on the frame itself without copying.
+        """
+        if out is None:
+            overlay = frame.copy()
+        else:
+            if out is not frame:
+                np.copyto(out, frame)
+            overlay = out
         
         try:
             if landmarks_data and emotions:
                 face_data = landmarks_data[0]
-                landmarks = face_data['landmarks']
-                
-                # Define colors for different emotions
-                emotion_colors = {
-                    'happy': (0, 255, 0),      # Green
-                    'sad': (255, 0, 0),        # Blue
-                    'angry': (0, 0, 255),      # Red
-                    'surprise': (255, 255, 0), # Yellow
-                    'fear': (128, 0, 128),     # Purple
-                    'disgust': (0, 128, 128),  # Teal
-                    'neutral': (128, 128, 128) # Gray
-                }
+                landmarks = as_landmark_array(face_data['landmarks'])
                 
                 # Get dominant emotion
                 dominant_emotion = max(emotions.items(), key=lambda x: x[1])
                 emotion_name = dominant_emotion[0]
                 emotion_intensity = dominant_emotion[1]
                 
-                # Draw emotion indicators on face landmarks
-                if emotion_name in emotion_colors:
-                    color = emotion_colors[emotion_name]
-                    
-                    # Draw circles on all landmarks with intensity-based sizing
-                    for landmark in landmarks:
-                        x = int(landmark['x'])
-                        y = int(landmark['y'])
-                        
-                        # Draw circles with size based on emotion intensity
-                        radius = max(1, int(2 + emotion_intensity * 4))
-                        cv2.circle(overlay, (x, y), radius, color, -1)
+                # Draw emotion indicators on face landmarks, sized by intensity
+                if emotion_name in EMOTION_COLORS:
+                    radius = max(1, int(2 + emotion_intensity * 4))
+                    stamp_points(overlay, landmarks, radius, EMOTION_COLORS[emotion_name])
                 
                 # Add emotion text overlay
                 if 'face_rect' in face_data:
@@ -240,11 +327,11 @@ class FaceAnalyzer:
                 bar_x = 10
                 bar_y = 50
                 for emotion, confidence in emotions.items():
-                    if emotion in emotion_colors:
+                    if emotion in EMOTION_COLORS:
                         # Draw emotion bar
                         bar_width = int(confidence * 200)
                         cv2.rectangle(overlay, (bar_x, bar_y), (bar_x + bar_width, bar_y + 15), 
-                                    emotion_colors[emotion], -1)
+                                    EMOTION_COLORS[emotion], -1)
                         cv2.putText(overlay, f"{emotion}: {confidence:.2f}", 
                                    (bar_x + 210, bar_y + 12), cv2.FONT_HERSHEY_SIMPLEX, 0.5, 
                                    (255, 255, 255), 1)
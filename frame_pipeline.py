@@ -0,0 +1,345 @@
+"""
+Frame Analysis Pipeline
+Converts each frame to grayscale and runs face detection once, then shares
+the detected faces with the emotion detector and the face analyzer
+"""
+
+import base64
+import time
+
+import cv2
+import numpy as np
+from emotion_detector import EmotionDetector, EMOTION_LABELS, FACE_INPUT_SIZE
+from face_analyzer import FaceAnalyzer, NUM_LANDMARKS, landmarks_to_dicts
+from metrics import StageTimer
+
+
+# imdecode flags that decode a JPEG straight to grayscale at 1/n resolution
+GRAYSCALE_DECODE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8
+}
+
+
+def decode_frame(image, reduction=1, color=False):
+    """Decode a JPEG video frame sent by the client
+
+    ``image`` is the raw bytes of the binary protocol or a legacy base64 data
+    URL. Colour frames are only decoded when asked for; otherwise the JPEG is
+    decoded directly to grayscale, reduced by ``reduction`` (1, 2, 4 or 8).
+    Returns the frame and the factor that maps its coordinates back to the
+    full-size image.
+    """
+    if isinstance(image, str):
+        image = base64.b64decode(image.split(',', 1)[-1])
+    buffer = np.frombuffer(image, np.uint8)
+
+    if color:
+        frame = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+        reduction = 1
+    else:
+        frame = cv2.imdecode(buffer, GRAYSCALE_DECODE_FLAGS[reduction])
+
+    if frame is None:
+        raise ValueError("Could not decode video frame")
+    return frame, reduction
+
+
+def serialize_faces(landmarks_data, face_emotions=None):
+    """Convert face analysis results to the JSON-serializable emotion_detected format
+
+    ``face_emotions`` is an optional (N, 7) array of per-face emotion scores,
+    aligned with ``landmarks_data``.
+    """
+    serializable_faces = []
+    for i, face_data in enumerate(landmarks_data or []):
+        serializable_face = {}
+        if face_emotions is not None and i < len(face_emotions):
+            serializable_face['emotions'] = dict(zip(EMOTION_LABELS, face_emotions[i].tolist()))
+        if 'landmarks' in face_data:
+            serializable_face['landmarks'] = landmarks_to_dicts(face_data['landmarks'])
+        if 'face_rect' in face_data:
+            x, y, w, h = face_data['face_rect']
+            serializable_face['face_rect'] = [int(x), int(y), int(w), int(h)]
+        if 'emotion_features' in face_data:
+            serializable_face['emotion_features'] = {
+                k: float(v) for k, v in face_data['emotion_features'].items()
+            }
+        serializable_faces.append(serializable_face)
+    return serializable_faces
+
+
+def _as_rects(faces):
+    """detectMultiScale returns an empty tuple when nothing is found"""
+    if len(faces) == 0:
+        return np.empty((0, 4), dtype=np.int32)
+    return np.asarray(faces, dtype=np.int32).reshape(-1, 4)
+
+
+class FrameResult:
+    """Everything computed for a single frame"""
+    def __init__(self, gray, faces, emotions, landmarks_data, tracked=False, scale=1.0,
+                 reused=False, face_emotions=None):
+        self.gray = gray
+        # Face rects in the coordinates of ``gray``; landmarks_data is in the
+        # coordinates of the original image, ``scale`` times larger
+        self.faces = faces
+        self.scale = scale
+        # Emotions of the first face, and an (N, 7) array with a row per face
+        self.emotions = emotions
+        if face_emotions is None:
+            face_emotions = np.empty((0, len(EMOTION_LABELS)), dtype=np.float32)
+        self.face_emotions = face_emotions
+        self.landmarks_data = landmarks_data
+        # True when the faces came from the tracker instead of a full detection
+        self.tracked = tracked
+        # True when the whole result was reused from a near-identical frame
+        self.reused = reused
+        # Seconds spent in each stage of producing the result
+        self.timings = {}
+
+    @property
+    def face_rois(self):
+        """Grayscale regions of interest for every detected face"""
+        if self.gray is None:
+            return []
+        return [self.gray[y:y+h, x:x+w] for (x, y, w, h) in self.faces]
+
+    @property
+    def landmarks(self):
+        """(faces, 468, 2) float32 landmark array for every detected face"""
+        if not self.landmarks_data:
+            return np.empty((0, NUM_LANDMARKS, 2), dtype=np.float32)
+        return np.stack([face['landmarks'] for face in self.landmarks_data])
+
+
+class SceneCache:
+    """Reuses the last analysis while the scene stays still
+
+    Each analysed frame is reduced to a ``thumb_size`` grayscale thumbnail.
+    A new frame reuses the cached result when its thumbnail differs from the
+    one of the analysed frame by less than ``threshold`` grey levels on
+    average and by at most ``cell_threshold`` in every cell, as long as the
+    cached result is younger than ``max_age`` seconds.
+    """
+    def __init__(self, threshold=2.0, cell_threshold=12.0, max_age=1.0, thumb_size=(32, 24),
+                 clock=time.time):
+        self.threshold = threshold
+        self.cell_threshold = cell_threshold
+        self.max_age = max_age
+        self.thumb_size = thumb_size
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+        self._thumbnail = None
+        self._key = None
+        self._entry = None
+        self._stored_at = 0.0
+
+    def thumbnail(self, gray):
+        return cv2.resize(gray, self.thumb_size, interpolation=cv2.INTER_AREA)
+
+    def lookup(self, thumbnail, gray, scale):
+        """The cached result for this frame, or None if it must be analysed"""
+        if (self._entry is not None and self._key == (gray.shape, scale)
+                and self.clock() - self._stored_at < self.max_age):
+            diff = cv2.absdiff(thumbnail, self._thumbnail)
+            if diff.mean() < self.threshold and diff.max() <= self.cell_threshold:
+                self.hits += 1
+                faces, emotions, face_emotions, landmarks_data = self._entry
+                return FrameResult(gray, faces, emotions, landmarks_data, True, scale,
+                                   reused=True, face_emotions=face_emotions)
+
+        self.misses += 1
+        return None
+
+    def store(self, thumbnail, result):
+        # The frame itself is not kept, only what is needed to rebuild a result
+        self._thumbnail = thumbnail
+        self._key = (result.gray.shape, result.scale)
+        self._entry = (result.faces, result.emotions, result.face_emotions, result.landmarks_data)
+        self._stored_at = self.clock()
+
+    def reset(self):
+        self._entry = None
+        self._thumbnail = None
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class FaceTracker:
+    """Per-session state for detect-then-track mode
+
+    A full detection runs every ``detect_interval`` frames. In between, each
+    face is searched for only inside its previous rect enlarged by
+    ``roi_margin``, restricted to sizes within ``size_tolerance`` of the last
+    one. Losing any face counts as low tracking confidence and forces a full
+    detection on the same frame.
+
+    With a ``scene_cache``, frames that barely differ from the last analysed
+    one skip detection and analysis altogether.
+    """
+    def __init__(self, detect_interval=5, roi_margin=0.5, size_tolerance=0.3, scene_cache=None):
+        self.detect_interval = detect_interval
+        self.roi_margin = roi_margin
+        self.size_tolerance = size_tolerance
+        self.scene_cache = scene_cache
+
+        self.faces = np.empty((0, 4), dtype=np.int32)
+        self.frames_since_detection = 0
+
+    def needs_detection(self):
+        """Whether the next frame should get a full detection"""
+        return len(self.faces) == 0 or self.frames_since_detection >= self.detect_interval
+
+    def reset(self):
+        """Forget tracked faces so the next frame is fully detected"""
+        self.faces = np.empty((0, 4), dtype=np.int32)
+        self.frames_since_detection = 0
+        if self.scene_cache is not None:
+            self.scene_cache.reset()
+
+
+class FramePipeline:
+    def __init__(self, emotion_detector=None, face_analyzer=None, detect_scale=1.0, seed=None):
+        # ``seed`` makes the components created here deterministic
+        self.emotion_detector = emotion_detector or EmotionDetector(seed=seed)
+        self.face_analyzer = face_analyzer or FaceAnalyzer(seed=seed)
+
+        # Full detections run on an image downscaled by this factor
+        self.detect_scale = detect_scale
+
+    @property
+    def face_cascade(self):
+        """The face cascade both components share, loaded once per thread"""
+        return self.emotion_detector.face_cascade
+
+    def warm_up(self, frame_size=(480, 640)):
+        """Load the models and run one dummy inference, so the first real
+        frame does not pay for loading and first-call allocations"""
+        gray = np.zeros(frame_size, dtype=np.uint8)
+        self.detect_faces(gray)
+        faces = np.array([[0, 0, FACE_INPUT_SIZE, FACE_INPUT_SIZE]], dtype=np.int32)
+        self.emotion_detector.detect_emotions_batch(gray, faces)
+        self.face_analyzer.analyze_faces(faces)
+
+    def analyze_frame(self, frame, tracker=None, scale=1.0):
+        """Detect faces once and run emotion and landmark analysis on them
+
+        Without a tracker every frame gets a full detection. With one, faces
+        are followed between periodic full detections, and if it has a scene
+        cache a still scene reuses the previous result. ``frame`` may be BGR or
+        already grayscale; if it was downscaled from the original image, pass
+        the ``scale`` factor so landmarks come back in original coordinates.
+        """
+        timer = StageTimer()
+        try:
+            if frame.ndim == 2:
+                gray = frame
+            else:
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                timer.mark('grayscale')
+
+            scene_cache = tracker.scene_cache if tracker is not None else None
+            if scene_cache is not None:
+                thumbnail = scene_cache.thumbnail(gray)
+                cached = scene_cache.lookup(thumbnail, gray, scale)
+                timer.mark('scene_check')
+                if cached is not None:
+                    cached.timings = timer.timings
+                    return cached
+
+            tracked = False
+            if tracker is None:
+                faces = self.detect_faces(gray)
+            else:
+                faces, tracked = self._track_faces(gray, tracker)
+            timer.mark('detect')
+
+            # Score every face in one batch; the first one is the frame's emotion
+            face_emotions = self.emotion_detector.detect_emotions_batch(gray, faces)
+            if len(face_emotions):
+                emotions = dict(zip(self.emotion_detector.emotion_labels, face_emotions[0].tolist()))
+            else:
+                emotions = self.emotion_detector._get_default_emotions()
+            timer.mark('emotions')
+            if scale != 1.0:
+                landmarks_data = self.face_analyzer.analyze_faces(
+                    np.round(faces * scale).astype(np.int32))
+            else:
+                landmarks_data = self.face_analyzer.analyze_faces(faces)
+            timer.mark('landmarks')
+
+            result = FrameResult(gray, faces, emotions, landmarks_data, tracked, scale,
+                                 face_emotions=face_emotions)
+            result.timings = timer.timings
+            if scene_cache is not None:
+                scene_cache.store(thumbnail, result)
+            return result
+
+        except Exception as e:
+            print(f"Error in frame analysis: {e}")
+            return FrameResult(None, np.empty((0, 4), dtype=np.int32),
+                               self.emotion_detector._get_default_emotions(), [])
+
+    def detect_faces(self, gray):
+        """Run a full detection, downscaled if configured, in full-res coordinates"""
+        if self.detect_scale >= 1.0:
+            return _as_rects(self.face_cascade.detectMultiScale(gray, 1.1, 4))
+
+        small = cv2.resize(gray, None, fx=self.detect_scale, fy=self.detect_scale,
+                           interpolation=cv2.INTER_AREA)
+        faces = _as_rects(self.face_cascade.detectMultiScale(small, 1.1, 4))
+        return np.round(faces / self.detect_scale).astype(np.int32)
+
+    def _track_faces(self, gray, tracker):
+        """Follow the tracker's faces, falling back to a full detection"""
+        if not tracker.needs_detection():
+            faces = self._search_near(gray, tracker)
+            if faces is not None:
+                tracker.faces = faces
+                tracker.frames_since_detection += 1
+                return faces, True
+
+        faces = self.detect_faces(gray)
+        tracker.faces = faces
+        tracker.frames_since_detection = 0
+        return faces, False
+
+    def _search_near(self, gray, tracker):
+        """Search for each face in its enlarged previous rect
+
+        Returns None as soon as one face cannot be found again.
+        """
+        frame_h, frame_w = gray.shape[:2]
+        found = []
+
+        for (x, y, w, h) in tracker.faces:
+            margin_x = int(w * tracker.roi_margin)
+            margin_y = int(h * tracker.roi_margin)
+            x0, y0 = max(0, x - margin_x), max(0, y - margin_y)
+            x1, y1 = min(frame_w, x + w + margin_x), min(frame_h, y + h + margin_y)
+            roi = gray[y0:y1, x0:x1]
+
+            min_size = (int(w * (1 - tracker.size_tolerance)), int(h * (1 - tracker.size_tolerance)))
+            max_size = (min(int(w * (1 + tracker.size_tolerance)), x1 - x0),
+                        min(int(h * (1 + tracker.size_tolerance)), y1 - y0))
+            if min_size[0] <= 0 or min_size[1] <= 0 or roi.size == 0:
+                return None
+
+            candidates = _as_rects(self.face_cascade.detectMultiScale(
+                roi, 1.1, 4, minSize=min_size, maxSize=max_size))
+            if len(candidates) == 0:
+                return None
+
+            # Keep the candidate closest to where the face was
+            centers = candidates[:, :2] + candidates[:, 2:] / 2 + (x0, y0)
+            distance = np.sum((centers - (x + w / 2, y + h / 2)) ** 2, axis=1)
+            cx, cy, cw, ch = candidates[np.argmin(distance)]
+            found.append((cx + x0, cy + y0, cw, ch))
+
+        return np.array(found, dtype=np.int32).reshape(-1, 4)
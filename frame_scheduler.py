@@ -0,0 +1,87 @@
+"""
+Frame Scheduling Module
+Keeps only the newest pending video frame per client session so slow
+processing never builds up a backlog of stale frames
+"""
+
+import threading
+
+
+class FrameScheduler:
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        # Newest unprocessed frame per session and sessions with a running worker
+        self._pending = {}
+        self._active = set()
+
+        # Frames received, dropped and processed, in total and per live session
+        self._totals = {'received': 0, 'dropped': 0, 'processed': 0}
+        self._session_stats = {}
+
+    def submit(self, sid, frame):
+        """Queue a frame for a session, replacing any frame still pending
+
+        Returns True when the session has no worker running and the caller
+        should start one.
+        """
+        with self._lock:
+            self._count(sid, 'received')
+            if sid in self._pending:
+                # Latest frame wins: the older one is never processed
+                self._count(sid, 'dropped')
+            self._pending[sid] = frame
+
+            if sid in self._active:
+                return False
+            self._active.add(sid)
+            return True
+
+    def next_frame(self, sid):
+        """Take the session's pending frame, or stop its worker if there is none"""
+        with self._lock:
+            frame = self._pending.pop(sid, None)
+            if frame is None:
+                self._active.discard(sid)
+            return frame
+
+    def mark_processed(self, sid):
+        """Count a frame as processed for a session"""
+        with self._lock:
+            self._totals['processed'] += 1
+            if sid in self._session_stats:
+                self._session_stats[sid]['processed'] += 1
+
+    def pending_count(self):
+        """Number of sessions with a frame waiting to be processed"""
+        with self._lock:
+            return len(self._pending)
+
+    def remove_session(self, sid):
+        """Drop a session's pending frame and counters"""
+        with self._lock:
+            if self._pending.pop(sid, None) is not None:
+                self._totals['dropped'] += 1
+            self._session_stats.pop(sid, None)
+
+    def get_stats(self, sid=None):
+        """Counters for one session, or totals plus per-session counters"""
+        with self._lock:
+            if sid is not None:
+                # Read-only: asking about a removed session must not add it back
+                return dict(self._session_stats.get(sid, {'received': 0, 'dropped': 0, 'processed': 0}))
+
+            totals = dict(self._totals)
+            totals['pending'] = len(self._pending)
+            totals['active_sessions'] = len(self._session_stats)
+            totals['sessions'] = {s: dict(stats) for s, stats in self._session_stats.items()}
+            return totals
+
+    def _count(self, sid, key):
+        self._totals[key] += 1
+        self._stats_for(sid)[key] += 1
+
+    def _stats_for(self, sid):
+        if sid not in self._session_stats:
+            self._session_stats[sid] = {'received': 0, 'dropped': 0, 'processed': 0}
+        return self._session_stats[sid]
@@ -0,0 +1,248 @@
+"""
+History Store Module
+Durable SQLite (WAL mode) storage for emotion samples and chat turns, with
+batched background writes and cursor-paginated, indexed reads
+"""
+
+import queue
+import sqlite3
+import threading
+
+from emotion_detector import EMOTION_LABELS
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS emotion_samples (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session TEXT NOT NULL,
+    ts REAL NOT NULL,
+    emotion TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    {', '.join(f'{label} REAL NOT NULL' for label in EMOTION_LABELS)}
+);
+CREATE INDEX IF NOT EXISTS idx_emotion_samples_session_ts ON emotion_samples (session, ts);
+
+CREATE TABLE IF NOT EXISTS chat_turns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session TEXT NOT NULL,
+    ts REAL NOT NULL,
+    user_message TEXT NOT NULL,
+    ai_response TEXT NOT NULL,
+    emotion TEXT,
+    intensity REAL
+);
+CREATE INDEX IF NOT EXISTS idx_chat_turns_session_ts ON chat_turns (session, ts);
+"""
+
+EMOTION_INSERT = (
+    f"INSERT INTO emotion_samples (session, ts, emotion, confidence, {', '.join(EMOTION_LABELS)}) "
+    f"VALUES ({', '.join('?' * (4 + len(EMOTION_LABELS)))})"
+)
+CHAT_INSERT = (
+    "INSERT INTO chat_turns (session, ts, user_message, ai_response, emotion, intensity) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+
+
+def _encode_cursor(row):
+    return f"{row['ts']!r}:{row['id']}"
+
+
+def _decode_cursor(cursor):
+    """(ts, id) of a cursor from _encode_cursor; ValueError if it is malformed"""
+    try:
+        ts, row_id = cursor.split(':')
+        return float(ts), int(row_id)
+    except ValueError:
+        raise ValueError(f"Invalid cursor {cursor!r}") from None
+
+
+class HistoryStore:
+    """Append-only emotion/chat history in SQLite
+
+    record_* calls only enqueue rows; a writer thread inserts them in
+    batches of up to ``batch_size`` or every ``flush_interval`` seconds.
+    When the queue is full new rows are dropped rather than blocking.
+    """
+    def __init__(self, path, batch_size=500, flush_interval=1.0, max_queue=20000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.written = 0
+
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+        # One connection for reads, shared by request handlers under a lock
+        self._reader = self._connect(check_same_thread=False)
+        self._reader_lock = threading.Lock()
+
+        self._closed = threading.Event()
+        self._writer = threading.Thread(target=self._write_loop, name='history-writer', daemon=True)
+        self._writer.start()
+
+    def _connect(self, check_same_thread=True):
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=check_same_thread)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def record_emotion(self, session, timestamp, emotions):
+        """Queue an emotion sample (dict of probabilities by label)"""
+        values = [float(emotions.get(label, 0.0)) for label in EMOTION_LABELS]
+        best = max(range(len(values)), key=values.__getitem__)
+        self._enqueue(EMOTION_INSERT, (session, timestamp, EMOTION_LABELS[best], values[best], *values))
+
+    def record_chat(self, session, timestamp, user_message, ai_response, emotion, intensity):
+        """Queue a chat turn"""
+        self._enqueue(CHAT_INSERT, (session, timestamp, user_message, ai_response, emotion, intensity))
+
+    def _enqueue(self, sql, params):
+        try:
+            self._queue.put_nowait((sql, params))
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self):
+        conn = self._connect()
+        while not (self._closed.is_set() and self._queue.empty()):
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                with conn:
+                    for sql, params in batch:
+                        conn.execute(sql, params)
+                self.written += len(batch)
+            except sqlite3.Error as e:
+                print(f"Error writing history batch: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+        conn.close()
+
+    def flush(self):
+        """Block until every queued row has been written"""
+        self._queue.join()
+
+    def close(self):
+        """Write what is queued and stop the writer thread"""
+        self._closed.set()
+        self._writer.join()
+        with self._reader_lock:
+            self._reader.close()
+
+    def _page(self, table, columns, session, cursor, limit, start, end, order):
+        if limit < 1:
+            raise ValueError(f"Invalid page size {limit!r}")
+        descending = order != 'asc'
+        sql = f"SELECT id, ts, {columns} FROM {table} WHERE session = ?"
+        params = [session]
+        if start is not None:
+            sql += " AND ts >= ?"
+            params.append(start)
+        if end is not None:
+            sql += " AND ts <= ?"
+            params.append(end)
+        if cursor:
+            ts, row_id = _decode_cursor(cursor)
+            comparison = '<' if descending else '>'
+            sql += f" AND (ts {comparison} ? OR (ts = ? AND id {comparison} ?))"
+            params.extend([ts, ts, row_id])
+        direction = 'DESC' if descending else 'ASC'
+        sql += f" ORDER BY ts {direction}, id {direction} LIMIT ?"
+        params.append(limit + 1)
+
+        with self._reader_lock:
+            rows = self._reader.execute(sql, params).fetchall()
+
+        next_cursor = _encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    def emotion_page(self, session, cursor=None, limit=100, start=None, end=None, order='desc'):
+        """One page of emotion samples plus the cursor of the next page (or None)"""
+        rows, next_cursor = self._page(
+            'emotion_samples', f"emotion, confidence, {', '.join(EMOTION_LABELS)}",
+            session, cursor, limit, start, end, order)
+        items = [{
+            'timestamp': row['ts'],
+            'emotion': row['emotion'],
+            'confidence': row['confidence'],
+            'all_emotions': {label: row[label] for label in EMOTION_LABELS}
+        } for row in rows]
+        return {'items': items, 'next_cursor': next_cursor}
+
+    def chat_page(self, session, cursor=None, limit=20, start=None, end=None, order='desc'):
+        """One page of chat turns plus the cursor of the next page (or None)"""
+        rows, next_cursor = self._page(
+            'chat_turns', "user_message, ai_response, emotion, intensity",
+            session, cursor, limit, start, end, order)
+        items = [{
+            'timestamp': row['ts'],
+            'user_message': row['user_message'],
+            'ai_response': row['ai_response'],
+            'emotion': row['emotion'],
+            'intensity': row['intensity']
+        } for row in rows]
+        return {'items': items, 'next_cursor': next_cursor}
+
+    def emotion_summary(self, session, start=None, end=None, bucket=None):
+        """Aggregate emotion samples over a time range
+
+        Returns the sample count, time span, mean probability per emotion and
+        how often each emotion was dominant. With ``bucket`` (seconds), also
+        returns the mean probabilities per time bucket.
+        """
+        where = "session = ?"
+        params = [session]
+        if start is not None:
+            where += " AND ts >= ?"
+            params.append(start)
+        if end is not None:
+            where += " AND ts <= ?"
+            params.append(end)
+
+        means = ', '.join(f'AVG({label}) AS {label}' for label in EMOTION_LABELS)
+        with self._reader_lock:
+            totals = self._reader.execute(
+                f"SELECT COUNT(*) AS count, MIN(ts) AS first, MAX(ts) AS last, {means} "
+                f"FROM emotion_samples WHERE {where}", params).fetchone()
+            dominant = self._reader.execute(
+                f"SELECT emotion, COUNT(*) AS count FROM emotion_samples WHERE {where} "
+                f"GROUP BY emotion", params).fetchall()
+            buckets = []
+            if bucket:
+                buckets = self._reader.execute(
+                    f"SELECT CAST(ts / ? AS INTEGER) * ? AS bucket_start, COUNT(*) AS count, {means} "
+                    f"FROM emotion_samples WHERE {where} GROUP BY bucket_start ORDER BY bucket_start",
+                    [bucket, bucket, *params]).fetchall()
+
+        summary = {
+            'count': totals['count'],
+            'first': totals['first'],
+            'last': totals['last'],
+            'mean': {label: totals[label] for label in EMOTION_LABELS} if totals['count'] else {},
+            'dominant_counts': {row['emotion']: row['count'] for row in dominant}
+        }
+        if bucket:
+            summary['buckets'] = [{
+                'start': row['bucket_start'],
+                'count': row['count'],
+                'mean': {label: row[label] for label in EMOTION_LABELS}
+            } for row in buckets]
+        return summary
+
+    def get_stats(self):
+        return {'queued': self._queue.qsize(), 'written': self.written, 'dropped': self.dropped}
@@ -0,0 +1,170 @@
+"""
+Inference Executor Module
+Runs frame decoding and analysis in a thread or process pool so OpenCV work
+does not block the Socket.IO event loop
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import cv2
+from emotion_backends import create_backend
+from emotion_detector import EmotionDetector
+from frame_pipeline import FramePipeline, decode_frame
+from mjpeg_stream import scale_landmarks_data
+
+
+# Each worker thread or process builds its own pipeline, loading the cascades once
+_worker_state = threading.local()
+
+
+def _init_worker(detect_scale, cv_threads, emotion_backend=None):
+    """Load the detection models for one worker and warm them up"""
+    if cv_threads is not None:
+        cv2.setNumThreads(cv_threads)
+    emotion_detector = EmotionDetector(backend=create_backend(emotion_backend))
+    _worker_state.pipeline = FramePipeline(emotion_detector, detect_scale=detect_scale)
+    _worker_state.pipeline.warm_up()
+
+
+def _worker_ready(hold):
+    """Warm-up task; holding each worker a moment makes the pool start them all"""
+    time.sleep(hold)
+    return True
+
+
+def analyze_encoded_frame(image, tracker=None, reduction=1, scale=1.0, pipeline=None):
+    """Decode a client JPEG and analyse it
+
+    Returns the FrameResult and the (updated) tracker, so tracking state
+    survives the trip to and from a worker process.
+    """
+    started = time.perf_counter()
+    frame, decode_scale = decode_frame(image, reduction)
+    decode_time = time.perf_counter() - started
+
+    pipeline = pipeline or _worker_state.pipeline
+    result = pipeline.analyze_frame(frame, tracker, decode_scale * scale)
+    result.timings = {'decode': decode_time, **result.timings}
+    return result, tracker
+
+
+def render_annotated_jpeg(image, landmarks_data, emotions, scale=1.0, quality=70, pipeline=None):
+    """Decode a client JPEG in colour, draw the emotion overlay and face mesh
+    on it and encode it again
+
+    ``scale`` is the factor from the frame's coordinates to the landmarks'.
+    """
+    frame, _ = decode_frame(image, color=True)
+    face_analyzer = (pipeline or _worker_state.pipeline).face_analyzer
+    if scale != 1.0:
+        landmarks_data = scale_landmarks_data(landmarks_data, 1.0 / scale)
+
+    if emotions and landmarks_data:
+        face_analyzer.get_face_emotions_overlay(frame, landmarks_data, emotions, out=frame)
+    if landmarks_data:
+        face_analyzer.draw_face_mesh(frame, landmarks_data)
+
+    ok, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode annotated frame")
+    return jpeg.tobytes()
+
+
+def _analyze_in_process(image, tracker, reduction, scale):
+    """Process-pool entry point; the grayscale frame is not sent back"""
+    result, tracker = analyze_encoded_frame(image, tracker, reduction, scale)
+    result.gray = None
+    return result, tracker
+
+
+class InferenceExecutor:
+    """Runs frame analysis inline, in a thread pool or in a process pool
+
+    ``sleep`` is the event loop's cooperative sleep (e.g. ``socketio.sleep``);
+    callers wait for results with it so other clients keep being served.
+    ``emotion_backend`` is the create_backend config workers build their
+    emotion classifier from.
+    """
+    MODES = ('inline', 'thread', 'process')
+
+    def __init__(self, mode='thread', workers=None, detect_scale=1.0, cv_threads=1,
+                 sleep=time.sleep, poll_interval=0.005, pipeline=None, emotion_backend=None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown inference executor mode: {mode}")
+
+        self.mode = mode
+        self.workers = workers or os.cpu_count() or 1
+        self.sleep = sleep
+        self.poll_interval = poll_interval
+
+        self._detect_scale = detect_scale
+        self._cv_threads = cv_threads
+        self._emotion_backend = emotion_backend
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+        if mode == 'inline':
+            self.pipeline = pipeline or FramePipeline(
+                EmotionDetector(backend=create_backend(emotion_backend)), detect_scale=detect_scale)
+
+    def _get_pool(self):
+        """Start the worker pool on first use"""
+        with self._pool_lock:
+            if self._pool is None:
+                initargs = (self._detect_scale, self._cv_threads, self._emotion_backend)
+                if self.mode == 'thread':
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=self.workers, thread_name_prefix='inference',
+                        initializer=_init_worker, initargs=initargs)
+                else:
+                    # Spawn so workers do not inherit the event loop's state
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                        initializer=_init_worker, initargs=initargs)
+            return self._pool
+
+    def analyze(self, image, tracker=None, reduction=1, scale=1.0):
+        """Decode and analyse a frame, yielding to the event loop while waiting
+
+        Returns the FrameResult and the tracker to keep for the next frame.
+        """
+        if self.mode == 'inline':
+            return analyze_encoded_frame(image, tracker, reduction, scale, self.pipeline)
+
+        if self.mode == 'process':
+            future = self._get_pool().submit(_analyze_in_process, image, tracker, reduction, scale)
+        else:
+            future = self._get_pool().submit(analyze_encoded_frame, image, tracker, reduction, scale)
+        return self._wait(future)
+
+    def render(self, image, landmarks_data, emotions, scale=1.0, quality=70):
+        """Annotated JPEG of a client frame, rendered by a worker"""
+        if self.mode == 'inline':
+            return render_annotated_jpeg(image, landmarks_data, emotions, scale, quality, self.pipeline)
+        return self._wait(self._get_pool().submit(
+            render_annotated_jpeg, image, landmarks_data, emotions, scale, quality))
+
+    def warm_up(self):
+        """Start every worker and run a dummy inference on it (inline: on the
+        shared pipeline) before the first real frame arrives"""
+        if self.mode == 'inline':
+            self.pipeline.warm_up()
+            return
+        pool = self._get_pool()
+        futures = [pool.submit(_worker_ready, 0.05) for _ in range(self.workers)]
+        for future in futures:
+            future.result()
+
+    def _wait(self, future):
+        while not future.done():
+            self.sleep(self.poll_interval)
+        return future.result()
+
+    def shutdown(self):
+        """Stop the worker pool"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
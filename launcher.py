@@ -0,0 +1,182 @@
+"""
+Launcher Module
+Runs several app.py workers behind one port. The workers share session
+state and Socket.IO events through Redis (an in-process stand-in unless
+--redis-url is given); a sticky proxy keeps every connection of a client on
+the worker that holds its Socket.IO session, so its video frames are
+processed where its face tracker and frame scheduler live.
+
+Browsers get the worker cookie with the page. Other clients should connect
+with the websocket transport, which needs no stickiness across requests.
+"""
+
+import argparse
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import eventlet
+from redis_standin import RedisStandin
+
+WORKER_PARAM = re.compile(rb'[?&]worker=(\w+)')
+WORKER_COOKIE = re.compile(rb'emotion_ai_worker=(\w+)')
+
+# Longest request head read to pick a worker
+MAX_HEAD_SIZE = 65536
+
+
+def _pipe(source, target):
+    """Copy ``source`` to ``target`` until ``source`` is closed"""
+    try:
+        while True:
+            data = source.recv(65536)
+            if not data:
+                break
+            target.sendall(data)
+    except OSError:
+        pass
+    finally:
+        try:
+            target.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+class StickyProxy:
+    """TCP proxy sending each HTTP/WebSocket connection to one worker
+
+    The worker comes from the ``worker`` query parameter, then the
+    ``emotion_ai_worker`` cookie the workers set, and otherwise is the one
+    with the fewest open connections. ``backends`` maps worker ids to
+    (host, port).
+    """
+    def __init__(self, backends):
+        self.backends = dict(backends)
+        self.connections = {worker: 0 for worker in self.backends}
+
+    def choose(self, head):
+        for pattern in (WORKER_PARAM, WORKER_COOKIE):
+            match = pattern.search(head)
+            if match and match.group(1).decode() in self.backends:
+                return match.group(1).decode()
+        return min(self.connections, key=self.connections.get)
+
+    def serve(self, host, port):
+        listener = eventlet.listen((host, port))
+        pool = eventlet.GreenPool()
+        while True:
+            client, _ = listener.accept()
+            pool.spawn_n(self.handle, client)
+
+    def handle(self, client):
+        backend = None
+        try:
+            head = self._read_head(client)
+            if not head:
+                return
+            worker = self.choose(head)
+            backend = eventlet.connect(self.backends[worker])
+            self.connections[worker] += 1
+            try:
+                backend.sendall(head)
+                upstream = eventlet.spawn(_pipe, client, backend)
+                _pipe(backend, client)
+                upstream.kill()
+            finally:
+                self.connections[worker] -= 1
+        except OSError as e:
+            print(f"Error proxying connection: {e}")
+        finally:
+            client.close()
+            if backend is not None:
+                backend.close()
+
+    def _read_head(self, client):
+        head = b''
+        while b'\r\n\r\n' not in head and len(head) < MAX_HEAD_SIZE:
+            data = client.recv(4096)
+            if not data:
+                break
+            head += data
+        return head
+
+
+def start_workers(count, base_port, redis_url, inference_workers):
+    """Start ``count`` app.py processes on consecutive ports from ``base_port``"""
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+    workers = {}
+    for i in range(count):
+        env = dict(os.environ, HOST='127.0.0.1', PORT=str(base_port + i), WORKER_ID=str(i),
+                   REDIS_URL=redis_url, FLASK_DEBUG='0')
+        env.setdefault('INFERENCE_WORKERS', str(inference_workers))
+        process = subprocess.Popen([sys.executable, app_path], env=env, cwd=os.path.dirname(app_path))
+        workers[str(i)] = (process, ('127.0.0.1', base_port + i))
+    return workers
+
+
+def wait_for_workers(workers, timeout=120.0):
+    """Block until every worker accepts connections"""
+    deadline = time.monotonic() + timeout
+    for worker, (process, address) in workers.items():
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"Worker {worker} exited with code {process.returncode}")
+            try:
+                socket.create_connection(address, timeout=1.0).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Worker {worker} did not start listening on port {address[1]}")
+                time.sleep(0.2)
+
+
+def stop_workers(workers):
+    for process, _ in workers.values():
+        process.terminate()
+    for process, _ in workers.values():
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Run several emotion AI workers behind one port")
+    parser.add_argument('--workers', type=int, default=cpus, help="Number of app.py processes")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5500, help="Port clients connect to")
+    parser.add_argument('--base-port', type=int, default=5510, help="Port of the first worker")
+    parser.add_argument('--redis-url', help="Shared Redis (default: start an in-process stand-in)")
+    args = parser.parse_args()
+
+    standin = None
+    redis_url = args.redis_url
+    if not redis_url:
+        standin = RedisStandin().start()
+        redis_url = standin.url
+        print(f"Redis stand-in listening on {redis_url}")
+
+    # Stop the workers too when the launcher is terminated
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    workers = start_workers(args.workers, args.base_port, redis_url, max(1, cpus // args.workers))
+    try:
+        wait_for_workers(workers)
+        proxy = StickyProxy({worker: address for worker, (_, address) in workers.items()})
+        print(f"Serving {len(workers)} workers on http://{args.host}:{args.port}")
+        proxy.serve(args.host, args.port)
+    except RuntimeError as e:
+        print(f"Error starting workers: {e}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_workers(workers)
+        if standin is not None:
+            standin.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""
+LLM Gateway Module
+Bounded concurrency, per-call deadlines, request coalescing and a circuit
+breaker around a pluggable language model backend
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LLMUnavailableError(Exception):
+    """The upstream model is unhealthy or overloaded"""
+
+
+class LLMTimeoutError(LLMUnavailableError):
+    """A call did not finish before its deadline"""
+
+
+class LLMBackend:
+    """Interface for language model backends"""
+    def generate(self, prompt):
+        """Return the complete response text for a prompt"""
+        raise NotImplementedError
+
+    def stream(self, prompt):
+        """Yield the response text in chunks as it is produced"""
+        raise NotImplementedError
+
+
+class ModelBackend(LLMBackend):
+    """Backend for any model object with generate_content(prompt, stream=False)"""
+    def __init__(self, model):
+        self.model = model
+
+    def generate(self, prompt):
+        return self.model.generate_content(prompt).text
+
+    def stream(self, prompt):
+        for chunk in self.model.generate_content(prompt, stream=True):
+            yield chunk.text
+
+
+class GeminiBackend(ModelBackend):
+    """Google Gemini through the google.generativeai client
+
+    The client library takes longer to import than the rest of the server,
+    so it is imported on the first call rather than at startup.
+    """
+    def __init__(self, model_name='gemma-2-27b-it', api_key=None):
+        self.model_name = model_name
+        self.api_key = api_key
+        self._model = None
+        self._model_lock = threading.Lock()
+
+    @property
+    def model(self):
+        with self._model_lock:
+            if self._model is None:
+                import google.generativeai as genai
+
+                genai.configure(api_key=self.api_key)
+                self._model = genai.GenerativeModel(self.model_name)
+            return self._model
+
+
+class StubBackend(LLMBackend):
+    """Local stand-in model with configurable latency, for tests and load tests"""
+    def __init__(self, response="Thanks for sharing. I'm here to help.", latency=0.0,
+                 chunk_count=4, fail=False):
+        self.response = response
+        self.latency = latency
+        self.chunk_count = chunk_count
+        self.fail = fail
+        self.calls = 0
+
+    def generate(self, prompt):
+        self.calls += 1
+        time.sleep(self.latency)
+        if self.fail:
+            raise RuntimeError("Stub backend failure")
+        return self.response
+
+    def stream(self, prompt):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError("Stub backend failure")
+
+        words = self.response.split(' ')
+        size = max(1, -(-len(words) // self.chunk_count))
+        for i in range(0, len(words), size):
+            time.sleep(self.latency / self.chunk_count)
+            text = ' '.join(words[i:i + size])
+            yield text if i == 0 else ' ' + text
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures and lets one trial call through
+    once ``reset_timeout`` seconds have passed"""
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go to the upstream right now"""
+        with self._lock:
+            if self.state == self.OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_running = False
+
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = self.clock()
+            self._trial_running = False
+
+    def record_cancelled(self):
+        """A call abandoned by its caller proves nothing either way; let
+        another trial through"""
+        with self._lock:
+            self._trial_running = False
+
+
+class LLMGateway:
+    """Guards every call to a backend
+
+    - At most ``max_concurrency`` backend calls run at once; a slot is held
+      until the backend call really returns, even after a timeout.
+    - ``generate`` fails with LLMTimeoutError after ``timeout`` seconds;
+      ``stream`` applies the same deadline to the wait for each chunk.
+    - Identical prompts requested while one is in flight share its result.
+    - While the circuit breaker is open calls fail immediately with
+      LLMUnavailableError.
+
+    ``sleep`` is used while waiting in ``generate`` so an event loop can keep
+    serving other requests (e.g. ``socketio.sleep``). ``stream`` blocks the
+    calling thread and is meant to be consumed from a worker thread.
+    ``latency_histogram`` is an optional metrics Histogram (labels: mode,
+    outcome) that receives the duration of every backend call.
+    """
+    def __init__(self, backend, max_concurrency=4, timeout=20.0, breaker=None,
+                 sleep=time.sleep, poll_interval=0.01, latency_histogram=None):
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.sleep = sleep
+        self.poll_interval = poll_interval
+        self.latency_histogram = latency_histogram
+
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='llm')
+        self._inflight = {}  # prompt -> future of the call serving it
+        self._abandoned = set()  # futures whose caller timed out
+        self._lock = threading.Lock()
+
+        self._stats = {'calls': 0, 'succeeded': 0, 'failed': 0, 'timeouts': 0,
+                       'rejected': 0, 'coalesced': 0, 'cancelled': 0, 'in_flight': 0}
+
+    def generate(self, prompt):
+        """Return the complete response for a prompt"""
+        self._count('calls')
+        if not self.breaker.allow():
+            self._count('rejected')
+            raise LLMUnavailableError("Language model circuit is open")
+
+        deadline = time.monotonic() + self.timeout
+        with self._lock:
+            future = self._inflight.get(prompt)
+            leader = future is None
+            if not leader:
+                self._stats['coalesced'] += 1
+
+        if leader:
+            self._acquire_slot(deadline)
+            with self._lock:
+                future = self._inflight.get(prompt)
+                leader = future is None
+                if leader:
+                    started = time.perf_counter()
+                    future = self._executor.submit(self.backend.generate, prompt)
+                    self._inflight[prompt] = future
+                    self._stats['in_flight'] += 1
+                    future.add_done_callback(lambda f: self._finish(prompt, f, started))
+                else:
+                    self._stats['coalesced'] += 1
+            if not leader:
+                self._slots.release()
+
+        while not future.done():
+            if time.monotonic() >= deadline:
+                if leader and not self._abandon(prompt, future):
+                    break  # finished just now
+                self._count('timeouts')
+                if leader:
+                    self.breaker.record_failure()
+                raise LLMTimeoutError(f"Language model call exceeded {self.timeout:.1f}s")
+            self.sleep(self.poll_interval)
+        return future.result()
+
+    def stream(self, prompt, cancel_event=None):
+        """Yield response chunks for a prompt, stopping once ``cancel_event`` is set"""
+        self._count('calls')
+        if not self.breaker.allow():
+            self._count('rejected')
+            raise LLMUnavailableError("Language model circuit is open")
+
+        if not self._slots.acquire(timeout=self.timeout):
+            self._count('timeouts')
+            raise LLMTimeoutError("No language model slot became free in time")
+
+        chunks = queue.Queue()
+        stop = threading.Event()
+        started = time.perf_counter()
+
+        def produce():
+            try:
+                for text in self.backend.stream(prompt):
+                    if stop.is_set() or (cancel_event is not None and cancel_event.is_set()):
+                        # A cut-off response is not a success
+                        chunks.put(('cancelled', None))
+                        return
+                    chunks.put(('chunk', text))
+                chunks.put(('done', None))
+            except Exception as e:
+                chunks.put(('error', e))
+            finally:
+                self._slots.release()
+                self._count('in_flight', -1)
+
+        self._count('in_flight')
+        threading.Thread(target=produce, daemon=True).start()
+
+        try:
+            while True:
+                try:
+                    kind, value = chunks.get(timeout=self.timeout)
+                except queue.Empty:
+                    self._count('timeouts')
+                    self.breaker.record_failure()
+                    self._observe('stream', 'timeout', started)
+                    raise LLMTimeoutError(f"No response chunk within {self.timeout:.1f}s")
+
+                if kind == 'chunk':
+                    yield value
+                elif kind == 'done':
+                    self._count('succeeded')
+                    self.breaker.record_success()
+                    self._observe('stream', 'succeeded', started)
+                    return
+                elif kind == 'cancelled':
+                    self._count('cancelled')
+                    self.breaker.record_cancelled()
+                    self._observe('stream', 'cancelled', started)
+                    return
+                else:
+                    self._count('failed')
+                    self.breaker.record_failure()
+                    self._observe('stream', 'failed', started)
+                    raise value
+        finally:
+            stop.set()
+
+    def get_stats(self):
+        """Call counters plus the circuit breaker state"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['breaker_state'] = self.breaker.state
+        stats['max_concurrency'] = self.max_concurrency
+        return stats
+
+    def _acquire_slot(self, deadline):
+        """Wait for a free concurrency slot without blocking the event loop"""
+        while not self._slots.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                self._count('timeouts')
+                raise LLMTimeoutError("No language model slot became free in time")
+            self.sleep(self.poll_interval)
+
+    def _abandon(self, prompt, future):
+        """Mark a call whose caller gave up, so its late outcome isn't
+        recorded over the timeout; False if it has already finished"""
+        with self._lock:
+            if self._inflight.get(prompt) is not future:
+                return False
+            self._abandoned.add(future)
+            return True
+
+    def _finish(self, prompt, future, started):
+        """Release the slot of a finished backend call and record its outcome"""
+        self._slots.release()
+        with self._lock:
+            self._inflight.pop(prompt, None)
+            self._stats['in_flight'] -= 1
+            abandoned = future in self._abandoned
+            self._abandoned.discard(future)
+
+        if abandoned:
+            # Its timeout was already counted against the breaker
+            self._observe('generate', 'timeout', started)
+        elif future.exception() is None:
+            self._count('succeeded')
+            self.breaker.record_success()
+            self._observe('generate', 'succeeded', started)
+        else:
+            self._count('failed')
+            self.breaker.record_failure()
+            self._observe('generate', 'failed', started)
+
+    def _observe(self, mode, outcome, started):
+        if self.latency_histogram is not None:
+            self.latency_histogram.observe(time.perf_counter() - started, mode=mode, outcome=outcome)
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
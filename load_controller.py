@@ -0,0 +1,112 @@
+"""
+Load Controller Module
+Adapts each client's capture rate, resolution and JPEG quality to the
+processing latency and load measured on the server
+"""
+
+import threading
+import time
+
+# Capture settings from the best to the most degraded level
+DEFAULT_LEVELS = [
+    {'interval_ms': 200, 'max_width': 640, 'max_height': 480, 'quality': 0.7},
+    {'interval_ms': 250, 'max_width': 640, 'max_height': 480, 'quality': 0.6},
+    {'interval_ms': 333, 'max_width': 480, 'max_height': 360, 'quality': 0.6},
+    {'interval_ms': 500, 'max_width': 320, 'max_height': 240, 'quality': 0.5},
+    {'interval_ms': 1000, 'max_width': 320, 'max_height': 240, 'quality': 0.4}
+]
+
+
+class LoadController:
+    """Picks capture settings per session from measured processing latency
+
+    Latency is kept as an EWMA per session and over all sessions. The load
+    of a level is the larger of the session's latency as a fraction of the
+    level's frame interval and the share of worker time all sessions would
+    need at that level. A session drops one level when its load exceeds
+    ``high_load`` or more frames are queued than there are workers, and
+    gains one when the estimated load of the better level is below
+    ``low_load``. Levels change at most once per ``cooldown`` seconds.
+    """
+    def __init__(self, workers=1, levels=None, high_load=0.9, low_load=0.6, alpha=0.2,
+                 cooldown=2.0, clock=time.monotonic):
+        self.workers = workers
+        self.levels = levels or DEFAULT_LEVELS
+        self.high_load = high_load
+        self.low_load = low_load
+        self.alpha = alpha
+        self.cooldown = cooldown
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._sessions = {}  # sid -> {'latency', 'level', 'changed_at'}
+        self._global_latency = None
+
+    def settings(self, sid):
+        """Current capture settings for a session"""
+        with self._lock:
+            return dict(self.levels[self._state(sid)['level']])
+
+    def record(self, sid, latency, sessions=1, pending=0):
+        """Add the processing latency (seconds) of one frame
+
+        ``sessions`` is the number of sessions sending frames and ``pending``
+        the number of frames waiting. Returns the new capture settings when
+        the session's level changed, otherwise None.
+        """
+        with self._lock:
+            state = self._state(sid)
+            state['latency'] = self._ewma(state['latency'], latency)
+            self._global_latency = self._ewma(self._global_latency, latency)
+
+            now = self.clock()
+            if now - state['changed_at'] < self.cooldown:
+                return None
+
+            level = state['level']
+            if level < len(self.levels) - 1 and (
+                    pending > self.workers
+                    or self._load(state['latency'], level, level, sessions) > self.high_load):
+                level += 1
+            elif level > 0 and self._load(state['latency'], level, level - 1, sessions) < self.low_load:
+                level -= 1
+            else:
+                return None
+
+            state['level'] = level
+            state['changed_at'] = now
+            return dict(self.levels[level])
+
+    def remove_session(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'global_latency_ms': (self._global_latency or 0.0) * 1000,
+                'sessions': {sid: {'level': state['level'],
+                                   'latency_ms': (state['latency'] or 0.0) * 1000}
+                             for sid, state in self._sessions.items()}
+            }
+
+    def _state(self, sid):
+        state = self._sessions.get(sid)
+        if state is None:
+            state = self._sessions[sid] = {'latency': None, 'level': 0, 'changed_at': self.clock()}
+        return state
+
+    def _ewma(self, average, value):
+        return value if average is None else average + self.alpha * (value - average)
+
+    def _load(self, latency, measured_level, level, sessions):
+        """Estimated load at ``level`` from latencies measured at ``measured_level``"""
+        # Processing time grows roughly with the pixels per frame
+        cost = self._pixels(level) / self._pixels(measured_level)
+        interval = self.levels[level]['interval_ms'] / 1000
+        session_load = latency * cost / interval
+        server_load = sessions * self._global_latency * cost / (interval * self.workers)
+        return max(session_load, server_load)
+
+    def _pixels(self, level):
+        return self.levels[level]['max_width'] * self.levels[level]['max_height']
@@ -0,0 +1,318 @@
+"""
+Load Test Script
+Simulated webcam clients and chat users against one server node. Camera
+clients replay a JPEG sequence to video_frame at a fixed frame rate and time
+each frame's round trip to emotion_detected; chat users post to /api/chat.
+Reports throughput, latency percentiles, dropped frames and the server's
+memory growth.
+
+Runs offline: unless --url is given, app.py is started on a local port with
+the stub language model (LLM_BACKEND=stub) and no durable history.
+"""
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import cv2
+import numpy as np
+import requests
+import socketio
+from benchmark import make_frame
+
+
+def load_frames(path=None, count=30, width=640, height=480, quality=80, seed=0):
+    """JPEG bytes of every image in directory ``path`` (sorted by name), or
+    of ``count`` synthetic frames with one face"""
+    if path:
+        frames = []
+        for filename in sorted(glob.glob(os.path.join(path, '*'))):
+            image = cv2.imread(filename)
+            if image is not None:
+                frames.append(cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes())
+        if not frames:
+            raise ValueError(f"No images found in {path}")
+        return frames
+
+    return [cv2.imencode('.jpg', make_frame(width, height, 1, seed=seed + i),
+                         [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+            for i in range(count)]
+
+
+def percentiles(values):
+    """Count, mean and p50/p90/p99/max in milliseconds of latencies in seconds"""
+    if not values:
+        return {'count': 0}
+    ms = np.asarray(values) * 1000
+    return {
+        'count': len(ms),
+        'mean': float(ms.mean()),
+        'p50': float(np.percentile(ms, 50)),
+        'p90': float(np.percentile(ms, 90)),
+        'p99': float(np.percentile(ms, 99)),
+        'max': float(ms.max())
+    }
+
+
+def read_metrics(url):
+    """Unlabeled samples of the server's /metrics, by name"""
+    samples = {}
+    for line in requests.get(url.rstrip('/') + '/metrics', timeout=5).text.splitlines():
+        if line and not line.startswith('#') and '{' not in line:
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+class CameraClient:
+    """Headless Socket.IO client sending ``frames`` in a loop at ``fps``
+
+    Every frame carries a ``frame_id`` the server echoes in frame_ack and
+    emotion_detected. Frames never acknowledged were dropped by the
+    server's newest-frame-wins scheduling (or are still in flight).
+    """
+    def __init__(self, url, frames, fps, transports=None):
+        self.url = url
+        self.frames = frames
+        self.fps = fps
+        self.transports = transports
+        self.sent = 0
+        self.acked = 0
+        self.detected = 0
+        self.errors = 0
+        self.round_trips = []
+
+        self._sent_at = {}
+        self._lock = threading.Lock()
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('emotion_detected', self._on_detected)
+        self.sio.on('frame_ack', self._on_ack)
+        self.sio.on('error', self._on_error)
+
+    def connect(self):
+        self.sio.connect(self.url, transports=self.transports)
+
+    def run(self, stop):
+        """Send frames until ``stop`` is set"""
+        interval = 1.0 / self.fps
+        next_frame_at = time.perf_counter()
+        while not stop.is_set():
+            with self._lock:
+                frame_id = self.sent
+                self._sent_at[frame_id] = time.perf_counter()
+                self.sent += 1
+            try:
+                self.sio.emit('video_frame', {'image': self.frames[frame_id % len(self.frames)],
+                                              'frame_id': frame_id})
+            except socketio.exceptions.SocketIOError as e:
+                print(f"Error sending frame: {e}")
+                self.errors += 1
+                return
+            next_frame_at += interval
+            stop.wait(max(0.0, next_frame_at - time.perf_counter()))
+
+    def disconnect(self):
+        self.sio.disconnect()
+
+    def _on_detected(self, data):
+        with self._lock:
+            sent_at = self._sent_at.get(data.get('frame_id'))
+            if sent_at is not None:
+                self.detected += 1
+                self.round_trips.append(time.perf_counter() - sent_at)
+
+    def _on_ack(self, data):
+        with self._lock:
+            if self._sent_at.pop(data.get('frame_id'), None) is not None:
+                self.acked += 1
+
+    def _on_error(self, data):
+        self.errors += 1
+
+
+class ChatUser:
+    """Posts chat messages to /api/chat, waiting ``interval`` seconds between them"""
+    def __init__(self, url, name, interval=1.0):
+        self.url = url.rstrip('/') + '/api/chat'
+        self.name = name
+        self.interval = interval
+        self.token = uuid.uuid4().hex
+        self.errors = 0
+        self.latencies = []
+        self.http = requests.Session()
+
+    def run(self, stop):
+        i = 0
+        while not stop.is_set():
+            # Distinct messages, so the response cache doesn't answer them
+            message = {'message': f"{self.name} message {i} ({self.token})", 'emotion': 'happy',
+                       'intensity': 0.6, 'session_id': self.name}
+            started = time.perf_counter()
+            try:
+                response = self.http.post(self.url, json=message, timeout=60)
+                if response.ok:
+                    self.latencies.append(time.perf_counter() - started)
+                else:
+                    self.errors += 1
+            except requests.RequestException:
+                self.errors += 1
+            i += 1
+            stop.wait(self.interval)
+
+
+def start_server(port, stub_latency, timeout=120.0):
+    """Start app.py with the stub language model and wait until it serves"""
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+    env = dict(os.environ, PORT=str(port), HOST='127.0.0.1', FLASK_DEBUG='0', LLM_BACKEND='stub',
+               STUB_LLM_LATENCY=str(stub_latency), HISTORY_DB_PATH='')
+    process = subprocess.Popen([sys.executable, app_path], env=env, cwd=os.path.dirname(app_path))
+
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            read_metrics(url)
+            return process, url
+        except requests.RequestException:
+            if time.monotonic() > deadline:
+                process.terminate()
+                raise RuntimeError(f"Server did not start on port {port}")
+            time.sleep(0.5)
+
+
+def run_stage(url, clients, chat_users, frames, fps, duration, chat_interval, transports=None, drain=2.0):
+    """Run ``clients`` cameras and ``chat_users`` chat users for ``duration`` seconds"""
+    before = read_metrics(url)
+    cameras = [CameraClient(url, frames, fps, transports) for _ in range(clients)]
+    for camera in cameras:
+        camera.connect()
+    chatters = [ChatUser(url, f"loadtest-{i}", chat_interval) for i in range(chat_users)]
+
+    stop = threading.Event()
+    threads = [threading.Thread(target=worker.run, args=(stop,), daemon=True)
+               for worker in cameras + chatters]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    # Let frames still in flight come back before counting drops
+    time.sleep(drain)
+    for camera in cameras:
+        camera.disconnect()
+    after = read_metrics(url)
+
+    sent = sum(camera.sent for camera in cameras)
+    acked = sum(camera.acked for camera in cameras)
+    chat_latencies = [latency for chatter in chatters for latency in chatter.latencies]
+
+    def delta(name):
+        return after.get(f'emotion_ai_{name}', 0.0) - before.get(f'emotion_ai_{name}', 0.0)
+
+    return {
+        'clients': clients,
+        'chat_users': chat_users,
+        'duration': elapsed,
+        'frames': {
+            'sent': sent,
+            'processed': acked,
+            'detected': sum(camera.detected for camera in cameras),
+            'dropped': sent - acked,
+            'errors': sum(camera.errors for camera in cameras),
+            'processed_per_second': acked / elapsed,
+            'round_trip_ms': percentiles([rtt for camera in cameras for rtt in camera.round_trips]),
+            'server_dropped': delta('frames_dropped_total')
+        },
+        'chat': {
+            'responses': len(chat_latencies),
+            'errors': sum(chatter.errors for chatter in chatters),
+            'responses_per_second': len(chat_latencies) / elapsed,
+            'latency_ms': percentiles(chat_latencies)
+        },
+        'memory': {
+            'rss_before_mb': before.get('emotion_ai_process_resident_memory_bytes', 0.0) / 2**20,
+            'rss_after_mb': after.get('emotion_ai_process_resident_memory_bytes', 0.0) / 2**20,
+            'growth_mb': delta('process_resident_memory_bytes') / 2**20
+        }
+    }
+
+
+def print_stage(stage):
+    frames, chat, memory = stage['frames'], stage['chat'], stage['memory']
+    rtt, chat_latency = frames['round_trip_ms'], chat['latency_ms']
+    print(f"{stage['clients']} cameras, {stage['chat_users']} chat users ({stage['duration']:.1f}s)")
+    print(f"  frames: {frames['processed_per_second']:.1f}/s processed, {frames['sent']} sent, "
+          f"{frames['dropped']} dropped ({frames['dropped'] / max(1, frames['sent']):.0%}), "
+          f"{frames['errors']} errors")
+    if rtt['count']:
+        print(f"  round trip: p50 {rtt['p50']:.1f} ms, p90 {rtt['p90']:.1f} ms, "
+              f"p99 {rtt['p99']:.1f} ms, max {rtt['max']:.1f} ms")
+    print(f"  chat: {chat['responses_per_second']:.2f}/s, {chat['errors']} errors")
+    if chat_latency['count']:
+        print(f"  chat latency: p50 {chat_latency['p50']:.1f} ms, p90 {chat_latency['p90']:.1f} ms, "
+              f"p99 {chat_latency['p99']:.1f} ms")
+    print(f"  server memory: {memory['rss_before_mb']:.1f} -> {memory['rss_after_mb']:.1f} MB "
+          f"({memory['growth_mb']:+.1f} MB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test one server node with simulated cameras and chat users")
+    parser.add_argument('--url', help="Server to test (default: start app.py with the stub model)")
+    parser.add_argument('--port', type=int, default=5599, help="Port for the started server")
+    parser.add_argument('--clients', default='1,2,4,8',
+                        help="Comma-separated camera counts, one stage each")
+    parser.add_argument('--chat-users', type=int, default=2, help="Concurrent chat users per stage")
+    parser.add_argument('--fps', type=float, default=10.0, help="Frames per second per camera")
+    parser.add_argument('--duration', type=float, default=20.0, help="Seconds per stage")
+    parser.add_argument('--chat-interval', type=float, default=1.0,
+                        help="Seconds each chat user waits between messages")
+    parser.add_argument('--stub-latency', type=float, default=0.5,
+                        help="Response time of the started server's stub model")
+    parser.add_argument('--frames', help="Directory of images to replay (default: synthetic faces)")
+    parser.add_argument('--transport', choices=['polling', 'websocket'],
+                        help="Socket.IO transport (default: polling, upgraded when possible)")
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    frames = load_frames(args.frames)
+    transports = [args.transport] if args.transport else None
+
+    server = None
+    url = args.url
+    if not url:
+        server, url = start_server(args.port, args.stub_latency)
+
+    stages = []
+    try:
+        for clients in (int(n) for n in args.clients.split(',')):
+            stage = run_stage(url, clients, args.chat_users, frames, args.fps, args.duration,
+                              args.chat_interval, transports)
+            print_stage(stage)
+            stages.append(stage)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'url': url, 'fps': args.fps, 'stages': stages}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""
+Metrics Module
+Counters, gauges and latency histograms exported in the Prometheus text
+format, stage timers for the frame and chat paths, and a sampling profiler
+that can be switched on while the server runs
+"""
+
+import bisect
+import collections
+import os
+import sys
+import threading
+import time
+
+# Upper bounds in seconds, from sub-millisecond stages to slow model calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ''
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def resident_memory_bytes():
+    """Resident set size of this process (the peak size where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        try:
+            import resource
+        except ImportError:
+            return 0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Metric:
+    """A named metric with one value (or histogram) per label combination
+
+    With a ``function`` the value is read from it when the metric is
+    rendered, e.g. to export a queue size another component already keeps.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self):
+        """(suffix, label names, label values, value) tuples to render"""
+        if self.function is not None:
+            return [('', (), (), self.function())]
+        with self._lock:
+            if not self.labelnames and not self._values:
+                return [('', (), (), 0)]
+            return [('', self.labelnames, key, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labelnames, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labelnames, values)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """Latency distribution in cumulative buckets, plus sum and count"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (not yet cumulative) counts, sum, count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        """Context manager observing the time spent inside it"""
+        return _Timer(self, labels)
+
+    def snapshot(self, **labels):
+        """Count, sum and cumulative bucket counts of one label combination"""
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, [[0] * (len(self.buckets) + 1), 0.0, 0])
+            counts = list(counts)
+        cumulative = [sum(counts[:i + 1]) for i in range(len(counts))]
+        return {'count': count, 'sum': total,
+                'buckets': dict(zip(self.buckets + (float('inf'),), cumulative))}
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        for key, counts, total, count in items:
+            running = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                running += bucket_count
+                samples.append(('_bucket', self.labelnames + ('le',), key + (_format_value(bound),), running))
+            samples.append(('_sum', self.labelnames, key, total))
+            samples.append(('_count', self.labelnames, key, count))
+        return samples
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class StageTimer:
+    """Times the consecutive stages of one operation
+
+    Each ``mark(stage)`` records the time since the previous mark (or since
+    the timer was created) in ``timings`` and, when a histogram with a
+    ``stage`` label is given, observes it there with ``labels``. Without a
+    histogram the timings can be sent elsewhere, e.g. back from a worker
+    process, and observed later. ``started`` is a perf_counter time to
+    count the first stage from instead of now.
+    """
+    def __init__(self, histogram=None, started=None, **labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.timings = {}
+        self.started = self._last = time.perf_counter() if started is None else started
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        self.timings[stage] = self.timings.get(stage, 0.0) + elapsed
+        if self.histogram is not None:
+            self.histogram.observe(elapsed, stage=stage, **self.labels)
+        return elapsed
+
+    def add(self, timings):
+        """Record stages timed elsewhere, e.g. in a worker, during the current
+        stage; the next ``mark`` only counts the time not covered by them"""
+        for stage, seconds in timings.items():
+            self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+            if self.histogram is not None:
+                self.histogram.observe(seconds, stage=stage, **self.labels)
+        self._last = min(self._last + sum(timings.values()), time.perf_counter())
+
+    def elapsed(self):
+        """Seconds since the timer was created"""
+        return time.perf_counter() - self.started
+
+
+class MetricsRegistry:
+    """The metrics of one server, rendered together by ``render``"""
+    def __init__(self, namespace=''):
+        self.namespace = namespace
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation, labelnames=(), function=None):
+        return self._register(Counter(self._name(name), documentation, labelnames, function))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self._register(Gauge(self._name(name), documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self._name(name), documentation, labelnames, buckets))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        blocks = []
+        for metric in metrics:
+            try:
+                blocks.append(metric.render())
+            except Exception as e:
+                print(f"Error rendering metric {metric.name}: {e}")
+        return '\n'.join(blocks) + '\n'
+
+    def _name(self, name):
+        return f"{self.namespace}_{name}" if self.namespace else name
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+
+class SamplingProfiler:
+    """Statistical profiler sampling the stacks of all threads
+
+    While running, a background thread records every thread's Python stack
+    each ``interval`` seconds. ``report`` returns the stacks in the collapsed
+    format flame graph tools read: one ``frame;frame;frame count`` line per
+    distinct stack, root first. Only stacks seen while running cost anything.
+    """
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self._stacks = collections.Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start sampling; returns False if it was already running"""
+        with self._lock:
+            if self.running:
+                return False
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """Stop sampling, keeping the samples taken so far"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+
+    def report(self, limit=None):
+        with self._lock:
+            stacks = self._stacks.most_common(limit)
+        return ''.join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                frames = []
+                while frame is not None and len(frames) < self.max_depth:
+                    code = frame.f_code
+                    name = names.get(code)
+                    if name is None:
+                        name = names[code] = f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})"
+                    frames.append(name)
+                    frame = frame.f_back
+                stacks.append(';'.join(reversed(frames)))
+
+            with self._lock:
+                self._stacks.update(stacks)
+                self.samples += 1
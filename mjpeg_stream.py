@@ -0,0 +1,104 @@
+"""
+MJPEG Stream Module
+Fans the latest annotated JPEG of each session out to any number of
+multipart/x-mixed-replace viewers
+"""
+
+import threading
+import time
+
+import numpy as np
+
+BOUNDARY = 'frame'
+
+
+def scale_landmarks_data(landmarks_data, factor):
+    """Landmarks and face rects multiplied by ``factor``, e.g. to draw them
+    on a frame smaller than the image they were computed for"""
+    scaled = []
+    for face_data in landmarks_data or []:
+        face = dict(face_data)
+        if 'landmarks' in face:
+            face['landmarks'] = np.asarray(face['landmarks']) * factor
+        if 'face_rect' in face:
+            face['face_rect'] = tuple(int(round(v * factor)) for v in face['face_rect'])
+        scaled.append(face)
+    return scaled
+
+
+class MjpegBroadcaster:
+    """Latest JPEG per session, shared by every viewer of that session
+
+    Producers call ``has_viewers`` first and only render and encode a frame
+    when someone is watching, then ``publish`` the bytes once. Each viewer
+    polls for a newer frame with ``sleep`` (e.g. ``socketio.sleep``) and
+    always gets the latest one, so a slow viewer skips frames instead of
+    holding up the producer. A viewer ends after ``idle_timeout`` seconds
+    without a new frame.
+    """
+    def __init__(self, sleep=time.sleep, poll_interval=0.02, idle_timeout=30.0, clock=time.monotonic):
+        self.sleep = sleep
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._viewers = {}  # session -> number of connected viewers
+        self._frames = {}   # session -> (sequence number, JPEG bytes)
+        self._stats = {'published': 0, 'sent': 0, 'skipped': 0}
+
+    def has_viewers(self, session):
+        with self._lock:
+            return self._viewers.get(session, 0) > 0
+
+    def publish(self, session, jpeg):
+        """Make ``jpeg`` the session's latest frame"""
+        with self._lock:
+            seq = self._frames[session][0] + 1 if session in self._frames else 1
+            self._frames[session] = (seq, jpeg)
+            self._stats['published'] += 1
+
+    def remove_session(self, session):
+        """Forget a session's frame; its viewers end after the idle timeout"""
+        with self._lock:
+            self._frames.pop(session, None)
+
+    def stream(self, session):
+        """Yield multipart chunks of the session's frames for one viewer"""
+        with self._lock:
+            self._viewers[session] = self._viewers.get(session, 0) + 1
+
+        last_seq = 0
+        last_frame_at = self.clock()
+        try:
+            while True:
+                with self._lock:
+                    entry = self._frames.get(session)
+
+                if entry is not None and entry[0] != last_seq:
+                    seq, jpeg = entry
+                    with self._lock:
+                        if last_seq and seq > last_seq + 1:
+                            self._stats['skipped'] += seq - last_seq - 1
+                        self._stats['sent'] += 1
+                    last_seq = seq
+                    last_frame_at = self.clock()
+                    yield (f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                           f"Content-Length: {len(jpeg)}\r\n\r\n").encode() + jpeg + b"\r\n"
+                elif self.clock() - last_frame_at > self.idle_timeout:
+                    return
+                else:
+                    self.sleep(self.poll_interval)
+        finally:
+            with self._lock:
+                self._viewers[session] -= 1
+                if self._viewers[session] == 0:
+                    del self._viewers[session]
+                    self._frames.pop(session, None)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['viewers'] = sum(self._viewers.values())
+            stats['sessions_watched'] = len(self._viewers)
+        return stats
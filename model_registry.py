@@ -0,0 +1,57 @@
+"""
+Model Registry Module
+Loads each detection model file once and hands out the loaded models, so
+components that use the same model share it instead of loading it again
+"""
+
+import os
+import threading
+
+import cv2
+
+FACE_CASCADE = 'haarcascade_frontalface_default.xml'
+
+# CascadeClassifier keeps per-image state while detecting, so each thread
+# gets its own instance of a cascade; a thread loads a file only once
+_cascades = threading.local()
+
+# dnn nets are shared by the whole process, each with a lock serializing
+# inference on it
+_nets = {}
+_nets_lock = threading.Lock()
+
+
+def get_cascade(name=FACE_CASCADE):
+    """The calling thread's classifier for a cascade file
+
+    ``name`` is a file in OpenCV's bundled haarcascades directory or a path.
+    """
+    cascades = getattr(_cascades, 'by_name', None)
+    if cascades is None:
+        cascades = _cascades.by_name = {}
+    cascade = cascades.get(name)
+    if cascade is None:
+        path = name if os.path.dirname(name) else cv2.data.haarcascades + name
+        cascade = cv2.CascadeClassifier(path)
+        if cascade.empty():
+            raise ValueError(f"Could not load cascade {path}")
+        cascades[name] = cascade
+    return cascade
+
+
+def get_dnn_net(model_path):
+    """The process-wide net for an ONNX model and its inference lock"""
+    with _nets_lock:
+        if model_path not in _nets:
+            net = cv2.dnn.readNetFromONNX(model_path)
+            net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+            _nets[model_path] = (net, threading.Lock())
+        return _nets[model_path]
+
+
+def loaded_models():
+    """Names of the models loaded so far (cascades of the calling thread)"""
+    with _nets_lock:
+        nets = list(_nets)
+    return {'cascades': list(getattr(_cascades, 'by_name', {})), 'dnn_nets': nets}
@@ -0,0 +1,85 @@
+"""
+Payload Codec Module
+Compact binary form of emotion_detected results: uint8 emotion scores,
+int16 landmark coordinates and skipping of landmarks that did not move
+"""
+
+import numpy as np
+from emotion_detector import EMOTION_LABELS
+from face_analyzer import as_landmark_array
+
+PAYLOAD_VERSION = 1
+
+# Landmarks are sent in 1/LANDMARK_SCALE pixel units, which keeps them in
+# int16 range for frames up to 8191 pixels wide
+LANDMARK_SCALE = 4
+
+
+def quantize_scores(emotions, labels=EMOTION_LABELS):
+    """Pack emotion probabilities into one byte each, in label order"""
+    values = np.array([emotions.get(label, 0.0) for label in labels], dtype=np.float32)
+    return np.rint(np.clip(values, 0.0, 1.0) * 255).astype(np.uint8).tobytes()
+
+
+def dequantize_scores(data, labels=EMOTION_LABELS):
+    values = np.frombuffer(data, dtype=np.uint8).astype(np.float32) / 255
+    return dict(zip(labels, values.tolist()))
+
+
+def pack_landmarks(landmarks):
+    """Pack (N, 2) landmark coordinates as little-endian int16 x, y pairs"""
+    coords = np.rint(as_landmark_array(landmarks) * LANDMARK_SCALE)
+    return np.clip(coords, -32768, 32767).astype('<i2').tobytes()
+
+
+def unpack_landmarks(data):
+    return np.frombuffer(data, dtype='<i2').reshape(-1, 2).astype(np.float32) / LANDMARK_SCALE
+
+
+class PayloadEncoder:
+    """Per-session encoder for the compact emotion_detected format
+
+    Each payload is ``{'v', 'scores', 'faces'}``: ``scores`` holds one byte
+    per emotion in EMOTION_LABELS order and each face has its ``rect`` and,
+    when per-face emotions are given, its own ``scores``. A ``frame_id``
+    the client sent with the frame is echoed as is.
+    With ``include_landmarks`` a face also carries packed ``landmarks``,
+    unless no point moved ``landmark_threshold`` pixels or more since they
+    were last sent for that face; the client then keeps the previous ones.
+    """
+    def __init__(self, include_landmarks=True, landmark_threshold=1.0):
+        self.include_landmarks = include_landmarks
+        self.landmark_threshold = landmark_threshold
+        self._sent = []  # landmarks last sent, per face index
+        self.stats = {'payloads': 0, 'landmarks_sent': 0, 'landmarks_skipped': 0}
+
+    def encode(self, emotions, landmarks_data, face_emotions=None, frame_id=None):
+        faces = []
+        sent = []
+        for i, face_data in enumerate(landmarks_data or []):
+            face = {}
+            if 'face_rect' in face_data:
+                face['rect'] = [int(v) for v in face_data['face_rect']]
+            if face_emotions is not None and i < len(face_emotions):
+                face['scores'] = quantize_scores(dict(zip(EMOTION_LABELS, face_emotions[i].tolist())))
+
+            if self.include_landmarks and 'landmarks' in face_data:
+                landmarks = as_landmark_array(face_data['landmarks'])
+                previous = self._sent[i] if i < len(self._sent) else None
+                if (previous is not None and previous.shape == landmarks.shape
+                        and np.abs(landmarks - previous).max() < self.landmark_threshold):
+                    sent.append(previous)
+                    self.stats['landmarks_skipped'] += 1
+                else:
+                    face['landmarks'] = pack_landmarks(landmarks)
+                    sent.append(landmarks.copy())
+                    self.stats['landmarks_sent'] += 1
+
+            faces.append(face)
+
+        self._sent = sent
+        self.stats['payloads'] += 1
+        payload = {'v': PAYLOAD_VERSION, 'scores': quantize_scores(emotions), 'faces': faces}
+        if frame_id is not None:
+            payload['frame_id'] = frame_id
+        return payload
@@ -0,0 +1,331 @@
+"""
+Redis Stand-in Module
+A small in-process server speaking the Redis protocol, with the strings,
+lists, hashes, expiry and pub/sub commands the session store and the
+Socket.IO message queue use. For tests and single-host multi-worker runs;
+use a real Redis anywhere else.
+"""
+
+import fnmatch
+import socketserver
+import threading
+import time
+
+
+class _Reply:
+    """Simple-string or error reply, as opposed to a bulk string"""
+    def __init__(self, text, error=False):
+        self.text = text
+        self.error = error
+
+
+OK = _Reply('OK')
+
+# Returned by commands that send their replies themselves (SUBSCRIBE)
+_NO_REPLY = object()
+
+
+def encode_reply(value):
+    """Serialize a reply in RESP2"""
+    if isinstance(value, _Reply):
+        return f"{'-' if value.error else '+'}{value.text}\r\n".encode()
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, int):
+        return f":{value}\r\n".encode()
+    if isinstance(value, (list, tuple)):
+        return f"*{len(value)}\r\n".encode() + b''.join(encode_reply(item) for item in value)
+    if isinstance(value, str):
+        value = value.encode()
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+class _Connection(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()
+        self.channels = set()
+        self.transaction = None
+
+    def handle(self):
+        server = self.server.standin
+        try:
+            while True:
+                command = self._read_command()
+                if command is None:
+                    return
+                name = command[0].decode().upper()
+                args = command[1:]
+
+                if self.transaction is not None and name not in ('EXEC', 'DISCARD', 'MULTI'):
+                    self.transaction.append((name, args))
+                    self.send(_Reply('QUEUED'))
+                elif name == 'MULTI':
+                    self.transaction = []
+                    self.send(OK)
+                elif name == 'EXEC':
+                    queued, self.transaction = self.transaction or [], None
+                    self.send([server.execute(self, n, a) for n, a in queued])
+                elif name == 'DISCARD':
+                    self.transaction = None
+                    self.send(OK)
+                else:
+                    reply = server.execute(self, name, args)
+                    if reply is not _NO_REPLY:
+                        self.send(reply)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            server.unsubscribe_all(self)
+
+    def send(self, reply):
+        data = encode_reply(reply)
+        with self.write_lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            # Inline command, e.g. from telnet
+            return line.split()
+        parts = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            parts.append(self.rfile.read(length + 2)[:-2])
+        return parts
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class RedisStandin:
+    """Threaded Redis-protocol server on ``host``:``port`` (0 picks a free port)
+
+    ``url`` is the redis:// URL clients connect to once ``start`` returned.
+    Data lives in memory and is lost when the server stops.
+    """
+    def __init__(self, host='127.0.0.1', port=0):
+        self._data = {}
+        self._expires = {}
+        self._subscribers = {}  # channel -> set of connections
+        self._lock = threading.RLock()
+
+        self._server = _Server((host, port), _Connection)
+        self._server.standin = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='redis-standin', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def execute(self, connection, name, args):
+        handler = getattr(self, f"_cmd_{name.lower()}", None)
+        if handler is None:
+            return _Reply(f"ERR unknown command '{name}'", error=True)
+        try:
+            with self._lock:
+                return handler(connection, *args)
+        except TypeError:
+            return _Reply(f"ERR wrong number of arguments for '{name}' command", error=True)
+        except (ValueError, KeyError) as e:
+            return _Reply(f"ERR {e}", error=True)
+
+    def unsubscribe_all(self, connection):
+        with self._lock:
+            for channel in connection.channels:
+                self._subscribers.get(channel, set()).discard(connection)
+            connection.channels.clear()
+
+    # Keyspace helpers
+
+    def _get(self, key, kind=None):
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        value = self._data.get(key)
+        if value is not None and kind is not None and not isinstance(value, kind):
+            raise ValueError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _delete(self, key):
+        self._expires.pop(key, None)
+        return self._data.pop(key, None) is not None
+
+    def _keys(self, pattern=b'*'):
+        pattern = pattern.decode()
+        return [key for key in list(self._data)
+                if self._get(key) is not None and fnmatch.fnmatchcase(key.decode(), pattern)]
+
+    # Connection
+
+    def _cmd_ping(self, connection, message=None):
+        return _Reply('PONG') if message is None else message
+
+    def _cmd_echo(self, connection, message):
+        return message
+
+    def _cmd_select(self, connection, db):
+        return OK
+
+    def _cmd_client(self, connection, *args):
+        return OK
+
+    def _cmd_flushall(self, connection, *args):
+        self._data.clear()
+        self._expires.clear()
+        return OK
+
+    _cmd_flushdb = _cmd_flushall
+
+    # Keys and strings
+
+    def _cmd_get(self, connection, key):
+        return self._get(key, bytes)
+
+    def _cmd_set(self, connection, key, value, *options):
+        self._delete(key)
+        self._data[key] = value
+        options = [option.upper() for option in options]
+        if b'EX' in options:
+            self._expires[key] = time.time() + int(options[options.index(b'EX') + 1])
+        return OK
+
+    def _cmd_del(self, connection, *keys):
+        return sum(self._delete(key) for key in keys)
+
+    def _cmd_exists(self, connection, *keys):
+        return sum(self._get(key) is not None for key in keys)
+
+    def _cmd_expire(self, connection, key, seconds):
+        if self._get(key) is None:
+            return 0
+        self._expires[key] = time.time() + int(seconds)
+        return 1
+
+    def _cmd_ttl(self, connection, key):
+        if self._get(key) is None:
+            return -2
+        expires_at = self._expires.get(key)
+        return -1 if expires_at is None else int(round(expires_at - time.time()))
+
+    def _cmd_keys(self, connection, pattern):
+        return self._keys(pattern)
+
+    def _cmd_scan(self, connection, cursor, *options):
+        options = list(options)
+        upper = [option.upper() for option in options]
+        pattern = options[upper.index(b'MATCH') + 1] if b'MATCH' in upper else b'*'
+        return [b'0', self._keys(pattern)]
+
+    # Lists
+
+    def _cmd_rpush(self, connection, key, *values):
+        items = self._get(key, list)
+        if items is None:
+            items = self._data[key] = []
+        items.extend(values)
+        return len(items)
+
+    def _cmd_llen(self, connection, key):
+        return len(self._get(key, list) or [])
+
+    def _cmd_lrange(self, connection, key, start, stop):
+        items = self._get(key, list) or []
+        start, stop = int(start), int(stop)
+        stop = len(items) if stop == -1 else (stop + 1 if stop >= 0 else len(items) + stop + 1)
+        return items[start if start >= 0 else max(0, len(items) + start):stop]
+
+    def _cmd_ltrim(self, connection, key, start, stop):
+        items = self._get(key, list)
+        if items is not None:
+            kept = self._cmd_lrange(connection, key, start, stop)
+            if kept:
+                items[:] = kept
+            else:
+                self._delete(key)
+        return OK
+
+    # Hashes
+
+    def _cmd_hset(self, connection, key, *pairs):
+        fields = self._get(key, dict)
+        if fields is None:
+            fields = self._data[key] = {}
+        added = 0
+        for field, value in zip(pairs[::2], pairs[1::2]):
+            added += field not in fields
+            fields[field] = value
+        return added
+
+    def _cmd_hget(self, connection, key, field):
+        return (self._get(key, dict) or {}).get(field)
+
+    def _cmd_hdel(self, connection, key, *fields):
+        values = self._get(key, dict) or {}
+        removed = sum(values.pop(field, None) is not None for field in fields)
+        if not values:
+            self._delete(key)
+        return removed
+
+    def _cmd_hgetall(self, connection, key):
+        values = self._get(key, dict) or {}
+        return [item for pair in values.items() for item in pair]
+
+    # Pub/sub
+
+    def _cmd_publish(self, connection, channel, message):
+        receivers = list(self._subscribers.get(channel, ()))
+        for receiver in receivers:
+            try:
+                receiver.send([b'message', channel, message])
+            except OSError:
+                pass
+        return len(receivers)
+
+    def _cmd_subscribe(self, connection, *channels):
+        for channel in channels:
+            self._subscribers.setdefault(channel, set()).add(connection)
+            connection.channels.add(channel)
+            connection.send([b'subscribe', channel, len(connection.channels)])
+        return _NO_REPLY
+
+    def _cmd_unsubscribe(self, connection, *channels):
+        for channel in channels or list(connection.channels):
+            self._subscribers.get(channel, set()).discard(connection)
+            connection.channels.discard(channel)
+            connection.send([b'unsubscribe', channel, len(connection.channels)])
+        return _NO_REPLY
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the in-process Redis stand-in")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args()
+
+    standin = RedisStandin(args.host, args.port).start()
+    print(f"Redis stand-in listening on {standin.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        standin.stop()
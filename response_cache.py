@@ -0,0 +1,120 @@
+"""
+Response Cache Module
+LRU + TTL cache for language model responses, keyed on the normalized user
+message, the emotion and the quantized emotion intensity
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    def __init__(self, max_size=256, ttl=600, intensity_buckets=4, max_message_length=100,
+                 path=None, clock=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.intensity_buckets = intensity_buckets
+        # Long messages are practically unique, so they are never cached
+        self.max_message_length = max_message_length
+        self.path = path
+        self.clock = clock
+
+        self._entries = OrderedDict()  # key -> (stored_at, response), oldest first
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if path and os.path.exists(path):
+            self.load()
+
+    def make_key(self, message, emotion, intensity):
+        """Cache key for a message, or None if the message is not cacheable"""
+        normalized = ' '.join(re.sub(r'[^\w\s]', '', message.lower()).split())
+        if not normalized or len(normalized) > self.max_message_length:
+            return None
+
+        bucket = min(int(float(intensity) * self.intensity_buckets), self.intensity_buckets - 1)
+        return f"{emotion}|{max(bucket, 0)}|{normalized}"
+
+    def get(self, key):
+        """Return the cached response for a key, or None"""
+        if key is None:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.clock() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.evictions += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, response):
+        """Store a response, evicting the least recently used entries"""
+        if key is None or not response:
+            return
+
+        with self._lock:
+            self._entries[key] = (self.clock(), response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'max_size': self.max_size
+            }
+
+    def save(self):
+        """Write the unexpired entries to ``path`` as JSON"""
+        if not self.path:
+            return
+
+        with self._lock:
+            now = self.clock()
+            entries = [[key, stored_at, response]
+                       for key, (stored_at, response) in self._entries.items()
+                       if now - stored_at <= self.ttl]
+
+        # Write to a temporary file first so a crash never leaves half a cache
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        """Read entries saved by save(), skipping expired ones"""
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error loading response cache: {e}")
+            return
+
+        with self._lock:
+            now = self.clock()
+            for key, stored_at, response in entries[-self.max_size:]:
+                if now - stored_at <= self.ttl:
+                    self._entries[key] = (stored_at, response)
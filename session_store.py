@@ -0,0 +1,221 @@
+"""
+Session Store Module
+Session state shared by every server worker through Redis: emotion and
+conversation histories, the worker owning each session, and the Socket.IO
+message queue
+"""
+
+import json
+import queue
+import threading
+
+import numpy as np
+import socketio
+from emotion_detector import EMOTION_LABELS
+from emotion_history import DEFAULT_WINDOWS, select_samples, emotion_entries
+
+# One stored emotion sample: Unix time and probabilities in label order
+SAMPLE_DTYPE = np.dtype([('timestamp', '<f8'), ('probabilities', '<f4', (len(EMOTION_LABELS),))])
+
+
+def connect_redis(url):
+    """Redis client for a redis:// URL (needs the redis package)"""
+    import redis
+
+    return redis.Redis.from_url(url)
+
+
+class RedisEmotionHistory:
+    """A session's emotion samples in a capped Redis list
+
+    Offers the EmotionRingBuffer query interface. Rolling aggregates are
+    computed from the stored samples when asked for, since any worker may
+    append.
+    """
+    def __init__(self, client, key, capacity=3000, ttl=3600, windows=None, labels=EMOTION_LABELS):
+        self.client = client
+        self.key = key
+        self.capacity = capacity
+        self.ttl = ttl
+        self.windows = windows or DEFAULT_WINDOWS
+        self.labels = list(labels)
+
+    def __len__(self):
+        return self.client.llen(self.key)
+
+    def append(self, timestamp, emotions):
+        """Add one sample; ``emotions`` is a dict by label or an array in label order"""
+        if isinstance(emotions, dict):
+            emotions = [emotions.get(label, 0.0) for label in self.labels]
+        sample = np.zeros(1, dtype=SAMPLE_DTYPE)
+        sample['timestamp'] = timestamp
+        sample['probabilities'] = emotions
+
+        pipe = self.client.pipeline(transaction=False)
+        pipe.rpush(self.key, sample.tobytes())
+        pipe.ltrim(self.key, -self.capacity, -1)
+        pipe.expire(self.key, self.ttl)
+        pipe.execute()
+
+    def samples(self, newest=None):
+        """Timestamps and (N, 7) probabilities of all (or the ``newest``) samples"""
+        data = self.client.lrange(self.key, -newest if newest else 0, -1)
+        samples = np.frombuffer(b''.join(data), dtype=SAMPLE_DTYPE)
+        return samples['timestamp'], samples['probabilities']
+
+    def aggregates(self, now=None):
+        """Mean, max and dominant emotion over every rolling window"""
+        timestamps, probabilities = self.samples()
+        if now is None:
+            now = timestamps[-1] if len(timestamps) else 0.0
+
+        result = {}
+        for name, seconds in self.windows.items():
+            window = probabilities[timestamps >= now - seconds]
+            if len(window) == 0:
+                result[name] = {'count': 0, 'mean': {}, 'max': {}, 'dominant': None}
+                continue
+
+            mean = window.mean(axis=0, dtype=np.float64)
+            result[name] = {
+                'count': len(window),
+                'mean': dict(zip(self.labels, mean.tolist())),
+                'max': dict(zip(self.labels, window.max(axis=0).tolist())),
+                'dominant': self.labels[int(np.argmax(mean))]
+            }
+        return result
+
+    def query(self, start=None, end=None, limit=None, points=None):
+        """Samples in time order, like EmotionRingBuffer.query"""
+        # Without a time range only the newest ``limit`` samples are fetched
+        newest = limit if start is None and end is None else None
+        timestamps, probabilities = self.samples(newest)
+        return select_samples(timestamps, probabilities, start, end, limit, points)
+
+    def to_entries(self, timestamps, probabilities):
+        return emotion_entries(timestamps, probabilities, self.labels)
+
+
+class RedisConversation:
+    """A session's conversation entries as JSON in a capped Redis list"""
+    def __init__(self, client, key, capacity=200, ttl=3600):
+        self.client = client
+        self.key = key
+        self.capacity = capacity
+        self.ttl = ttl
+
+    def __len__(self):
+        return self.client.llen(self.key)
+
+    def __iter__(self):
+        return iter([json.loads(item) for item in self.client.lrange(self.key, 0, -1)])
+
+    def append(self, entry):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.rpush(self.key, json.dumps(entry))
+        pipe.ltrim(self.key, -self.capacity, -1)
+        pipe.expire(self.key, self.ttl)
+        pipe.execute()
+
+
+class RedisSessionHistories:
+    """SessionHistories kept in Redis, so every worker sees every session
+
+    Keys expire ``ttl`` seconds after the last write, which cleans up after
+    workers that died without seeing their clients disconnect.
+    """
+    def __init__(self, client, capacity=3000, conversation_capacity=200, windows=None,
+                 ttl=3600, prefix='emotion_ai'):
+        self.client = client
+        self.capacity = capacity
+        self.conversation_capacity = conversation_capacity
+        self.windows = windows
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def emotions(self, session, create=True):
+        """The session's emotion history; None if it has none and ``create`` is False"""
+        key = f"{self.prefix}:emotions:{session}"
+        if not create and not self.client.exists(key):
+            return None
+        return RedisEmotionHistory(self.client, key, self.capacity, self.ttl, self.windows)
+
+    def conversation(self, session, create=True):
+        """The session's conversation history; None if it has none and ``create`` is False"""
+        key = f"{self.prefix}:conversation:{session}"
+        if not create and not self.client.exists(key):
+            return None
+        return RedisConversation(self.client, key, self.conversation_capacity, self.ttl)
+
+    def remove(self, session):
+        """Free everything stored for a session"""
+        self.client.delete(f"{self.prefix}:emotions:{session}", f"{self.prefix}:conversation:{session}")
+
+    def session_count(self):
+        sessions = set()
+        for kind in ('emotions', 'conversation'):
+            prefix = f"{self.prefix}:{kind}:"
+            for key in self.client.scan_iter(match=prefix + '*'):
+                sessions.add(key.decode()[len(prefix):])
+        return len(sessions)
+
+
+class SessionOwners:
+    """Which worker holds each session's Socket.IO connection
+
+    Per-connection state (face tracking, frame scheduling, MJPEG frames)
+    lives on that worker; other workers use this to send requests for a
+    session there.
+    """
+    def __init__(self, client, worker_id, prefix='emotion_ai'):
+        self.client = client
+        self.worker_id = worker_id
+        self.key = f"{prefix}:owners"
+
+    def claim(self, session):
+        self.client.hset(self.key, session, self.worker_id)
+
+    def release(self, session):
+        self.client.hdel(self.key, session)
+
+    def sessions(self):
+        """Every session with a connection on some worker"""
+        return [session.decode() for session in self.client.hkeys(self.key)]
+
+    def owner(self, session):
+        owner = self.client.hget(self.key, session)
+        return owner.decode() if owner is not None else None
+
+
+class ThreadedRedisManager(socketio.RedisManager):
+    """Socket.IO message queue over Redis for an eventlet server that is not
+    monkey patched
+
+    socketio.RedisManager needs green sockets to read its subscription
+    without blocking the event loop. This one reads it on an OS thread and
+    hands the messages to the event loop through a queue, polled with the
+    server's cooperative sleep.
+    """
+    name = 'redis-threaded'
+
+    def __init__(self, url, channel='socketio', poll_interval=0.005, **kwargs):
+        super().__init__(url, channel=channel, **kwargs)
+        self.poll_interval = poll_interval
+
+    def initialize(self):
+        # Skips RedisManager's monkey patching check
+        socketio.PubSubManager.initialize(self)
+
+    def _listen(self):
+        messages = queue.Queue()
+
+        def read():
+            for message in socketio.RedisManager._listen(self):
+                messages.put(message)
+
+        threading.Thread(target=read, name='socketio-redis', daemon=True).start()
+        while True:
+            try:
+                yield messages.get_nowait()
+            except queue.Empty:
+                self.server.sleep(self.poll_interval)
@@ -59,6 +59,1053 @@ def test_face_analysis():
         print(f"❌ Face analysis error: {e}")
         return False
 
+def test_frame_pipeline():
+    """Test the shared frame analysis pipeline with dummy data"""
+    try:
+        from frame_pipeline import FramePipeline
+        import numpy as np
+        
+        pipeline = FramePipeline()
+        
+        # Create a dummy frame
+        dummy_frame = np.zeros((480, 640, 3), dtype=np.uint8)
+        result = pipeline.analyze_frame(dummy_frame)
+        
+        if isinstance(result.emotions, dict) and len(result.faces) == len(result.landmarks_data):
+            print("✅ Frame pipeline working")
+            print(f"Faces detected: {len(result.faces)}")
+            return True
+        else:
+            print("❌ Frame pipeline failed")
+            return False
+    except Exception as e:
+        print(f"❌ Frame pipeline error: {e}")
+        return False
+
+def test_face_tracking():
+    """Test detect-then-track mode on frames with a synthetic face"""
+    try:
+        from frame_pipeline import FramePipeline, FaceTracker
+        from benchmark import make_frame
+        import numpy as np
+        
+        pipeline = FramePipeline(detect_scale=0.5, seed=0)
+        tracker = FaceTracker(detect_interval=3)
+        
+        # Count full detections
+        detections = []
+        detect_faces = pipeline.detect_faces
+        def counting_detect_faces(gray):
+            detections.append(len(detections))
+            return detect_faces(gray)
+        pipeline.detect_faces = counting_detect_faces
+        
+        # A full detection, 3 frames tracked near the face, then the next full detection
+        frame = make_frame(640, 480, 1)
+        results = [pipeline.analyze_frame(frame, tracker) for _ in range(6)]
+        tracked = [r.tracked for r in results]
+        periodic_detections = len(detections)
+        
+        # Losing the face falls back to a full detection on the same frame
+        empty = np.full((480, 640, 3), 120, dtype=np.uint8)
+        lost = pipeline.analyze_frame(empty, tracker)
+        
+        if (tracked == [False, True, True, True, False, True] and periodic_detections == 2
+                and all(len(r.faces) == 1 for r in results)
+                and not lost.tracked and len(lost.faces) == 0 and len(detections) == 3
+                and tracker.needs_detection()):
+            print("✅ Face tracking working")
+            return True
+        else:
+            print("❌ Face tracking failed")
+            return False
+    except Exception as e:
+        print(f"❌ Face tracking error: {e}")
+        return False
+
+def test_landmark_arrays():
+    """Test batched landmark generation and the legacy dict view"""
+    try:
+        from face_analyzer import FaceAnalyzer, landmarks_to_dicts
+        import numpy as np
+        
+        analyzer = FaceAnalyzer()
+        faces = np.array([[10, 20, 100, 100], [200, 150, 80, 80]], dtype=np.int32)
+        landmarks_data = analyzer.analyze_faces(faces)
+        
+        landmarks = landmarks_data[1]['landmarks']
+        legacy = landmarks_to_dicts(landmarks)
+        
+        if (landmarks.shape == (468, 2) and landmarks.dtype == np.float32
+                and len(legacy) == 468 and 'mouth_curve' in landmarks_data[0]['emotion_features']):
+            print("✅ Landmark arrays working")
+            return True
+        else:
+            print("❌ Landmark arrays failed")
+            return False
+    except Exception as e:
+        print(f"❌ Landmark arrays error: {e}")
+        return False
+
+def test_frame_decoding():
+    """Test binary and data URL frame decoding"""
+    try:
+        from frame_pipeline import decode_frame
+        import numpy as np
+        import base64
+        import cv2
+        
+        dummy_frame = np.zeros((480, 640, 3), dtype=np.uint8)
+        jpeg = cv2.imencode('.jpg', dummy_frame)[1].tobytes()
+        data_url = 'data:image/jpeg;base64,' + base64.b64encode(jpeg).decode()
+        
+        gray, scale = decode_frame(jpeg)
+        legacy, _ = decode_frame(data_url)
+        reduced, reduced_scale = decode_frame(jpeg, reduction=4)
+        
+        if gray.shape == legacy.shape == (480, 640) and reduced.shape == (120, 160) and reduced_scale == 4:
+            print("✅ Frame decoding working")
+            return True
+        else:
+            print("❌ Frame decoding failed")
+            return False
+    except Exception as e:
+        print(f"❌ Frame decoding error: {e}")
+        return False
+
+def test_frame_scheduler():
+    """Test latest-frame-wins scheduling per session"""
+    try:
+        from frame_scheduler import FrameScheduler
+        
+        scheduler = FrameScheduler()
+        
+        # Only the first submit starts a worker; later frames replace the pending one
+        started = [scheduler.submit('session', frame) for frame in ('a', 'b', 'c')]
+        newest = scheduler.next_frame('session')
+        scheduler.mark_processed('session')
+        done = scheduler.next_frame('session') is None
+        stats = scheduler.get_stats('session')
+        
+        if started == [True, False, False] and newest == 'c' and done and stats['dropped'] == 2:
+            print("✅ Frame scheduler working")
+            print(f"Frame stats: {stats}")
+            return True
+        else:
+            print("❌ Frame scheduler failed")
+            return False
+    except Exception as e:
+        print(f"❌ Frame scheduler error: {e}")
+        return False
+
+def test_inference_executor():
+    """Test frame analysis in the thread pool executor"""
+    try:
+        from inference_executor import InferenceExecutor
+        import numpy as np
+        import cv2
+        
+        executor = InferenceExecutor(mode='thread', workers=2)
+        
+        dummy_frame = np.zeros((480, 640, 3), dtype=np.uint8)
+        jpeg = cv2.imencode('.jpg', dummy_frame)[1].tobytes()
+        result, tracker = executor.analyze(jpeg)
+        executor.shutdown()
+        
+        if isinstance(result.emotions, dict) and result.gray.shape == (480, 640):
+            print("✅ Inference executor working")
+            return True
+        else:
+            print("❌ Inference executor failed")
+            return False
+    except Exception as e:
+        print(f"❌ Inference executor error: {e}")
+        return False
+
+class FakeChunk:
+    """Response chunk with the same .text attribute as the Gemini client's"""
+    def __init__(self, text):
+        self.text = text
+
+class FakeStreamingModel:
+    """Local stand-in for the language model that streams fixed chunks"""
+    def __init__(self, chunks=("Hello", " there", "!")):
+        self.chunks = chunks
+    
+    def generate_content(self, prompt, stream=False):
+        if not stream:
+            return FakeChunk("".join(self.chunks))
+        return (FakeChunk(text) for text in self.chunks)
+
+def test_streaming_chat():
+    """Test streamed responses and cancellation against a fake model"""
+    try:
+        from conversation_ai import EmotionConversationAI
+        from llm_gateway import LLMGateway, StubBackend
+        from response_cache import ResponseCache
+        import threading
+        
+        conversation = EmotionConversationAI(FakeStreamingModel())
+        chunks = list(conversation.stream_response("hi", "happy", 0.8))
+        
+        # A cancelled stream stops after the chunk that was being read
+        cancel_event = threading.Event()
+        partial = []
+        for text in conversation.stream_response("hi", "happy", 0.8, cancel_event):
+            partial.append(text)
+            cancel_event.set()
+        
+        # Cancelled while the model produces the next chunk: nothing is
+        # cached, and the next request gets the whole response
+        cache = ResponseCache()
+        gateway = LLMGateway(StubBackend("one two three four", latency=0.4), timeout=2)
+        cached_conversation = EmotionConversationAI(gateway, cache)
+        cancel_event = threading.Event()
+        for text in cached_conversation.stream_response("hi", "happy", 0.8, cancel_event):
+            cancel_event.set()
+        uncached = cache.get(cache.make_key("hi", "happy", 0.8)) is None
+        full = ''.join(cached_conversation.stream_response("hi", "happy", 0.8))
+        
+        if (chunks == ["Hello", " there", "!"] and partial == ["Hello"] and uncached
+                and full == "one two three four" and gateway.get_stats()['cancelled'] == 1):
+            print("✅ Streaming chat working")
+            return True
+        else:
+            print("❌ Streaming chat failed")
+            return False
+    except Exception as e:
+        print(f"❌ Streaming chat error: {e}")
+        return False
+
+def test_response_cache():
+    """Test LRU + TTL eviction and key normalization of the response cache"""
+    try:
+        from response_cache import ResponseCache
+        
+        now = [0.0]
+        cache = ResponseCache(max_size=2, ttl=60, clock=lambda: now[0])
+        
+        # Punctuation and case are ignored; intensity is bucketed
+        key = cache.make_key("Hi!", "happy", 0.80)
+        same_key = cache.make_key("  hi ", "happy", 0.90)
+        cache.put(key, "Hello!")
+        cache.put(cache.make_key("hello", "happy", 0.8), "Hey!")
+        cache.put(cache.make_key("hey", "happy", 0.8), "Hi!")  # evicts "hi"
+        evicted = cache.get(same_key) is None
+        
+        now[0] = 61.0
+        expired = cache.get(cache.make_key("hey", "happy", 0.8)) is None
+        stats = cache.get_stats()
+        
+        if key == same_key and evicted and expired and stats['misses'] == 2:
+            print("✅ Response cache working")
+            print(f"Cache stats: {stats}")
+            return True
+        else:
+            print("❌ Response cache failed")
+            return False
+    except Exception as e:
+        print(f"❌ Response cache error: {e}")
+        return False
+
+def test_llm_gateway():
+    """Test coalescing, deadlines and the circuit breaker with a stub backend"""
+    try:
+        from llm_gateway import LLMGateway, StubBackend, CircuitBreaker, LLMTimeoutError, LLMUnavailableError
+        import threading
+        import time
+        
+        # Identical concurrent prompts share one backend call
+        backend = StubBackend(latency=0.2)
+        gateway = LLMGateway(backend, max_concurrency=2, timeout=2)
+        threads = [threading.Thread(target=gateway.generate, args=("same prompt",)) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        # A slow upstream times out, then the open circuit fails fast
+        slow = LLMGateway(StubBackend(latency=1.0), timeout=0.1,
+                          breaker=CircuitBreaker(failure_threshold=1, reset_timeout=60))
+        errors = []
+        for _ in range(2):
+            try:
+                slow.generate("hello")
+            except LLMUnavailableError as e:
+                errors.append(type(e))
+        
+        # Calls finishing after their timeout don't reset the failure count
+        late = LLMGateway(StubBackend(latency=0.3), timeout=0.1,
+                          breaker=CircuitBreaker(failure_threshold=3, reset_timeout=60))
+        late_errors = []
+        for i in range(4):
+            try:
+                late.generate(f"prompt {i}")
+            except (LLMTimeoutError, LLMUnavailableError) as e:
+                late_errors.append(type(e))
+            time.sleep(0.4)
+        late_stats = late.get_stats()
+        
+        if (backend.calls == 1 and errors == [LLMTimeoutError, LLMUnavailableError]
+                and late_errors == [LLMTimeoutError] * 3 + [LLMUnavailableError]
+                and late_stats['succeeded'] == 0 and late_stats['timeouts'] == 3
+                and late_stats['in_flight'] == 0 and late_stats['breaker_state'] == 'open'):
+            print("✅ LLM gateway working")
+            print(f"Gateway stats: {gateway.get_stats()}")
+            return True
+        else:
+            print("❌ LLM gateway failed")
+            return False
+    except Exception as e:
+        print(f"❌ LLM gateway error: {e}")
+        return False
+
+def test_seeded_simulation():
+    """Test that seeded detectors produce identical simulated output"""
+    try:
+        from frame_pipeline import FramePipeline
+        from benchmark import make_frame
+        import numpy as np
+        
+        frame = make_frame(640, 480, num_faces=1)
+        first = FramePipeline(seed=42).analyze_frame(frame)
+        second = FramePipeline(seed=42).analyze_frame(frame)
+        
+        if (len(first.faces) == 1 and first.emotions == second.emotions
+                and np.array_equal(first.landmarks, second.landmarks)):
+            print("✅ Seeded simulation working")
+            return True
+        else:
+            print("❌ Seeded simulation failed")
+            return False
+    except Exception as e:
+        print(f"❌ Seeded simulation error: {e}")
+        return False
+
+def test_emotion_history():
+    """Test the emotion ring buffer and its rolling aggregates"""
+    try:
+        from emotion_history import EmotionRingBuffer
+        import numpy as np
+        
+        history = EmotionRingBuffer(capacity=50, windows={'10s': 10})
+        for i in range(100):
+            # 5 samples per second; 'happy' dominates the most recent samples
+            probabilities = np.full(7, 0.1)
+            probabilities[3 if i >= 60 else 4] = 0.4
+            history.append(i * 0.2, probabilities)
+        
+        aggregates = history.aggregates()['10s']
+        timestamps, probabilities = history.query(limit=20, points=5)
+        
+        if (len(history) == 50 and aggregates['count'] == 50 and aggregates['dominant'] == 'happy'
+                and probabilities.shape == (5, 7)):
+            print("✅ Emotion history working")
+            return True
+        else:
+            print("❌ Emotion history failed")
+            return False
+    except Exception as e:
+        print(f"❌ Emotion history error: {e}")
+        return False
+
+def test_history_store():
+    """Test durable history writes and cursor pagination"""
+    try:
+        import tempfile
+        from history_store import HistoryStore
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            store = HistoryStore(os.path.join(tmp, 'history.db'), flush_interval=0.05)
+            for i in range(25):
+                store.record_emotion('s1', 1000.0 + i, {'happy': 0.6, 'neutral': 0.4})
+            store.record_chat('s1', 1000.0, "Hello", "Hi there", 'happy', 0.6)
+            store.flush()
+            
+            timestamps = []
+            cursor = None
+            while True:
+                page = store.emotion_page('s1', cursor, limit=10)
+                timestamps.extend(item['timestamp'] for item in page['items'])
+                cursor = page['next_cursor']
+                if cursor is None:
+                    break
+            summary = store.emotion_summary('s1', bucket=10)
+            chats = store.chat_page('s1')['items']
+            try:
+                store.emotion_page('s1', limit=0)
+                empty_page_rejected = False
+            except ValueError:
+                empty_page_rejected = True
+            store.close()
+        
+        if (timestamps == [1000.0 + i for i in reversed(range(25))] and summary['count'] == 25
+                and summary['dominant_counts'] == {'happy': 25} and len(summary['buckets']) == 3
+                and len(chats) == 1 and empty_page_rejected):
+            print("✅ History store working")
+            return True
+        else:
+            print("❌ History store failed")
+            return False
+    except Exception as e:
+        print(f"❌ History store error: {e}")
+        return False
+
+def test_payload_codec():
+    """Test the compact emotion_detected encoding"""
+    try:
+        from payload_codec import PayloadEncoder, dequantize_scores, unpack_landmarks
+        import numpy as np
+        
+        landmarks = np.random.default_rng(0).uniform(0, 640, size=(468, 2)).astype(np.float32)
+        faces = [{'landmarks': landmarks, 'face_rect': (10, 20, 100, 100)}]
+        emotions = {'happy': 0.6, 'neutral': 0.3, 'sad': 0.1}
+        
+        encoder = PayloadEncoder(landmark_threshold=1.0)
+        first = encoder.encode(emotions, faces)
+        still = encoder.encode(emotions, [dict(faces[0], landmarks=landmarks + 0.5)])
+        moved = encoder.encode(emotions, [dict(faces[0], landmarks=landmarks + 2.0)])
+        rects_only = PayloadEncoder(include_landmarks=False).encode(emotions, faces)
+        with_id = PayloadEncoder().encode(emotions, faces, frame_id=7)
+        
+        decoded = unpack_landmarks(first['faces'][0]['landmarks'])
+        scores = dequantize_scores(first['scores'])
+        
+        if (np.abs(decoded - landmarks).max() <= 0.125 and abs(scores['happy'] - 0.6) < 0.01
+                and 'landmarks' not in still['faces'][0] and 'landmarks' in moved['faces'][0]
+                and rects_only['faces'] == [{'rect': [10, 20, 100, 100]}]
+                and with_id['frame_id'] == 7 and 'frame_id' not in first):
+            print("✅ Payload codec working")
+            return True
+        else:
+            print("❌ Payload codec failed")
+            return False
+    except Exception as e:
+        print(f"❌ Payload codec error: {e}")
+        return False
+
+def test_scene_reuse():
+    """Test result reuse for near-static frames"""
+    try:
+        from frame_pipeline import FramePipeline, FaceTracker, SceneCache
+        import numpy as np
+        
+        clock = [0.0]
+        pipeline = FramePipeline(detect_scale=0.5)
+        tracker = FaceTracker(scene_cache=SceneCache(max_age=1.0, clock=lambda: clock[0]))
+        
+        frame = np.random.default_rng(0).integers(0, 255, (480, 640), dtype=np.uint8)
+        changed = frame.copy()
+        changed[100:200, 100:200] = 255
+        
+        first = pipeline.analyze_frame(frame, tracker)
+        still = pipeline.analyze_frame(frame, tracker)
+        moved = pipeline.analyze_frame(changed, tracker)
+        clock[0] = 2.0
+        expired = pipeline.analyze_frame(changed, tracker)
+        
+        if (not first.reused and still.reused and not moved.reused and not expired.reused
+                and tracker.scene_cache.get_stats() == {'hits': 1, 'misses': 3}):
+            print("✅ Scene reuse working")
+            return True
+        else:
+            print("❌ Scene reuse failed")
+            return False
+    except Exception as e:
+        print(f"❌ Scene reuse error: {e}")
+        return False
+
+def test_load_controller():
+    """Test capture settings adapting to processing latency"""
+    try:
+        from load_controller import LoadController
+        
+        clock = [0.0]
+        controller = LoadController(workers=2, cooldown=1.0, clock=lambda: clock[0])
+        initial = controller.settings('a')
+        
+        # Frames slower than the capture interval degrade the session, once per cooldown
+        changes = []
+        for _ in range(4):
+            clock[0] += 0.5
+            changes.append(controller.record('a', 0.3, sessions=1))
+        degraded = controller.settings('a')
+        
+        # Fast frames bring the quality back up
+        for _ in range(20):
+            clock[0] += 1.0
+            controller.record('a', 0.01, sessions=1)
+        
+        if (changes.count(None) == 2 and degraded['interval_ms'] > initial['interval_ms']
+                and controller.settings('a') == initial):
+            print("✅ Load controller working")
+            return True
+        else:
+            print("❌ Load controller failed")
+            return False
+    except Exception as e:
+        print(f"❌ Load controller error: {e}")
+        return False
+
+def test_multi_face_emotions():
+    """Test batched per-face emotion scoring"""
+    try:
+        from frame_pipeline import FramePipeline
+        from benchmark import make_frame
+        import numpy as np
+        
+        result = FramePipeline(seed=0).analyze_frame(make_frame(1280, 720, num_faces=3))
+        scores = result.face_emotions
+        
+        if (len(result.faces) == 3 and scores.shape == (3, 7)
+                and np.allclose(scores.sum(axis=1), 1.0, atol=1e-5)
+                and np.isclose(max(result.emotions.values()), scores[0].max())):
+            print("✅ Multi-face emotions working")
+            return True
+        else:
+            print("❌ Multi-face emotions failed")
+            return False
+    except Exception as e:
+        print(f"❌ Multi-face emotions error: {e}")
+        return False
+
+def test_dnn_emotion_backend():
+    """Test batched scoring with a tiny generated ONNX model"""
+    try:
+        import tempfile
+        import numpy as np
+        from emotion_backends import DnnBackend
+        from emotion_detector import EmotionDetector
+        from benchmark import write_tiny_emotion_model
+        
+        try:
+            import onnx  # noqa: F401
+        except ImportError:
+            print("⚠️ DNN emotion backend skipped (onnx not installed)")
+            return True
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            path = write_tiny_emotion_model(os.path.join(tmp, 'tiny_emotion.onnx'))
+            backend = DnnBackend(path, batch_size=2)
+            detector = EmotionDetector(backend=DnnBackend(path))
+            
+            gray = np.random.default_rng(0).integers(0, 255, (240, 320), dtype=np.uint8)
+            faces = np.array([[0, 0, 100, 100], [100, 50, 80, 80], [200, 100, 90, 90]])
+            scores = detector.detect_emotions_batch(gray, faces)
+            chunked = backend.predict(np.zeros((5, 48, 48), dtype=np.float32))
+        
+        if (scores.shape == (3, 7) and np.allclose(scores.sum(axis=1), 1.0, atol=1e-5)
+                and chunked.shape == (5, 7) and detector.backend.net is backend.net):
+            print("✅ DNN emotion backend working")
+            return True
+        else:
+            print("❌ DNN emotion backend failed")
+            return False
+    except Exception as e:
+        print(f"❌ DNN emotion backend error: {e}")
+        return False
+
+def test_overlay_rendering():
+    """Test vectorized landmark drawing against per-point cv2.circle"""
+    try:
+        import cv2
+        import numpy as np
+        from face_analyzer import FaceAnalyzer, stamp_points
+        
+        points = np.random.default_rng(0).uniform(-10, 330, size=(468, 2)).astype(np.float32)
+        expected = np.zeros((240, 320, 3), dtype=np.uint8)
+        for x, y in points.astype(np.int32).tolist():
+            cv2.circle(expected, (x, y), 3, (0, 255, 0), -1)
+        stamped = stamp_points(np.zeros_like(expected), points, 3, (0, 255, 0))
+        
+        analyzer = FaceAnalyzer(seed=0)
+        landmarks_data = analyzer.analyze_faces(np.array([[60, 40, 150, 150]]))
+        frame = np.zeros((240, 320, 3), dtype=np.uint8)
+        out = np.empty_like(frame)
+        overlay = analyzer.get_face_emotions_overlay(frame, landmarks_data, {'happy': 0.8, 'sad': 0.2}, out=out)
+        
+        if np.array_equal(stamped, expected) and overlay is out and out.any() and not frame.any():
+            print("✅ Overlay rendering working")
+            return True
+        else:
+            print("❌ Overlay rendering failed")
+            return False
+    except Exception as e:
+        print(f"❌ Overlay rendering error: {e}")
+        return False
+
+def test_mjpeg_stream():
+    """Test encode-once MJPEG fan-out to stream viewers"""
+    try:
+        from mjpeg_stream import MjpegBroadcaster, BOUNDARY
+        
+        broadcaster = MjpegBroadcaster(sleep=lambda seconds: None, idle_timeout=0.0)
+        viewer = broadcaster.stream('session')
+        broadcaster.publish('session', b'first')
+        first = next(viewer)
+        watching = broadcaster.has_viewers('session')
+        
+        # Frames published while the viewer is busy are skipped, not queued
+        broadcaster.publish('session', b'second')
+        broadcaster.publish('session', b'third')
+        latest = next(viewer)
+        viewer.close()
+        stats = broadcaster.get_stats()
+        
+        if (first.startswith(f"--{BOUNDARY}\r\n".encode()) and first.endswith(b"first\r\n")
+                and latest.endswith(b"third\r\n") and watching and not broadcaster.has_viewers('session')
+                and stats['sent'] == 2 and stats['skipped'] == 1 and stats['viewers'] == 0):
+            print("✅ MJPEG stream working")
+            return True
+        else:
+            print("❌ MJPEG stream failed")
+            return False
+    except Exception as e:
+        print(f"❌ MJPEG stream error: {e}")
+        return False
+
+def test_demo_pipeline():
+    """Test the threaded capture/analysis/display pipeline on a fake source"""
+    try:
+        from benchmark import make_frame
+        from demo import DemoPipeline, LatestQueue
+        
+        queue = LatestQueue()
+        queue.put(1)
+        queue.put(2)
+        queue.close()
+        latest, after_close = queue.get(), queue.get()
+        
+        class FakeCapture:
+            def __init__(self, frames):
+                self.frames = list(frames)
+            
+            def read(self):
+                if not self.frames:
+                    return False, None
+                return True, self.frames.pop(0)
+        
+        frames = [make_frame(320, 240, 1, seed=i) for i in range(10)]
+        pipeline = DemoPipeline(FakeCapture(frames), workers=2, frame_interval=0.01, seed=0)
+        pipeline.start()
+        shown = list(pipeline.frames())
+        pipeline.stop()
+        stats = pipeline.get_stats()
+        
+        if (latest == 2 and after_close is None and queue.dropped == 1
+                and stats['capture']['frames'] == 10
+                and len(shown) + stats['display']['dropped'] == 10
+                and stats['analysis']['frames'] >= 1 and shown[-1].shape == (240, 320, 3)):
+            print("✅ Demo pipeline working")
+            return True
+        else:
+            print("❌ Demo pipeline failed")
+            return False
+    except Exception as e:
+        print(f"❌ Demo pipeline error: {e}")
+        return False
+
+def test_metrics():
+    """Test histograms, stage timers, Prometheus rendering and the profiler"""
+    try:
+        import time
+        from metrics import MetricsRegistry, SamplingProfiler, StageTimer
+        
+        registry = MetricsRegistry(namespace='test')
+        stages = registry.histogram('stage_seconds', "Stage time", ['stage'], buckets=(0.01, 0.1))
+        errors = registry.counter('errors_total', "Errors")
+        registry.gauge('queue_depth', "Queue depth", function=lambda: 3)
+        
+        timer = StageTimer(stages)
+        timer.add({'decode': 0.05})
+        timer.mark('emit')
+        stages.observe(0.5, stage='decode')
+        errors.inc()
+        text = registry.render()
+        decode = stages.snapshot(stage='decode')
+        
+        profiler = SamplingProfiler(interval=0.001)
+        profiler.start()
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            pass
+        profiler.stop()
+        report = profiler.report()
+        
+        if (decode['count'] == 2 and decode['buckets'][0.1] == 1 and decode['buckets'][float('inf')] == 2
+                and 'test_stage_seconds_bucket{stage="decode",le="+Inf"} 2' in text
+                and 'test_stage_seconds_count{stage="emit"} 1' in text
+                and 'test_errors_total 1' in text and 'test_queue_depth 3' in text
+                and timer.timings['emit'] < 0.05 and profiler.samples > 0 and 'test_metrics' in report):
+            print("✅ Metrics working")
+            return True
+        else:
+            print("❌ Metrics failed")
+            return False
+    except Exception as e:
+        print(f"❌ Metrics error: {e}")
+        return False
+
+def test_model_registry():
+    """Test that models load once per thread, lazily, and warm up"""
+    try:
+        import threading
+        from emotion_detector import EmotionDetector
+        from face_analyzer import FaceAnalyzer
+        from frame_pipeline import FramePipeline
+        from llm_gateway import GeminiBackend
+        from model_registry import get_cascade
+        
+        pipeline = FramePipeline(EmotionDetector(seed=0), FaceAnalyzer(seed=0))
+        shared = pipeline.face_cascade is pipeline.face_analyzer.face_cascade is get_cascade()
+        
+        other_thread = []
+        thread = threading.Thread(target=lambda: other_thread.append(pipeline.face_cascade))
+        thread.start()
+        thread.join()
+        
+        pipeline.warm_up()
+        gemini = GeminiBackend(api_key='unused')
+        
+        if shared and other_thread[0] is not get_cascade() and gemini._model is None:
+            print("✅ Model registry working")
+            return True
+        else:
+            print("❌ Model registry failed")
+            return False
+    except Exception as e:
+        print(f"❌ Model registry error: {e}")
+        return False
+
+def test_session_store():
+    """Test Redis session histories against the in-memory ones"""
+    try:
+        import numpy as np
+        from emotion_history import SessionHistories
+        from redis_standin import RedisStandin
+        from session_store import RedisSessionHistories, SessionOwners, connect_redis
+        
+        try:
+            import redis  # noqa: F401
+        except ImportError:
+            print("⚠️ Session store skipped (redis not installed)")
+            return True
+        
+        standin = RedisStandin().start()
+        try:
+            client = connect_redis(standin.url)
+            shared = RedisSessionHistories(client, capacity=50, windows={'10s': 10})
+            local = SessionHistories(capacity=50, windows={'10s': 10})
+            for i in range(100):
+                probabilities = np.full(7, 0.1)
+                probabilities[3 if i >= 60 else 4] = 0.4
+                shared.emotions('s1').append(i * 0.2, probabilities)
+                local.emotions('s1').append(i * 0.2, probabilities)
+            shared.conversation('s1').append({'user_message': "Hello"})
+            
+            expected = local.emotions('s1').query(limit=20, points=5)
+            timestamps, probabilities = shared.emotions('s1').query(limit=20, points=5)
+            aggregates = shared.emotions('s1').aggregates()['10s']
+            conversation = list(shared.conversation('s1'))
+            
+            owners = SessionOwners(client, '1')
+            owners.claim('s1')
+            owner = owners.owner('s1')
+            shared.remove('s1')
+            removed = shared.emotions('s1', create=False) is None and shared.session_count() == 0
+        finally:
+            standin.stop()
+        
+        if (np.allclose(timestamps, expected[0]) and np.allclose(probabilities, expected[1])
+                and aggregates['count'] == 50 and aggregates['dominant'] == 'happy'
+                and conversation == [{'user_message': "Hello"}] and owner == '1' and removed):
+            print("✅ Session store working")
+            return True
+        else:
+            print("❌ Session store failed")
+            return False
+    except Exception as e:
+        print(f"❌ Session store error: {e}")
+        return False
+
+def test_load_test():
+    """Test the load tester's frame accounting and reports offline"""
+    try:
+        import cv2
+        import numpy as np
+        from loadtest import CameraClient, load_frames, percentiles
+        from metrics import resident_memory_bytes
+        
+        frames = load_frames(count=3, width=320, height=240)
+        decoded = [cv2.imdecode(np.frombuffer(frame, np.uint8), cv2.IMREAD_COLOR) for frame in frames]
+        
+        # Frames 0-2 sent, frame 1 replaced before processing
+        camera = CameraClient('http://127.0.0.1:1', frames, fps=10)
+        camera._sent_at = {0: 0.0, 1: 0.0, 2: 0.0}
+        camera.sent = 3
+        for frame_id in (0, 2):
+            camera._on_detected({'frame_id': frame_id})
+            camera._on_ack({'frame_id': frame_id})
+        camera._on_detected({'frame_id': 0})  # already acknowledged
+        
+        stats = percentiles([0.01, 0.02, 0.03, 0.04])
+        
+        if (all(image.shape == (240, 320, 3) for image in decoded)
+                and camera.acked == 2 and camera.detected == 2 and camera.sent - camera.acked == 1
+                and stats['count'] == 4 and abs(stats['p50'] - 25.0) < 1e-6 and stats['max'] == 40.0
+                and percentiles([]) == {'count': 0} and resident_memory_bytes() > 0):
+            print("✅ Load test working")
+            return True
+        else:
+            print("❌ Load test failed")
+            return False
+    except Exception as e:
+        print(f"❌ Load test error: {e}")
+        return False
+
+def test_batch_analysis():
+    """Test chunked batch analysis of an image directory"""
+    try:
+        import tempfile
+        import cv2
+        import numpy as np
+        import batch_analyze
+        from batch_analyze import analyze_source, plan_chunks, read_chunks
+        from benchmark import make_frame
+        from frame_pipeline import FramePipeline
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            frames_dir = os.path.join(tmp, 'frames')
+            os.makedirs(frames_dir)
+            for i in range(5):
+                cv2.imwrite(os.path.join(frames_dir, f'{i:03d}.jpg'), make_frame(320, 240, 1, seed=i))
+            
+            manifest = analyze_source(frames_dir, os.path.join(tmp, 'out'), stride=2, chunk_frames=2,
+                                      fps=10.0, pipeline=FramePipeline(seed=0))
+            chunks = list(read_chunks(os.path.join(tmp, 'out', 'frames.json')))
+            
+            # A video that doesn't report its length is still written a chunk at a time
+            count_frames = batch_analyze.count_frames
+            batch_analyze.count_frames = lambda source: None
+            try:
+                unknown = analyze_source(frames_dir, os.path.join(tmp, 'unknown'), chunk_frames=2,
+                                         fps=10.0, pipeline=FramePipeline(seed=0))
+            finally:
+                batch_analyze.count_frames = count_frames
+            unknown_chunks = list(read_chunks(os.path.join(tmp, 'unknown', 'frames.json')))
+        
+        frame_index = np.concatenate([chunk['frame_index'] for chunk in chunks])
+        timestamps = np.concatenate([chunk['timestamp'] for chunk in chunks])
+        face_emotions = np.concatenate([chunk['face_emotions'] for chunk in chunks])
+        
+        if (len(chunks) == 2 and manifest['frames'] == 3 and frame_index.tolist() == [0, 2, 4]
+                and np.allclose(timestamps, [0.0, 0.2, 0.4]) and manifest['faces'] == face_emotions.shape[0]
+                and face_emotions.shape[1] == 7 and plan_chunks(5, 2, 2) == [(0, 4), (4, 5)]
+                and [chunk['frames'] for chunk in unknown['chunks']] == [2, 2, 1]
+                and np.concatenate([chunk['frame_index'] for chunk in unknown_chunks]).tolist() == [0, 1, 2, 3, 4]):
+            print("✅ Batch analysis working")
+            return True
+        else:
+            print("❌ Batch analysis failed")
+            return False
+    except Exception as e:
+        print(f"❌ Batch analysis error: {e}")
+        return False
+
+def test_disconnect_cleanup():
+    """Test that a client leaving while its frame is analysed leaves no state behind"""
+    try:
+        import cv2
+        from benchmark import make_frame
+        
+        # The server without a language model or durable history
+        os.environ.setdefault('LLM_BACKEND', 'stub')
+        os.environ.setdefault('HISTORY_DB_PATH', '')
+        import app
+        
+        jpeg = cv2.imencode('.jpg', make_frame(320, 240, 1))[1].tobytes()
+        client = app.socketio.test_client(app.app)
+        
+        analyze = app.inference_executor.analyze
+        def disconnect_during_analysis(*args, **kwargs):
+            client.disconnect()
+            return analyze(*args, **kwargs)
+        app.inference_executor.analyze = disconnect_during_analysis
+        try:
+            client.emit('video_frame', {'image': jpeg, 'frame_id': 1})
+            for _ in range(500):
+                app.socketio.sleep(0.01)
+                if not app.frame_scheduler._active:
+                    break
+        finally:
+            app.inference_executor.analyze = analyze
+        
+        if (not app.face_trackers and not app.connected_sessions
+                and app.session_histories.session_count() == 0
+                and not app.load_controller.get_stats()['sessions']
+                and not app.frame_scheduler.get_stats()['sessions']
+                and not app.frame_scheduler._active):
+            print("✅ Disconnect cleanup working")
+            return True
+        else:
+            print("❌ Disconnect cleanup failed")
+            return False
+    except Exception as e:
+        print(f"❌ Disconnect cleanup error: {e}")
+        return False
+
+def test_stream_access():
+    """Test that annotated streams need a token, can be found and watched by
+    client session id, and that stats hide session ids"""
+    try:
+        import cv2
+        from benchmark import make_frame
+        
+        os.environ.setdefault('LLM_BACKEND', 'stub')
+        os.environ.setdefault('HISTORY_DB_PATH', '')
+        import app
+        
+        jpeg = cv2.imencode('.jpg', make_frame(320, 240, 1))[1].tobytes()
+        before = set(app.connected_sessions)
+        socket_client = app.socketio.test_client(app.app, auth={'session_id': 'watched-1234'})
+        sid = (app.connected_sessions - before).pop()
+        socket_client.emit('video_frame', {'image': b''})
+        http = app.app.test_client()
+        
+        token = app.MJPEG_STREAM_TOKEN
+        try:
+            app.MJPEG_STREAM_TOKEN = None
+            disabled = http.get('/stream/any.mjpg').status_code
+            app.MJPEG_STREAM_TOKEN = 'secret'
+            wrong_token = http.get('/stream/any.mjpg?token=guess').status_code
+            no_token = http.get('/stream/any.mjpg').status_code
+            unlisted = http.get('/api/streams').status_code
+            listed = http.get('/api/streams?token=secret').get_json()['sessions']
+            
+            # Open the session's stream (which waits for its first frame)
+            # while its client sends frames
+            streams = []
+            app.socketio.start_background_task(lambda: streams.append(
+                http.get('/stream/watched-1234.mjpg?token=secret', buffered=False)))
+            for frame_id in range(500):
+                if streams:
+                    break
+                if app.mjpeg_broadcaster.has_viewers('watched-1234'):
+                    socket_client.emit('video_frame', {'image': jpeg, 'frame_id': frame_id})
+                app.socketio.sleep(0.01)
+            stream = streams[0]
+            first_part = next(stream.iter_encoded())
+            stream.close()
+        finally:
+            app.MJPEG_STREAM_TOKEN = token
+        
+        frame_stats = http.get('/api/frame_stats').get_json()
+        load_stats = http.get('/api/load_stats').get_json()
+        socket_client.disconnect()
+        
+        if (disabled == 404 and wrong_token == 403 and no_token == 403 and unlisted == 403
+                and 'watched-1234' in listed and sid not in listed
+                and stream.status_code == 200 and first_part.startswith(b'--frame\r\nContent-Type: image/jpeg')
+                and isinstance(frame_stats['sessions'], list) and isinstance(load_stats['sessions'], list)
+                and len(load_stats['sessions']) >= 1 and sid not in str(frame_stats) + str(load_stats)):
+            print("✅ Stream access working")
+            return True
+        else:
+            print("❌ Stream access failed")
+            return False
+    except Exception as e:
+        print(f"❌ Stream access error: {e}")
+        return False
+
+def test_history_sessions():
+    """Test that history survives a reconnect under the client's session id"""
+    try:
+        import tempfile
+        import cv2
+        from benchmark import make_frame
+        from history_store import HistoryStore
+        
+        os.environ.setdefault('LLM_BACKEND', 'stub')
+        os.environ.setdefault('HISTORY_DB_PATH', '')
+        import app
+        
+        jpeg = cv2.imencode('.jpg', make_frame(320, 240, 1))[1].tobytes()
+        http = app.app.test_client()
+        store = app.history_store
+        with tempfile.TemporaryDirectory() as tmp:
+            app.history_store = HistoryStore(os.path.join(tmp, 'history.db'), flush_interval=0.05)
+            try:
+                # Two connections of the same browser, one after the other
+                for frame_id in range(2):
+                    client = app.socketio.test_client(app.app, auth={'session_id': 'browser-1234'})
+                    client.emit('video_frame', {'image': jpeg, 'frame_id': frame_id})
+                    for _ in range(500):
+                        app.socketio.sleep(0.01)
+                        if any(message['name'] == 'frame_ack' for message in client.get_received()):
+                            break
+                    client.disconnect()
+                app.history_store.flush()
+                
+                page = http.get('/api/emotion_history?session=browser-1234&page_size=10').get_json()
+                bad_cursor = http.get('/api/emotion_history?session=browser-1234&cursor=bad')
+                bad_start = http.get('/api/conversation_history?session=browser-1234&page_size=5&start=abc')
+                bad_end = http.get('/api/emotion_summary?session=browser-1234&end=abc')
+                bad_sizes = [http.get(f'/api/emotion_history?session=browser-1234&page_size={size}').status_code
+                             for size in ('0', '-3', '-20', 'abc', str(app.HISTORY_MAX_PAGE_SIZE + 1))]
+                largest = http.get(f'/api/emotion_history?session=browser-1234'
+                                   f'&page_size={app.HISTORY_MAX_PAGE_SIZE}').status_code
+            finally:
+                app.history_store.close()
+                app.history_store = store
+        
+        if (len(page['items']) == 2 and bad_cursor.status_code == 400 and 'error' in bad_cursor.get_json()
+                and bad_start.status_code == 400 and bad_end.status_code == 400
+                and bad_sizes == [400] * 5 and largest == 200
+                and not app.client_sessions and app.session_histories.session_count() == 0):
+            print("✅ History sessions working")
+            return True
+        else:
+            print("❌ History sessions failed")
+            return False
+    except Exception as e:
+        print(f"❌ History sessions error: {e}")
+        return False
+
+def test_chat_sessions():
+    """Test that history requests need a session and REST chat turns only
+    stored with one"""
+    try:
+        os.environ.setdefault('LLM_BACKEND', 'stub')
+        os.environ.setdefault('HISTORY_DB_PATH', '')
+        import app
+        
+        http = app.app.test_client()
+        missing = [http.get(path).status_code for path in
+                   ('/api/emotion_history', '/api/emotion_aggregates', '/api/conversation_history')]
+        
+        sessions = app.session_histories.session_count()
+        anonymous = http.post('/api/chat', json={'message': "Hello there"})
+        stored_anonymous = app.session_histories.session_count() - sessions
+        named = http.post('/api/chat', json={'message': "Hello again", 'session_id': 'rest-client-1'})
+        history = http.get('/api/conversation_history?session=rest-client-1').get_json()
+        bad_limits = [http.get(f'/api/conversation_history?session=rest-client-1&limit={limit}').status_code
+                      for limit in ('0', '-1', 'abc')]
+        bad_limits.append(http.get('/api/emotion_history?session=rest-client-1&points=0').status_code)
+        last = http.get('/api/conversation_history?session=rest-client-1&limit=1').get_json()
+        app.session_histories.remove('rest-client-1')
+        
+        if (missing == [400, 400, 400] and anonymous.status_code == 200 and stored_anonymous == 0
+                and named.status_code == 200 and [entry['user_message'] for entry in history] == ["Hello again"]
+                and bad_limits == [400] * 4 and len(last) == 1):
+            print("✅ Chat sessions working")
+            return True
+        else:
+            print("❌ Chat sessions failed")
+            return False
+    except Exception as e:
+        print(f"❌ Chat sessions error: {e}")
+        return False
+
 def main():
     """Run all tests"""
     print("🧪 Running component tests...")
@@ -67,7 +1114,36 @@ def main():
     tests = [
         ("Imports", test_imports),
         ("Emotion Detection", test_emotion_detection),
-        ("Face Analysis", test_face_analysis)
+        ("Face Analysis", test_face_analysis),
+        ("Frame Pipeline", test_frame_pipeline),
+        ("Face Tracking", test_face_tracking),
+        ("Landmark Arrays", test_landmark_arrays),
+        ("Frame Decoding", test_frame_decoding),
+        ("Frame Scheduler", test_frame_scheduler),
+        ("Inference Executor", test_inference_executor),
+        ("Streaming Chat", test_streaming_chat),
+        ("Response Cache", test_response_cache),
+        ("LLM Gateway", test_llm_gateway),
+        ("Seeded Simulation", test_seeded_simulation),
+        ("Emotion History", test_emotion_history),
+        ("History Store", test_history_store),
+        ("Payload Codec", test_payload_codec),
+        ("Scene Reuse", test_scene_reuse),
+        ("Load Controller", test_load_controller),
+        ("Multi-face Emotions", test_multi_face_emotions),
+        ("DNN Emotion Backend", test_dnn_emotion_backend),
+        ("Overlay Rendering", test_overlay_rendering),
+        ("MJPEG Stream", test_mjpeg_stream),
+        ("Demo Pipeline", test_demo_pipeline),
+        ("Metrics", test_metrics),
+        ("Model Registry", test_model_registry),
+        ("Session Store", test_session_store),
+        ("Load Test", test_load_test),
+        ("Batch Analysis", test_batch_analysis),
+        ("Disconnect Cleanup", test_disconnect_cleanup),
+        ("Stream Access", test_stream_access),
+        ("History Sessions", test_history_sessions),
+        ("Chat Sessions", test_chat_sessions)
     ]
     
     passed = 0